@@ -47,8 +47,11 @@ setup(
     entry_points={
       'console_scripts': [
         'plda_example_iris.py = xbob.paper.tpami2013.scripts.plda_example_iris:main',
+        'annotation_index.py = xbob.paper.tpami2013.scripts.annotation_index:main',
+        'face_cropping.py = xbob.paper.tpami2013.scripts.face_cropping:main',
         'lbph_extraction.py = xbob.paper.tpami2013.scripts.lbph_extraction:main',
         'lbph_features.py = xbob.paper.tpami2013.scripts.lbph_features:main',
+        'lbph_sweep.py = xbob.paper.tpami2013.scripts.lbph_sweep:main',
         'pca_train.py = xbob.paper.tpami2013.scripts.pca_train:main',
         'lda_train.py = xbob.paper.tpami2013.scripts.lda_train:main',
         'linear_project.py = xbob.paper.tpami2013.scripts.linear_project:main',
@@ -57,6 +60,8 @@ setup(
         'plda_enroll.py = xbob.paper.tpami2013.scripts.plda_enroll:main',
         'plda_scores.py = xbob.paper.tpami2013.scripts.plda_scores:main',
         'concatenate_scores.py = xbob.paper.tpami2013.scripts.concatenate_scores:main',
+        'concatenate_features.py = xbob.paper.tpami2013.scripts.concatenate_features:main',
+        'lbph_benchmark.py = xbob.paper.tpami2013.scripts.lbph_benchmark:main',
         'toolchain_plda.py = xbob.paper.tpami2013.scripts.toolchain_plda:main',
         'experiment_plda_subworld.py = xbob.paper.tpami2013.scripts.experiment_plda_subworld:main',
         'plot_figure2.py = xbob.paper.tpami2013.scripts.plot_figure2:main',
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Annotations of the Multi-PIE images, and their binary index.
+
+The index stores the eye positions of all the samples into a single (N,4)
+array, together with the (database) paths of the samples. It is built once
+by parsing the annotation files, and saved into a '.npz' file, from which
+it is then loaded by the extraction jobs instead of reading one small text
+file per image. Since the jobs run in parallel on the grid cannot update a
+shared index, it should be built before submitting them (see the
+annotation_index.py script).
+"""
+
+import os
+import numpy
+from . import utils
+
+# Labels of the frontal image annotations (in the order of the files)
+FRONTAL_LABELS = ['reye', 'leye', 'reyeo', 'reyei', 'leyei', 'leyeo', 'nose', 'mouthr', 'mouthl', 'lipt', 'lipb', 'chin', 'rbrowo', 'rbrowi', 'lbrowi', 'lbrowo']
+
+def parse(pos_input_k):
+  """Parse annotations in Multi-PIE format, and returns the positions of
+     the eyes as a (rh, rw, lh, lw) tuple"""
+
+  if not os.path.exists(pos_input_k):
+    raise IOError("The annotation file '%s' was not found" % pos_input_k)
+
+  f = open(pos_input_k, 'r')
+  annotations = {}
+  count = int(f.readline())
+
+  if count == 16:
+    # frontal image annotations
+    labels = FRONTAL_LABELS
+  else:
+    raise ValueError("The number %d of annotations in file '%s' is not handled." % (count, pos_input_k))
+
+  for i in range(count):
+    line = f.readline()
+    positions = line.split()
+    assert len(positions) == 2
+    annotations[labels[i]] = (float(positions[1]), float(positions[0]))
+  f.close()
+
+  rh = annotations['reye'][0]
+  rw = annotations['reye'][1]
+  lh = annotations['leye'][0]
+  lw = annotations['leye'][1]
+
+  return (rh, rw, lh, lw)
+
+
+class AnnotationIndex(object):
+  """Eye positions of a set of samples, retrieved using their path"""
+
+  def __init__(self, paths, eyes):
+    if len(paths) != eyes.shape[0]:
+      raise RuntimeError("The number of paths (%d) does not match the number of eye positions (%d)." % (len(paths), eyes.shape[0]))
+    self.paths = [str(p) for p in paths]
+    self.eyes = numpy.asarray(eyes, dtype=numpy.float64).reshape(-1, 4)
+    self.index = dict([(p, i) for i, p in enumerate(self.paths)])
+
+  def __len__(self):
+    return len(self.paths)
+
+  def __contains__(self, path):
+    return str(path) in self.index
+
+  def _rows(self, paths):
+    rows = []
+    for p in paths:
+      p = str(p)
+      if not p in self.index:
+        raise RuntimeError("Cannot find the annotations of sample %s in the index" % p)
+      rows.append(self.index[p])
+    return numpy.array(rows, dtype=numpy.int64)
+
+  def get(self, path):
+    """Returns the (rh, rw, lh, lw) eye positions of the sample with the given path"""
+    return tuple([float(v) for v in self.eyes[self._rows([path])[0]]])
+
+  def lookup(self, paths):
+    """Returns the eye positions of the samples with the given paths, as a
+       (N,4) array (one (rh, rw, lh, lw) row per sample)"""
+    return self.eyes[self._rows(paths)]
+
+
+def build(inputs_list, pos_input_dir, pos_input_ext):
+  """Builds the index of the given samples (database File objects) by
+     parsing their annotation files"""
+  eyes = numpy.ndarray(shape=(len(inputs_list), 4), dtype=numpy.float64)
+  for i, k in enumerate(inputs_list):
+    eyes[i] = parse(k.make_path(directory=pos_input_dir, extension=pos_input_ext))
+  return AnnotationIndex([k.path for k in inputs_list], eyes)
+
+def save(index, filename):
+  """Saves an index (atomically, since several jobs may try to write it)"""
+  utils.ensure_dir(os.path.dirname(filename))
+  tmp_filename = filename + '.tmp%d.npz' % os.getpid()
+  numpy.savez(tmp_filename, paths=numpy.array(index.paths), eyes=index.eyes)
+  os.rename(tmp_filename, filename)
+
+def load(filename):
+  """Loads an index"""
+  data = numpy.load(filename)
+  index = AnnotationIndex(data['paths'].tolist(), data['eyes'])
+  data.close()
+  return index
+
+def get(filename, inputs_list, pos_input_dir, pos_input_ext, force=False):
+  """Loads the index from the given file. It is first built (or completed
+     with the missing samples) and saved if required."""
+  if not force and os.path.exists(filename):
+    index = utils.cached_load(filename, load)
+  else:
+    index = AnnotationIndex([], numpy.ndarray(shape=(0, 4), dtype=numpy.float64))
+  # (the samples of several protocols may be given, with duplicates)
+  missing = dict([(k.path, k) for k in inputs_list if not k.path in index])
+  missing = [missing[p] for p in sorted(missing.keys())]
+  if len(missing) > 0:
+    print("Building the annotation index for %d sample(s)." % len(missing))
+    added = build(missing, pos_input_dir, pos_input_ext)
+    index = AnnotationIndex(index.paths + added.paths, numpy.vstack([index.eyes, added.eyes]))
+    save(index, filename)
+  return index
+
+def require(filename, inputs_list):
+  """Loads the index from the given file, checking that it contains the given
+     samples. This is used by the grid jobs, which only read the index."""
+  if not os.path.exists(filename):
+    raise RuntimeError("Cannot find the annotation index %s, which should be built before submitting the jobs (see annotation_index.py)." % filename)
+  index = utils.cached_load(filename, load)
+  missing = [k.path for k in inputs_list if not k.path in index]
+  if len(missing) > 0:
+    raise RuntimeError("The annotation index %s does not contain %d of the samples (e.g. %s), and should be completed before submitting the jobs (see annotation_index.py)." % (filename, len(missing), missing[0]))
+  return index
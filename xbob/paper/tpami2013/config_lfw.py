@@ -33,6 +33,8 @@ features_ext = '.hdf5'
 ## models and scores
 model_filename = 'model.hdf5'
 models_dir = 'models'
+model_bank_filename = 'model_bank.npy'
+protocol_index_filename = 'protocol_index.pkl'
 scores_nonorm_dir = 'scores'
 ## Algorithms
 ## PLDA
@@ -45,6 +47,8 @@ db = xbob.db.verification.filelist.Database('xbob/paper/tpami2013/protocol/lfw/'
 
 # PCA
 pca_n_outputs = 200
+## PCA method: 'svd' (all components, bob trainer), 'gram' or 'randomized' (leading components only)
+pca_method = 'svd'
 
 # PLDA
 plda_nf = 48 
@@ -25,12 +25,19 @@ import xbob.db.multipie
 ## features
 features_base_dir = 'features'
 lbph_features_dir = os.path.join(features_base_dir, 'lbph')
+lbph_sweep_dir = os.path.join(features_base_dir, 'lbph_sweep')
+crops_dir = os.path.join(features_base_dir, 'crops')
+annotation_index_filename = 'annotations.npz'
+stage_cache_dir = 'stage_cache'
+shared_features_dir = 'shared_features'
 features_projected_dir = 'lbph_projected'
 features_dir = os.path.join(features_base_dir, features_projected_dir)
 features_ext = '.hdf5'
 ## models and scores
 model_filename = 'model.hdf5'
 models_dir = 'models'
+model_bank_filename = 'model_bank.npy'
+protocol_index_filename = 'protocol_index.pkl'
 scores_nonorm_dir = 'scores'
 ## Algorithms
 ## PCA
@@ -74,6 +81,8 @@ block_ow = 4
 
 # PCA
 pca_n_outputs = 500
+## PCA method: 'svd' (all components, bob trainer), 'gram' or 'randomized' (leading components only)
+pca_method = 'svd'
 
 # LDA
 lda_n_outputs = 64
@@ -19,36 +19,296 @@
 import os
 import bob
 import numpy
-from . import utils
+import hashlib
+from . import utils, featurestore, annotations
 
-def _parse_annotations(pos_input_k):
-  """Parse annotations in Multi-PIE format"""
+# Engines available to compute the LBP histograms
+LBPH_ENGINES = ('bob', 'numpy')
 
-  if not os.path.exists(pos_input_k):
-    raise IOError("The annotation file '%s' was not found" % pos_input_k)
+def stage_key(*params):
+  """Returns a short key identifying the given parameters of a stage"""
+  return hashlib.md5(repr(params).encode('utf-8')).hexdigest()[:12]
 
-  f = open(pos_input_k, 'r')
-  annotations = {}
-  count = int(f.readline())
+def shared_features_dir(shared_dir, *extractor_params):
+  """Returns the directory of the features extracted with the given
+     parameters (the ones of LBPHExtractor, including the engine) in the
+     shared, protocol-independent, cache of features"""
+  return os.path.join(shared_dir, 'lbph-%s' % stage_key(*extractor_params))
 
-  if count == 16:
-    # frontal image annotations
-    labels = ['reye', 'leye', 'reyeo', 'reyei', 'leyei', 'leyeo', 'nose', 'mouthr', 'mouthl', 'lipt', 'lipb', 'chin', 'rbrowo', 'rbrowi', 'lbrowi', 'lbrowo']
-  else:
-    raise ValueError("The number %d of annotations in file '%s' is not handled." % (count, file_name))
 
-  for i in range(count):
-    line = f.readline()
-    positions = line.split()
-    assert len(positions) == 2
-    annotations[labels[i]] = (float(positions[1]), float(positions[0]))
+class StageCache(object):
+  """Cache of the intermediate results (cropped or preprocessed faces) of a
+     stage of the extraction. The results are stored as a feature store in a
+     subdirectory of the cache directory, named after the stage and a key
+     made from the parameters the stage depends on. The results computed by
+     an extractor are kept in memory until they are saved (see pop and
+     save_stage), such that the cache is only written by the main process."""
+
+  def __init__(self, cache_dir, stage, params, dtype=numpy.float64):
+    self.store_dir = os.path.join(cache_dir, '%s-%s' % (stage, stage_key(*params)))
+    self.dtype = dtype
+    self.store = None
+    if featurestore.is_feature_store(self.store_dir):
+      self.store = featurestore.FeatureStore(self.store_dir)
+    self.new_paths = []
+    self.new_data = []
+
+  def __contains__(self, path):
+    return self.store is not None and path in self.store
+
+  def load(self, paths):
+    """Loads the cached results of the given samples (flattened, one row per sample)"""
+    return self.store.load(paths)
+
+  def add(self, paths, data):
+    """Records the results of the given samples"""
+    self.new_paths.extend([str(p) for p in paths])
+    self.new_data.append(numpy.array(data, dtype=self.dtype).reshape(len(paths), -1))
+
+  def pop(self):
+    """Returns the new results as a (store_dir, paths, data, dtype) tuple,
+       and forgets them"""
+    if len(self.new_paths) == 0:
+      return None
+    entry = (self.store_dir, self.new_paths, numpy.vstack(self.new_data), self.dtype)
+    self.new_paths = []
+    self.new_data = []
+    return entry
+
+def save_stage(entries):
+  """Saves the new results of a stage cache (as returned by StageCache.pop)
+     as a new shard of its store, named after the paths of the samples"""
+  entries = [e for e in entries if e is not None]
+  if len(entries) == 0:
+    return
+  (store_dir, dtype) = (entries[0][0], entries[0][3])
+  paths = sum([e[1] for e in entries], [])
+  data = numpy.vstack([e[2] for e in entries])
+  shard_id = hashlib.md5('\n'.join(paths).encode('utf-8')).hexdigest()[:12]
+  featurestore.save_shard(store_dir, shard_id, paths, data, dtype)
+
+class FaceCropper(object):
+  """Loads images and crops the faces given the positions of the eyes. The
+     faces are either cropped image by image with bob ('bob' engine), or
+     for a whole batch of images with NumPy ('numpy' engine). If a
+     directory with a feature store of cropped faces is given, the faces are
+     read from there (using the database path of the samples) instead. If
+     the filename of an annotation index is given, the eye positions are
+     retrieved from the index (using the database path of the samples)
+     rather than parsed from the annotation files."""
+
+  def __init__(self, crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow, engine='bob', crops_dir=None, annotation_index=None):
+    self.crop_h = crop_h
+    self.crop_w = crop_w
+    if engine == 'bob':
+      self.fen = bob.ip.FaceEyesNorm( crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow)
+    elif engine == 'numpy':
+      from . import facenorm
+      self.fen = facenorm.FaceEyesNorm( crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow)
+    else:
+      raise RuntimeError("Unknown LBPH engine '%s'." % engine)
+    self.engine = engine
+    self.crops = None
+    if crops_dir is not None:
+      self.crops = featurestore.FeatureStore(crops_dir)
+    self.annotations = None
+    if annotation_index is not None:
+      self.annotations = utils.cached_load(annotation_index, annotations.load)
+
+  def load(self, img_input_k):
+    """Loads an image, and converts it to grayscale if required"""
+    img_unk = bob.io.load( str(img_input_k) )
+    if(img_unk.ndim == 3):
+      return bob.ip.rgb_to_gray(img_unk)
+    return img_unk
+
+  def __call__(self, samples, out=None):
+    """Crops the faces of a list of (image, annotation) filenames (or of
+       (sample path, None) if the faces are read from a feature store, or of
+       (image, sample path) if the annotations are read from the index), and
+       returns them as a 3D array"""
+    if out is None:
+      out = numpy.ndarray(shape=(len(samples), self.crop_h, self.crop_w), dtype=numpy.float64)
+    if self.crops is not None:
+      out.reshape(len(samples), -1)[:] = self.crops.load([s[0] for s in samples])
+      return out
+    images = []
+    if self.annotations is not None:
+      eyes = self.annotations.lookup([s[1] for s in samples])
+    else:
+      eyes = numpy.ndarray(shape=(len(samples), 4), dtype=numpy.float64)
+    for i, (img_input_k, pos_input_k) in enumerate(samples):
+      print("Cropping face from sample %s." % (img_input_k))
+      images.append(self.load(img_input_k))
+      if self.annotations is None: eyes[i] = annotations.parse(pos_input_k)
+    if self.engine == 'numpy':
+      return self.fen(images, eyes, out)
+    for i in range(len(samples)):
+      self.fen(images[i], out[i], eyes[i,0], eyes[i,1], eyes[i,2], eyes[i,3])
+    return out
+
+
+class LBPHExtractor(object):
+  """Extracts LBP histograms features from images, given the positions of
+     the eyes. The processors (cropper, Tan and Triggs preprocessing and
+     LBPHS) and the intermediate arrays are allocated once, and reused for
+     all the images. The cropping, the Tan and Triggs preprocessing and the
+     LBP histograms are either computed image by image with bob ('bob'
+     engine), or for a whole batch of images with NumPy ('numpy' engine)."""
+
+  def __init__(self,
+               crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow,       # cropping
+               gamma, sigma0, sigma1, size, threshold, alpha,       # Tan Triggs
+               radius, p_n, circular, to_average, add_average_bit,  # LBP
+               uniform, rot_inv,
+               block_h, block_w, block_oh, block_ow,                # Histogram
+               engine='bob', crops_dir=None, annotation_index=None, cache_dir=None):
+    # Initializes cropper
+    self.crop_h = crop_h
+    self.crop_w = crop_w
+    self.cropper = FaceCropper( crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow, engine, crops_dir, annotation_index)
+
+    # Initializes the caches of the cropped and preprocessed faces, which are
+    # keyed on the parameters of their stage (and of the previous ones)
+    self.caches = None
+    if cache_dir is not None:
+      crop_params = (engine, crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow)
+      tt_params = crop_params + (gamma, sigma0, sigma1, size, threshold, alpha)
+      self.caches = {'crop': StageCache(cache_dir, 'crop', crop_params),
+                     'preprocessed': StageCache(cache_dir, 'preprocessed', tt_params, numpy.uint8)}
+
+    # Initializes the Tan and Triggs preprocessing
+    self.threshold = threshold
+    self.preprocessed_img = numpy.ndarray(shape=(crop_h, crop_w), dtype=numpy.float64)
+
+    # Initializes LBPHS processor
+    if engine == 'bob':
+      self.tt = bob.ip.TanTriggs( gamma, sigma0, sigma1, size, threshold, alpha)
+    elif engine == 'numpy':
+      from . import tantriggs
+      self.tt = tantriggs.TanTriggs( gamma, sigma0, sigma1, size, threshold, alpha)
+    else:
+      raise RuntimeError("Unknown LBPH engine '%s'." % engine)
+    self.engine = engine
+    self.lbphs = self.lbphs_processor( radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv, block_h, block_w, block_oh, block_ow)
+
+  def preprocess(self, cropped, out):
+    """Preprocesses a stack of cropped faces using Tan and Triggs. The result
+       is written (as uint8) into the given 3D array."""
+    if self.engine == 'numpy':
+      return self.tt(cropped, out)
+    for i in range(cropped.shape[0]):
+      self.tt(cropped[i], self.preprocessed_img)
+      out[i] = bob.core.convert(self.preprocessed_img, dtype=numpy.uint8, source_range=(-self.threshold,self.threshold))
+    return out
+
+  def lbphs_processor(self, radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv, block_h, block_w, block_oh, block_ow):
+    """Returns a LBPHS processor of the engine of the extractor"""
+    if self.engine == 'numpy':
+      from . import lbp
+      return lbp.LBPHS( block_h, block_w, block_oh, block_ow, radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv)
+    return bob.ip.LBPHSFeatures( block_h, block_w, block_oh, block_ow, radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv)
+
+  def lbph(self, preprocessed, out=None, lbphs=None):
+    """Computes the LBP histograms of a stack of preprocessed images, and
+       returns them as a 2D array (one row per image). Another LBPHS
+       processor than the one of the extractor may be given."""
+    if lbphs is None: lbphs = self.lbphs
+    if self.engine == 'numpy':
+      return lbphs(preprocessed, out)
+    for i in range(preprocessed.shape[0]):
+      lbphs_blocks = lbphs(preprocessed[i])
+      if out is None:
+        out = numpy.ndarray(shape=(preprocessed.shape[0], sum([b.shape[0] for b in lbphs_blocks])), dtype=numpy.float64)
+      # Concatenates the block histograms directly into the output array
+      offset = 0
+      for b in lbphs_blocks:
+        out[i,offset:offset+b.shape[0]] = b
+        offset += b.shape[0]
+    return out
+
+  def _cached(self, stage, indices, paths):
+    """Splits the given indices of samples into the ones which are in the
+       cache of the stage and the other ones"""
+    if self.caches is None or paths is None:
+      return ([], indices)
+    hit = [i for i in indices if paths[i] in self.caches[stage]]
+    return (hit, [i for i in indices if not paths[i] in self.caches[stage]])
+
+  def preprocessed(self, samples, paths=None):
+    """Returns the cropped and preprocessed faces of a list of (image,
+       annotation) filenames, as a 3D uint8 array. If the (database) paths
+       of the samples are given and the extractor has a cache, each sample
+       starts from its deepest cached result."""
+    n = len(samples)
+    preprocessed = numpy.ndarray(shape=(n, self.crop_h, self.crop_w), dtype=numpy.uint8)
+    (hit, todo) = self._cached('preprocessed', list(range(n)), paths)
+    if len(hit) > 0:
+      preprocessed[hit] = self.caches['preprocessed'].load([paths[i] for i in hit]).reshape(len(hit), self.crop_h, self.crop_w)
+    if len(todo) > 0:
+      cropped = numpy.ndarray(shape=(len(todo), self.crop_h, self.crop_w), dtype=numpy.float64)
+      (hit, crop) = self._cached('crop', list(range(len(todo))), [paths[i] for i in todo] if paths is not None else None)
+      if len(hit) > 0:
+        cropped[hit] = self.caches['crop'].load([paths[todo[j]] for j in hit]).reshape(len(hit), self.crop_h, self.crop_w)
+      if len(crop) > 0:
+        cropped[crop] = self.cropper([samples[todo[j]] for j in crop])
+        if self.caches is not None and paths is not None:
+          self.caches['crop'].add([paths[todo[j]] for j in crop], cropped[crop])
+      preprocessed[todo] = self.preprocess(cropped, numpy.ndarray(shape=cropped.shape, dtype=numpy.uint8))
+      if self.caches is not None and paths is not None:
+        self.caches['preprocessed'].add([paths[i] for i in todo], preprocessed[todo])
+    return preprocessed
+
+  def extract(self, samples, out=None, paths=None):
+    """Extracts the features of a list of (image, annotation) filenames
+       (see preprocessed for the use of the paths of the samples)"""
+    return self.lbph(self.preprocessed(samples, paths), out)
 
-  rh = annotations['reye'][0]
-  rw = annotations['reye'][1]
-  lh = annotations['leye'][0]
-  lw = annotations['leye'][1]
+  def pop_cache(self):
+    """Returns the new entries of the stage caches (see save_stage)"""
+    if self.caches is None:
+      return {}
+    return dict([(stage, c.pop()) for stage, c in self.caches.items()])
 
-  return (rh, rw, lh, lw)
+  def __call__(self, img_input_k, pos_input_k):
+    """Extracts the features of the given image, using its annotations"""
+    return self.extract([(img_input_k, pos_input_k)])[0]
+
+  def process(self, tasks):
+    """Extracts the features of a list of (image, annotation, features,
+       path) tasks. The features are saved into their file if given, and
+       returned as a 2D array otherwise."""
+    data = self.extract([(t[0], t[1]) for t in tasks], paths=[t[3] for t in tasks])
+    if all([t[2] is None for t in tasks]):
+      return data
+    for (img_input_k, pos_input_k, features_k, path), lbphs_array in zip(tasks, data):
+      utils.ensure_dir(os.path.dirname(str(features_k)))
+      bob.io.save(lbphs_array, str(features_k))
+
+
+# Extractor of the current worker process (see extract_lbph)
+_worker_extractor = None
+
+def _init_worker(extractor_params):
+  """Builds the extractor of a worker process"""
+  global _worker_extractor
+  _worker_extractor = LBPHExtractor(*extractor_params)
+
+def _process_worker(tasks):
+  """Processes a block of samples in a worker process, and returns the
+     results together with the new entries of the stage caches"""
+  return (_worker_extractor.process(tasks), _worker_extractor.pop_cache())
+
+
+def _sample_inputs(k, img_input_dir, img_input_ext, pos_input_dir, pos_input_ext, crops_dir, annotation_index):
+  """Returns the (image, annotation) inputs of the extractor for a sample"""
+  if crops_dir is not None:
+    # The cropped faces are retrieved from their store using the database path
+    return (k.path, None)
+  img_input_k = k.make_path(directory=img_input_dir, extension=img_input_ext)
+  if annotation_index is not None:
+    return (img_input_k, k.path)
+  return (img_input_k, k.make_path(directory=pos_input_dir, extension=pos_input_ext))
 
 def extract_lbph(inputs_list, # File objects from the database
                  img_input_dir, img_input_ext, # images
@@ -59,23 +319,52 @@ def extract_lbph(inputs_list, # File objects from the database
                  radius, p_n, circular, to_average, add_average_bit,  # LBP
                  uniform, rot_inv,
                  block_h, block_w, block_oh, block_ow,                # Histogram
-                 force):
+                 force, store_shard=None, n_processes=1, engine='bob', batch_size=1, crops_dir=None,
+                 annotation_index=None, cache_dir=None):
+  """Extracts LBP histograms features. If store_shard is set, the features
+     are saved as the shard with this id of a feature store located in
+     features_dir, rather than into one file per sample (the samples which
+     are already in another shard of the store are skipped, unless force is
+     set, such that stores can be shared by several protocols). The samples are
+     processed by blocks of batch_size samples. If n_processes is larger
+     than one, the blocks are distributed to this number of worker
+     processes, each of them having its own extractor. If crops_dir is set,
+     the cropped faces are read from this feature store (see crop_faces)
+     instead of being computed from the images. If annotation_index is set,
+     the eye positions are read from this index file (see the annotations
+     module) rather than from the annotation files. If cache_dir is set, the
+     cropped and preprocessed faces are cached there (see StageCache), and
+     reused by the extractions with different LBP parameters."""
 
-  # Initializes cropper and destination array
-  fen = bob.ip.FaceEyesNorm( crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow)
-  cropped_img = numpy.ndarray(shape=(crop_h,crop_w), dtype=numpy.float64)
+  # Checks if the shard of the feature store has already been computed
+  if store_shard is not None:
+    if force == True and featurestore.shard_exists(features_dir, store_shard):
+      print("Remove old features shard %s." % featurestore.shard_name(store_shard))
+      featurestore.erase_shard(features_dir, store_shard)
+    if featurestore.shard_exists(features_dir, store_shard):
+      print("Features shard %s already exists." % featurestore.shard_name(store_shard))
+      return
 
-  # Initializes the Tan and Triggs preprocessing
-  tt = bob.ip.TanTriggs( gamma, sigma0, sigma1, size, threshold, alpha)
-  preprocessed_img = numpy.ndarray(shape=(crop_h, crop_w), dtype=numpy.float64)
+  extractor_params = (crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow,
+                      gamma, sigma0, sigma1, size, threshold, alpha,
+                      radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv,
+                      block_h, block_w, block_oh, block_ow, engine, crops_dir, annotation_index, cache_dir)
 
-  # Initializes LBPHS processor
-  lbphs = bob.ip.LBPHSFeatures( block_h, block_w, block_oh, block_ow, radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv)
+  # Samples already extracted in the other shards of the store
+  store = None
+  if store_shard is not None and force == False and featurestore.is_feature_store(features_dir):
+    store = featurestore.FeatureStore(features_dir)
 
-  # Processes the 'dictionary of files'
+  # Lists the samples to process
+  tasks = []
   for k in inputs_list: # Loops over the database File objects
-    img_input_k = k.make_path(directory=img_input_dir, extension=img_input_ext)
-    pos_input_k = k.make_path(directory=pos_input_dir, extension=pos_input_ext)
+    (img_input_k, pos_input_k) = _sample_inputs(k, img_input_dir, img_input_ext, pos_input_dir, pos_input_ext, crops_dir, annotation_index)
+    if store_shard is not None:
+      if store is not None and k.path in store:
+        print("Features for sample %s already exists."  % (img_input_k))
+      else:
+        tasks.append((img_input_k, pos_input_k, None, k.path))
+      continue
     features_k = k.make_path(directory=features_dir, extension=features_ext)
     if force == True and os.path.exists(features_k):
       print("Remove old features %s." % (features_k))
@@ -84,33 +373,130 @@ def extract_lbph(inputs_list, # File objects from the database
     if os.path.exists(features_k):
       print("Features for sample %s already exists."  % (img_input_k))
     else:
-      print("Computing features from sample %s." % (img_input_k))
-
-      # Loads image file
-      img_unk = bob.io.load( str(img_input_k) )
-      
-      # Converts to grayscale
-      if(img_unk.ndim == 3):
-        img = bob.ip.rgb_to_gray(img_unk)
-      else:
-        img = img_unk
+      tasks.append((img_input_k, pos_input_k, features_k, k.path))
 
-      # Parse annotations
-      rh, rw, lh, lw = _parse_annotations(pos_input_k)
+  # Processes the blocks of samples (the results are in the same order as the tasks)
+  blocks = utils.split_list(tasks, max(1, batch_size))
+  if n_processes > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(n_processes, _init_worker, (extractor_params,))
+    results = pool.imap(_process_worker, blocks)
+  else:
+    extractor = LBPHExtractor(*extractor_params)
+    results = ((extractor.process(block), extractor.pop_cache()) for block in blocks)
+  store_data = []
+  cache_entries = {}
+  for (r, entries) in results:
+    if r is not None: store_data.append(r)
+    for stage, e in entries.items():
+      cache_entries.setdefault(stage, []).append(e)
+  if n_processes > 1:
+    pool.close()
+    pool.join()
 
-      # Extracts and crops a face 
-      fen(img, cropped_img, rh, rw, lh, lw) 
-       
-      # Preprocesses a face using Tan and Triggs
-      tt(cropped_img, preprocessed_img)
-      preprocessed_img_s = bob.core.convert(preprocessed_img, dtype=numpy.uint8, source_range=(-threshold,threshold))
+  # Saves the new cropped and preprocessed faces into the stage caches
+  for entries in cache_entries.values():
+    save_stage(entries)
 
-      # Computes LBP histograms
-      lbphs_blocks = lbphs(preprocessed_img_s)
-      lbphs_array = numpy.hstack(lbphs_blocks).astype(numpy.float64)
+  # Saves the features of all the (new) samples into a single shard
+  if store_shard is not None and len(store_data) > 0:
+    featurestore.save_shard(features_dir, store_shard, [t[3] for t in tasks], numpy.vstack(store_data))
 
-      # Saves to file
-      utils.ensure_dir(os.path.dirname(str(features_k)))
-      bob.io.save(lbphs_array, str(features_k))
 
 
+def sweep_lbph(inputs_list, # File objects from the database
+               img_input_dir, img_input_ext, # images
+               pos_input_dir, pos_input_ext, # annotations
+               features_dirs, # feature stores (output), one per LBP configuration
+               crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow,       # cropping
+               gamma, sigma0, sigma1, size, threshold, alpha,       # Tan Triggs
+               lbp_configs, # list of (radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv, block_h, block_w, block_oh, block_ow)
+               force, store_shard=0, engine='bob', batch_size=1, crops_dir=None,
+               annotation_index=None, cache_dir=None):
+  """Extracts LBP histograms features for several LBP configurations at
+     once. Each image is loaded, cropped and preprocessed only once, and
+     the LBP histograms of all the configurations are then computed from
+     the preprocessed faces, one configuration after the other. The
+     features of each configuration are saved as the shard with the given
+     id of its feature store before the next configuration is processed.
+     The other options are the ones of extract_lbph."""
+
+  if len(features_dirs) != len(lbp_configs):
+    raise RuntimeError("The number of feature directories (%d) does not match the number of LBP configurations (%d)." % (len(features_dirs), len(lbp_configs)))
+
+  # Checks which configurations have already been computed
+  todo = []
+  for features_dir, lbp_config in zip(features_dirs, lbp_configs):
+    if force == True and featurestore.shard_exists(features_dir, store_shard):
+      print("Remove old features shard %s of %s." % (featurestore.shard_name(store_shard), features_dir))
+      featurestore.erase_shard(features_dir, store_shard)
+    if featurestore.shard_exists(features_dir, store_shard):
+      print("Features shard %s of %s already exists." % (featurestore.shard_name(store_shard), features_dir))
+    else:
+      todo.append((features_dir, tuple(lbp_config)))
+  if len(todo) == 0 or len(inputs_list) == 0:
+    return
+
+  # The extractor preprocesses the faces, and one LBPHS processor is used per configuration
+  extractor = LBPHExtractor(crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow,
+                            gamma, sigma0, sigma1, size, threshold, alpha,
+                            *todo[0][1], engine=engine, crops_dir=crops_dir,
+                            annotation_index=annotation_index, cache_dir=cache_dir)
+  processors = [extractor.lbphs_processor(*lbp_config) for (features_dir, lbp_config) in todo]
+
+  samples = [_sample_inputs(k, img_input_dir, img_input_ext, pos_input_dir, pos_input_ext, crops_dir, annotation_index) for k in inputs_list]
+  paths = [k.path for k in inputs_list]
+  blocks = utils.split_list(list(range(len(samples))), max(1, batch_size))
+
+  # Preprocesses all the faces once (as uint8, which is much smaller than
+  # the LBP histograms of a single configuration)
+  preprocessed = numpy.ndarray(shape=(len(samples), crop_h, crop_w), dtype=numpy.uint8)
+  for block in blocks:
+    preprocessed[block[0]:block[-1]+1] = extractor.preprocessed([samples[i] for i in block], [paths[i] for i in block])
+  for entry in extractor.pop_cache().values():
+    save_stage([entry])
+
+  # Computes and saves the features of one configuration at a time, such
+  # that only the features of a single configuration are kept in memory
+  for (features_dir, lbp_config), lbphs in zip(todo, processors):
+    data = None
+    for block in blocks:
+      features = extractor.lbph(preprocessed[block[0]:block[-1]+1], lbphs=lbphs)
+      if data is None:
+        data = numpy.ndarray(shape=(len(samples), features.shape[1]), dtype=numpy.float64)
+      data[block[0]:block[-1]+1] = features
+    featurestore.save_shard(features_dir, store_shard, paths, data)
+    del data
+
+
+def crop_faces(inputs_list, # File objects from the database
+               img_input_dir, img_input_ext, # images
+               pos_input_dir, pos_input_ext, # annotations
+               crops_dir, # cropped faces (output)
+               crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow, # cropping
+               force, store_shard=0, engine='bob', batch_size=1, annotation_index=None):
+  """Crops the faces of the given samples, and saves them (as flattened
+     rows) as the shard with the given id of a feature store located in
+     crops_dir. This store can then be given to extract_lbph, such that
+     the images are not loaded and cropped again for each extraction. If
+     annotation_index is set, the eye positions are read from this index."""
+
+  # Checks if the shard of the store has already been computed
+  if force == True and featurestore.shard_exists(crops_dir, store_shard):
+    print("Remove old cropped faces shard %s." % featurestore.shard_name(store_shard))
+    featurestore.erase_shard(crops_dir, store_shard)
+  if featurestore.shard_exists(crops_dir, store_shard):
+    print("Cropped faces shard %s already exists." % featurestore.shard_name(store_shard))
+    return
+
+  cropper = FaceCropper(crop_eyes_d, crop_h, crop_w, crop_oh, crop_ow, engine, annotation_index=annotation_index)
+  if annotation_index is not None:
+    samples = [(k.make_path(directory=img_input_dir, extension=img_input_ext), k.path) for k in inputs_list]
+  else:
+    samples = [(k.make_path(directory=img_input_dir, extension=img_input_ext), k.make_path(directory=pos_input_dir, extension=pos_input_ext)) for k in inputs_list]
+  data = numpy.ndarray(shape=(len(samples), crop_h * crop_w), dtype=numpy.float64)
+  offset = 0
+  for block in utils.split_list(samples, max(1, batch_size)):
+    cropper(block, data[offset:offset+len(block)].reshape(len(block), crop_h, crop_w))
+    offset += len(block)
+  featurestore.save_shard(crops_dir, store_shard, [k.path for k in inputs_list], data)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Consolidated feature store.
+
+A feature store is a directory containing one or several shards. Each shard
+consists of a 2D NumPy array (one sample per row) saved in the '.npy' format,
+and of a text index with the (database) path of the sample of each row::
+
+  store_dir/shard-0000.npy
+  store_dir/shard-0000.lst
+  store_dir/shard-0001.npy
+  ...
+
+Shards are written independently (e.g. one per SGE array job), and may be
+concatenated afterwards into a single contiguous matrix (shard-merged).
+Shards are read as memory maps, such that only the required rows are loaded
+from the disk.
+
+A store may also be read through a view, that is a directory only
+containing a small descriptor with the location of the store and a number
+of columns. The samples of a view are the leading columns of the ones of
+the store (e.g. the projections onto the leading components of a PCA
+subspace), which are hence never copied::
+
+  view_dir/view.txt
+"""
+
+import os
+import glob
+import numpy
+from . import utils
+
+SHARD_PREFIX = 'shard-'
+DATA_EXT = '.npy'
+INDEX_EXT = '.lst'
+VIEW_FILENAME = 'view.txt'
+# Id of the shard resulting from the concatenation of a store
+MERGED_SHARD_ID = 'merged'
+
+def shard_name(shard_id):
+  """Returns the base name of the shard with the given id"""
+  return SHARD_PREFIX + str(shard_id).zfill(4)
+
+def _shard_basenames(store_dir):
+  """Returns the (sorted) list of the shards of a store, without extension"""
+  indices = sorted(glob.glob(os.path.join(store_dir, SHARD_PREFIX + '*' + INDEX_EXT)))
+  return [f[:-len(INDEX_EXT)] for f in indices]
+
+def _shards_by_age(store_dir):
+  """Returns the list of the shards of a store (without extension), from the
+     oldest to the most recently written one. When several shards contain
+     the same sample (e.g. a shard rewritten after a concatenation), the
+     most recently written one wins."""
+  bases = _shard_basenames(store_dir)
+  # The index of a shard is written last, when the shard is complete
+  return sorted(bases, key=lambda base: (os.path.getmtime(base + INDEX_EXT), base))
+
+def is_view(dirname):
+  """Checks if the given directory contains a view of a feature store"""
+  return os.path.exists(os.path.join(dirname, VIEW_FILENAME))
+
+def is_feature_store(dirname):
+  """Checks if the given directory contains a feature store (or a view)"""
+  return os.path.isdir(dirname) and (len(_shard_basenames(dirname)) > 0 or is_view(dirname))
+
+def save_view(view_dir, store_dir, n_columns):
+  """Saves a view of the leading n_columns columns of the given store. The
+     location of the store is saved relatively to the view, such that both
+     can be moved together."""
+  utils.ensure_dir(view_dir)
+  filename = os.path.join(view_dir, VIEW_FILENAME)
+  f = open(filename + '.tmp', 'w')
+  f.write(os.path.relpath(store_dir, view_dir) + "\n")
+  f.write("%d\n" % n_columns)
+  f.close()
+  os.rename(filename + '.tmp', filename)
+
+def load_view(view_dir):
+  """Returns the location of the store and the number of columns of a view"""
+  f = open(os.path.join(view_dir, VIEW_FILENAME), 'r')
+  store_dir = f.readline().rstrip('\n')
+  n_columns = int(f.readline())
+  f.close()
+  return (os.path.normpath(os.path.join(view_dir, store_dir)), n_columns)
+
+def shard_exists(store_dir, shard_id):
+  """Checks if the shard with the given id has been (completely) written"""
+  return os.path.exists(os.path.join(store_dir, shard_name(shard_id) + INDEX_EXT))
+
+def erase_shard(store_dir, shard_id):
+  """Erases the shard with the given id if it exists"""
+  base = os.path.join(store_dir, shard_name(shard_id))
+  # The index is removed first, such that the shard is never seen as complete
+  utils.erase_if_exists(base + INDEX_EXT)
+  utils.erase_if_exists(base + DATA_EXT)
+
+def _write_index(index_filename, paths):
+  """Writes the list of sample paths of a shard (atomically, since the index
+     indicates a complete shard)"""
+  f = open(index_filename + '.tmp', 'w')
+  for p in paths:
+    f.write(str(p) + "\n")
+  f.close()
+  os.rename(index_filename + '.tmp', index_filename)
+
+def save_shard(store_dir, shard_id, paths, data, dtype=numpy.float64):
+  """Saves a 2D array of features (one row per sample) together with the
+     paths of the samples as a shard of the given store. The rows are
+     always loaded as float64, but may be stored with a smaller type."""
+  if len(paths) != data.shape[0]:
+    raise RuntimeError("The number of paths (%d) does not match the number of rows (%d) of the shard." % (len(paths), data.shape[0]))
+  utils.ensure_dir(store_dir)
+  base = os.path.join(store_dir, shard_name(shard_id))
+  # The index is written last (and atomically), since it indicates a complete shard
+  numpy.save(base + DATA_EXT, numpy.ascontiguousarray(data, dtype=dtype))
+  _write_index(base + INDEX_EXT, paths)
+
+def _load_index(index_filename):
+  """Loads the list of sample paths of a shard"""
+  f = open(index_filename, 'r')
+  paths = [l.rstrip('\n') for l in f]
+  f.close()
+  return paths
+
+
+class FeatureStore(object):
+  """Read access to a feature store. The shards are opened as memory maps and
+     the samples are retrieved using their (database) path. If the directory
+     is a view, only the leading columns of the store are read."""
+
+  def __init__(self, store_dir, mmap_mode='r'):
+    n_columns = None
+    if is_view(store_dir):
+      store_dir, n_columns = load_view(store_dir)
+    # Shards from the oldest to the most recent one, which hence wins
+    bases = _shards_by_age(store_dir)
+    if len(bases) == 0:
+      raise RuntimeError("Cannot find any feature shard in %s" % store_dir)
+    self.store_dir = store_dir
+    self.shards = []
+    self.index = {}
+    for s, base in enumerate(bases):
+      data = numpy.load(base + DATA_EXT, mmap_mode=mmap_mode)
+      paths = _load_index(base + INDEX_EXT)
+      if len(paths) != data.shape[0]:
+        raise RuntimeError("Index and data of the shard %s do not match." % base)
+      if n_columns is not None:
+        if n_columns > data.shape[1]:
+          raise RuntimeError("Cannot view %d columns of the shard %s, which only has %d." % (n_columns, base, data.shape[1]))
+        # (a slice of a memory map, which does not read anything)
+        data = data[:,:n_columns]
+      self.shards.append(data)
+      for r, p in enumerate(paths):
+        self.index[p] = (s, r)
+    self.shape = (len(self.index), self.shards[0].shape[1])
+
+  def __len__(self):
+    return len(self.index)
+
+  def __contains__(self, path):
+    return str(path) in self.index
+
+  def get(self, path):
+    """Returns the feature vector of the sample with the given path"""
+    path = str(path)
+    if not path in self.index:
+      raise RuntimeError("Cannot find features of sample %s in store %s" % (path, self.store_dir))
+    s, r = self.index[path]
+    return numpy.array(self.shards[s][r], dtype=numpy.float64)
+
+  def load(self, paths, data=None):
+    """Loads the features of the samples with the given paths into a 2D array
+       (one row per sample, in the same order than the paths). Rows are
+       gathered from each shard at once."""
+    if data is None:
+      data = numpy.ndarray(shape=(len(paths), self.shape[1]), dtype=numpy.float64)
+    rows = {}
+    for i, p in enumerate(paths):
+      p = str(p)
+      if not p in self.index:
+        raise RuntimeError("Cannot find features of sample %s in store %s" % (p, self.store_dir))
+      s, r = self.index[p]
+      rows.setdefault(s, ([], []))
+      rows[s][0].append(i)
+      rows[s][1].append(r)
+    for s, (dst, src) in rows.items():
+      data[numpy.array(dst)] = self.shards[s][numpy.array(src)]
+    return data
+
+
+# Stores opened by this process, with the modification times of their indices
+_stores = {}
+
+def _signature(store_dir):
+  """Returns the modification times of the files describing a store (the
+     shard indices, and the descriptor of a view)"""
+  filenames = []
+  if is_view(store_dir):
+    filenames.append(os.path.join(store_dir, VIEW_FILENAME))
+    store_dir = load_view(store_dir)[0]
+  filenames.extend([base + INDEX_EXT for base in _shard_basenames(store_dir)])
+  return tuple([(f, os.path.getmtime(f)) for f in filenames])
+
+def open_store(store_dir):
+  """Returns the FeatureStore of the given directory. A store is only opened
+     (and its indices parsed) once per process, and is reopened if its
+     shards have been modified in the meantime."""
+  key = os.path.abspath(store_dir)
+  signature = _signature(store_dir)
+  if not key in _stores or _stores[key][0] != signature:
+    _stores[key] = (signature, FeatureStore(store_dir))
+  return _stores[key][1]
+
+
+def concatenate(store_dir):
+  """Concatenates all the shards of a store into a single contiguous shard.
+     The resulting matrix is written through a memory map, such that the
+     whole feature set never needs to fit into memory. The concatenated
+     shard is complete (index included) before the previous shards are
+     removed: if interrupted, the store contains some samples twice, which
+     are only kept once by the next concatenation. As when reading the
+     store, the features of a sample are taken from the most recently
+     written shard which contains it."""
+  bases = _shards_by_age(store_dir)
+  if len(bases) <= 1:
+    return
+  shards = [numpy.load(base + DATA_EXT, mmap_mode='r') for base in bases]
+  # Shard and row of each sample (the most recent shard wins)
+  owner = {}
+  indices = []
+  for s, base in enumerate(bases):
+    indices.append(_load_index(base + INDEX_EXT))
+    for r, p in enumerate(indices[s]):
+      owner[p] = (s, r)
+  # Rows of each shard which are kept
+  rows = []
+  paths = []
+  for s, paths_s in enumerate(indices):
+    rows_s = [r for r, p in enumerate(paths_s) if owner[p] == (s, r)]
+    paths.extend([paths_s[r] for r in rows_s])
+    rows.append(numpy.array(rows_s, dtype=numpy.int64))
+  # The concatenated shard is named differently from the current ones
+  shard_id = MERGED_SHARD_ID
+  k = 0
+  while os.path.join(store_dir, shard_name(shard_id)) in bases:
+    k += 1
+    shard_id = '%s-%d' % (MERGED_SHARD_ID, k)
+  base = os.path.join(store_dir, shard_name(shard_id))
+  # The type of the features is kept (e.g. uint8 for the stage caches)
+  dtype = numpy.result_type(*[s.dtype for s in shards])
+  data = numpy.lib.format.open_memmap(base + '.tmp' + DATA_EXT, mode='w+', dtype=dtype, shape=(len(paths), shards[0].shape[1]))
+  offset = 0
+  for s, rows_s in zip(shards, rows):
+    data[offset:offset+len(rows_s)] = s[rows_s]
+    offset += len(rows_s)
+  data.flush()
+  del data
+  os.rename(base + '.tmp' + DATA_EXT, base + DATA_EXT)
+  _write_index(base + INDEX_EXT, paths)
+  # Only then removes the previous shards
+  for base in bases:
+    utils.erase_if_exists(base + INDEX_EXT)
+    utils.erase_if_exists(base + DATA_EXT)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Batched LBP histograms computed with NumPy.
+
+This is an alternative to bob.ip.LBPHSFeatures, which computes the LBP
+codes and the block histograms of a whole stack of images at once. It
+follows the conventions of bob.ip.LBP8R (order of the neighbours, bilinear
+interpolation for the circular LBP, labels of the uniform patterns), and
+the block decomposition of bob.ip.LBPHSFeatures (the LBP codes of a block
+are computed on the block only, such that the codes of its border pixels
+are not taken into account).
+"""
+
+import math
+import numpy
+
+def uniform_lut(p_n=8):
+  """Returns the lookup table from the LBP codes to the labels of the
+     uniform patterns: 0 for the non-uniform patterns, 1 for the pattern
+     with all bits set to 0, then the rotations of the patterns with 1 to
+     p_n-1 consecutive bits set to 1, and finally the pattern with all bits
+     set to 1."""
+  lut = numpy.zeros(shape=(2**p_n,), dtype=numpy.int64)
+  lut[0] = 1
+  label = 2
+  for k in range(1, p_n):
+    pattern = ((1 << k) - 1) << (p_n - k)
+    for r in range(p_n):
+      lut[pattern] = label
+      label += 1
+      pattern = (pattern >> 1) | ((pattern & 1) << (p_n - 1))
+  lut[2**p_n - 1] = label
+  return lut
+
+def neighbour_offsets(radius, circular=True):
+  """Returns the (y,x) offsets of the 8 neighbours, starting from the top
+     left one (most significant bit), and clockwise"""
+  if circular: d = radius / math.sqrt(2.)
+  else: d = float(radius)
+  r = float(radius)
+  return [(-d, -d), (-r, 0.), (-d, d), (0., r), (d, d), (r, 0.), (d, -d), (0., -r)]
+
+
+class LBPHS(object):
+  """Computes LBP histograms on (overlapping) blocks of a stack of images"""
+
+  def __init__(self, block_h, block_w, block_oh, block_ow, radius, p_n, circular, to_average, add_average_bit, uniform, rot_inv):
+    if p_n != 8 or to_average or add_average_bit or rot_inv:
+      raise RuntimeError("Only the (circular or not, uniform or not) LBP with 8 neighbours is supported by the NumPy LBP engine.")
+    if int(radius) != radius or radius < 1:
+      raise RuntimeError("The radius of the LBP should be a strictly positive integer (%s given)." % str(radius))
+    self.block_h = block_h
+    self.block_w = block_w
+    self.block_oh = block_oh
+    self.block_ow = block_ow
+    self.radius = int(radius)
+    self.offsets = neighbour_offsets(radius, circular)
+    if uniform:
+      self.lut = uniform_lut(p_n)
+      self.n_bins = int(self.lut.max()) + 1
+    else:
+      self.lut = None
+      self.n_bins = 2**p_n
+    self._indices = {}
+
+  def n_blocks(self, height, width):
+    """Returns the number of blocks (vertically and horizontally) of an image"""
+    return ((height - self.block_oh) // (self.block_h - self.block_oh), (width - self.block_ow) // (self.block_w - self.block_ow))
+
+  def n_features(self, height, width):
+    """Returns the length of the features of an image"""
+    (n_h, n_w) = self.n_blocks(height, width)
+    return n_h * n_w * self.n_bins
+
+  def codes(self, images):
+    """Returns the LBP codes (or labels if uniform) of a stack of images.
+       The codes are not computed for the pixels closer to the border than
+       the radius."""
+    images = numpy.asarray(images, dtype=numpy.float64)
+    R = self.radius
+    (n, h, w) = images.shape
+    ch = h - 2 * R
+    cw = w - 2 * R
+    center = images[:, R:R+ch, R:R+cw]
+    codes = numpy.zeros(shape=(n, ch, cw), dtype=numpy.int64)
+    for (dy, dx) in self.offsets:
+      yl = int(math.floor(dy))
+      xl = int(math.floor(dx))
+      fy = dy - yl
+      fx = dx - xl
+      # Bilinear interpolation (exact when the offsets are integers)
+      sl = lambda oy, ox: images[:, R+yl+oy:R+yl+oy+ch, R+xl+ox:R+xl+ox+cw]
+      if fy == 0. and fx == 0.:
+        neighbour = sl(0, 0)
+      else:
+        neighbour = (1. - fy) * ((1. - fx) * sl(0, 0) + fx * sl(0, 1)) + fy * ((1. - fx) * sl(1, 0) + fx * sl(1, 1))
+      codes <<= 1
+      codes += (neighbour >= center)
+    if self.lut is not None:
+      codes = self.lut[codes]
+    return codes
+
+  def _block_indices(self, height, width):
+    """Returns the indices (in the flattened array of codes) of the pixels
+       of each block, for which the LBP code is computed"""
+    key = (height, width)
+    if not key in self._indices:
+      R = self.radius
+      cw = width - 2 * R
+      (n_h, n_w) = self.n_blocks(height, width)
+      ys = numpy.arange(self.block_h - 2 * R)
+      xs = numpy.arange(self.block_w - 2 * R)
+      cells = (ys[:,numpy.newaxis] * cw + xs[numpy.newaxis,:]).ravel()
+      by = numpy.arange(n_h) * (self.block_h - self.block_oh)
+      bx = numpy.arange(n_w) * (self.block_w - self.block_ow)
+      starts = (by[:,numpy.newaxis] * cw + bx[numpy.newaxis,:]).ravel()
+      self._indices[key] = starts[:,numpy.newaxis] + cells[numpy.newaxis,:]
+    return self._indices[key]
+
+  def __call__(self, images, out=None):
+    """Computes the concatenated block histograms of a stack of images, and
+       returns them as a 2D array (one row per image)"""
+    images = numpy.asarray(images)
+    (n, h, w) = images.shape
+    indices = self._block_indices(h, w)
+    n_blocks = indices.shape[0]
+    if out is None:
+      out = numpy.ndarray(shape=(n, n_blocks * self.n_bins), dtype=numpy.float64)
+    codes = self.codes(images).reshape(n, -1)
+    # Bin of each code in the (flattened) set of histograms
+    bins = codes[:, indices]
+    bins += (numpy.arange(n_blocks) * self.n_bins)[numpy.newaxis,:,numpy.newaxis]
+    bins += (numpy.arange(n) * n_blocks * self.n_bins)[:,numpy.newaxis,numpy.newaxis]
+    out[:] = numpy.bincount(bins.ravel(), minlength=n*n_blocks*self.n_bins).reshape(n, n_blocks * self.n_bins)
+    return out
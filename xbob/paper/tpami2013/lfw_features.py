@@ -19,6 +19,10 @@
 
 import os
 import sys
+import numpy
+
+# Suffix of the files containing the SIFT features
+JEVAL_SUFFIX = '.jpg.pts.sift16.jeval'
 
 def download(url, output_file):
   """Downloads an URL and saves it to file"""
@@ -42,34 +46,95 @@ def extract_tbz2(input_filename, output_dir):
   tgz_file = tarfile.open(input_filename, 'r:bz2')
   tgz_file.extractall(output_dir)
 
+def parse_jeval(text):
+  """Parses the content of a .jeval file, and returns the SIFT features as
+     a 1D array. The first two lines are a header, and each of the other
+     ones contains the location and scale of a keypoint (5 values),
+     followed by its descriptor. All the values are converted at once, and
+     the keypoint columns are then dropped by slicing."""
+  body = text.split('\n', 2)[2] if text.count('\n') >= 2 else ''
+  n_rows = len([l for l in body.splitlines() if l.strip()])
+  values = numpy.array(body.split(), dtype=numpy.float64)
+  if n_rows == 0:
+    return values
+  return values.reshape(n_rows, -1)[:,5:].flatten()
+
 def _parse_jeval(input_filename, output_filename):
-  import csv
-  with open(input_filename, 'r') as csvfile:
-    spamreader = csv.reader(csvfile, delimiter=' ')
-    dlist = []
-    count = 0
-    for row in spamreader:
-      # Skip the first two lines
-      if count < 2:
-        count += 1
-        continue
-      # Only keep the features (Not the location/scale of the keypoints)
-      # And concatenate them in a 
-      else:
-        dlist.extend(row[5:])
-    dlist = map(float, dlist)
-    import bob
-    bob.io.save(dlist, output_filename)
+  """Converts a .jeval file into HDF5 format"""
+  with open(input_filename, 'r') as f:
+    data = parse_jeval(f.read())
+  import bob
+  bob.io.save(data, output_filename)
+
+def _parse_client_dir(client_dir):
+  """Converts all the .jeval files of a client directory into HDF5 format"""
+  suffix_len = len(JEVAL_SUFFIX)
+  for f in os.listdir(client_dir):
+    filename = os.path.join(client_dir, f)
+    if filename.endswith(JEVAL_SUFFIX):
+      filename_noext = filename[:-suffix_len]
+      filename_hdf5 = filename_noext + '.hdf5'
+      print("Converting '%s' into hdf5 format" % filename)
+      _parse_jeval(filename, filename_hdf5)
+
+def db_parse_jeval(input_dir, n_processes=1):
+  """Converts all the .jeval files of the extracted archive into HDF5
+     format. If n_processes is larger than one, the client directories are
+     distributed to this number of worker processes."""
+  client_dirs = [os.path.join(input_dir, c_dir) for c_dir in sorted(os.listdir(input_dir))]
+  client_dirs = [c for c in client_dirs if os.path.isdir(c)]
+  if n_processes > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(n_processes)
+    pool.map(_parse_client_dir, client_dirs)
+    pool.close()
+    pool.join()
+  else:
+    for client_dir in client_dirs:
+      _parse_client_dir(client_dir)
+
+def _member_path(member_name):
+  """Returns the (database) path of the sample of a .jeval member of the
+     archive, that is without the top directory and the suffix"""
+  path = member_name[:-len(JEVAL_SUFFIX)].replace('\\', '/')
+  return path.split('/', 1)[1]
+
+def ingest_tbz2(input_filename, store_dir, shard_size=2000, force=False):
+  """Streams the .jeval members of the .tar.bz2 archive, parses them in
+     memory and saves the SIFT features into a feature store (by shards of
+     shard_size samples), without extracting the archive on the disk. The
+     store is written into a temporary directory, which is renamed once
+     complete."""
+  import shutil
+  import tarfile
+  from . import featurestore, utils
+  if os.path.exists(store_dir):
+    if not force:
+      print("Feature store '%s' already exists." % store_dir)
+      return
+    print("Remove old feature store '%s'." % store_dir)
+    shutil.rmtree(store_dir)
+  tmp_dir = store_dir + '.tmp%d' % os.getpid()
+  utils.ensure_dir(tmp_dir)
 
-def db_parse_jeval(input_dir):
-  suffix = '.jpg.pts.sift16.jeval'
-  suffix_len = len(suffix)
-  for c_dir in os.listdir(input_dir):
-    client_dir = os.path.join(input_dir, c_dir)
-    for f in os.listdir(client_dir):
-      filename = os.path.join(client_dir, f)
-      if filename.endswith(suffix):
-        filename_noext = filename[:-suffix_len]
-        filename_hdf5 = filename_noext + '.hdf5'
-        print("Converting '%s' into hdf5 format" % filename)
-        _parse_jeval(filename, filename_hdf5)
+  tar_file = tarfile.open(input_filename, 'r|bz2')
+  paths = []
+  data = []
+  shard_id = 0
+  for member in tar_file:
+    if not member.isfile() or not member.name.endswith(JEVAL_SUFFIX):
+      continue
+    print("Parsing '%s'" % member.name)
+    f = tar_file.extractfile(member)
+    data.append(parse_jeval(f.read().decode('ascii')))
+    f.close()
+    paths.append(_member_path(member.name))
+    if len(paths) == shard_size:
+      featurestore.save_shard(tmp_dir, shard_id, paths, numpy.vstack(data))
+      shard_id += 1
+      paths = []
+      data = []
+  tar_file.close()
+  if len(paths) > 0:
+    featurestore.save_shard(tmp_dir, shard_id, paths, numpy.vstack(data))
+  os.rename(tmp_dir, store_dir)
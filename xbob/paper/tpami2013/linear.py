@@ -17,16 +17,101 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import bob
+import numpy
 import os
+from . import utils
 
-def pca_train(data, n_outputs):
-  """Generates the PCA covariance matrix"""
-  print("Training LinearMachine using PCA (SVD)")
-  T = bob.trainer.PCATrainer()
-  machine, eig_vals = T.train(data)
-  # Machine: get shape, then resize
-  machine.resize(machine.shape[0], n_outputs)
-  return (machine, eig_vals)
+PCA_METHODS = ('svd', 'gram', 'randomized')
+# Ridge (relative to the mean variance) added to a singular within-class
+# scatter matrix when training the LDA from accumulated statistics
+LDA_RIDGE = 1e-6
+
+def _linear_machine(weights, input_subtract):
+  """Creates a LinearMachine from a projection matrix and an input offset"""
+  machine = bob.machine.LinearMachine(numpy.ascontiguousarray(weights))
+  machine.input_subtract = input_subtract
+  return machine
+
+def _pca_gram(data, mean, n_outputs):
+  """Computes the n_outputs leading eigenvectors of the covariance matrix,
+     by eigendecomposing the smallest of the Gram matrix
+     (n_samples x n_samples) and of the scatter matrix (dim x dim), as well
+     as all its min(n_samples-1, dim) eigenvalues. The data are centered
+     implicitly to avoid a copy of the data."""
+  n_samples = data.shape[0]
+  rank = min(n_samples - 1, data.shape[1])
+  data_mean = numpy.dot(data, mean)
+  if n_samples < data.shape[1]:
+    # Gram matrix of the centered data
+    K = numpy.dot(data, data.T)
+    K -= data_mean[:,numpy.newaxis]
+    K -= data_mean[numpy.newaxis,:]
+    K += numpy.dot(mean, mean)
+    eig_vals, U = numpy.linalg.eigh(K)
+    eig_vals = eig_vals[::-1]
+    U = U[:,::-1][:,0:n_outputs]
+    # Eigenvectors of the scatter matrix: Xc^T.U / sqrt(eig_vals)
+    V = numpy.dot(data.T, U) - numpy.outer(mean, U.sum(axis=0))
+    V /= numpy.sqrt(numpy.maximum(eig_vals[0:n_outputs], numpy.finfo(numpy.float64).tiny))
+  else:
+    # Scatter matrix of the centered data
+    S = numpy.dot(data.T, data) - n_samples * numpy.outer(mean, mean)
+    eig_vals, V = numpy.linalg.eigh(S)
+    eig_vals = eig_vals[::-1]
+    V = V[:,::-1][:,0:n_outputs]
+  return (V, eig_vals[0:rank] / (n_samples - 1))
+
+def _pca_randomized(data, mean, n_outputs, n_oversamples=10, n_iter=4, seed=0):
+  """Computes the n_outputs leading eigenvectors/eigenvalues of the
+     covariance matrix using a randomized SVD (Halko et al., 2011) of the
+     (implicitly) centered data."""
+  n_samples = data.shape[0]
+  k = min(n_outputs + n_oversamples, min(data.shape))
+  ones = numpy.ones((n_samples,), dtype=numpy.float64)
+  rng = numpy.random.RandomState(seed)
+  # Range finder with power iterations: Y = Xc.Omega
+  Omega = rng.normal(size=(data.shape[1], k))
+  Q, _ = numpy.linalg.qr(numpy.dot(data, Omega) - numpy.outer(ones, numpy.dot(mean, Omega)))
+  for i in range(n_iter):
+    Z = numpy.dot(data.T, Q) - numpy.outer(mean, Q.sum(axis=0))
+    Z, _ = numpy.linalg.qr(Z)
+    Q, _ = numpy.linalg.qr(numpy.dot(data, Z) - numpy.outer(ones, numpy.dot(mean, Z)))
+  # SVD of the small matrix B = Q^T.Xc
+  B = numpy.dot(Q.T, data) - numpy.outer(Q.sum(axis=0), mean)
+  _, s, Vt = numpy.linalg.svd(B, full_matrices=False)
+  return (Vt[0:n_outputs,:].T, (s[0:n_outputs]**2) / (n_samples - 1))
+
+def pca_train(data, n_outputs, method='svd'):
+  """Generates the PCA covariance matrix. The 'svd' method relies on the
+     bob PCATrainer and computes all the components, whereas the 'gram' and
+     'randomized' methods only compute the n_outputs leading ones. The
+     eigenvalues are returned as by the bob PCATrainer (all the
+     min(n_samples-1, dim) ones), except by the 'randomized' method which
+     only estimates the n_outputs leading ones. The 'gram' and 'randomized'
+     methods raise an error if more components are requested than the
+     min(n_samples-1, dim) ones spanned by the centered data."""
+  if method == 'svd':
+    print("Training LinearMachine using PCA (SVD)")
+    T = bob.trainer.PCATrainer()
+    machine, eig_vals = T.train(data)
+    # Machine: get shape, then resize
+    machine.resize(machine.shape[0], n_outputs)
+    return (machine, eig_vals)
+  if not method in PCA_METHODS:
+    raise RuntimeError("Unknown PCA method '%s'." % method)
+  # The centered data span at most n_samples-1 dimensions: the components
+  # beyond are undefined (and the Gram matrix would divide by zero)
+  n_max = min(data.shape[0] - 1, data.shape[1])
+  if n_outputs > n_max:
+    raise RuntimeError("Cannot compute %d PCA components from %d samples of dimension %d (at most %d)." % (n_outputs, data.shape[0], data.shape[1], max(0, n_max)))
+  mean = data.mean(axis=0)
+  if method == 'gram':
+    print("Training LinearMachine using PCA (Gram matrix, %d components)" % n_outputs)
+    weights, eig_vals = _pca_gram(data, mean, n_outputs)
+  else:
+    print("Training LinearMachine using PCA (randomized SVD, %d components)" % n_outputs)
+    weights, eig_vals = _pca_randomized(data, mean, n_outputs)
+  return (_linear_machine(weights, mean), eig_vals)
 
 def lda_train(data, n_outputs):
   """Generates the Fisher LDA preojection matrix"""
@@ -37,13 +122,274 @@ def lda_train(data, n_outputs):
   machine.resize(machine.shape[0], n_outputs)
   return (machine, eig_vals)
 
+class ScatterStatistics(object):
+  """Sufficient statistics to train PCA and LDA LinearMachines: number of
+     samples, mean and total scatter (about the mean) of the data, as well as
+     the number of samples and the sum of the samples of each class. They are
+     accumulated chunk by chunk, so that the memory usage is bounded by
+     dim x dim rather than n_samples x dim."""
+
+  def __init__(self):
+    self.key = ''
+    self.n_samples = 0
+    self.mean = None
+    self.scatter = None
+    self.class_counts = {}
+    self.class_sums = {}
+
+  def _merge_moments(self, n_samples, mean, scatter):
+    """Merges the moments of another set of samples (Chan et al., 1979)"""
+    if self.n_samples == 0:
+      self.n_samples = n_samples
+      self.mean = mean.copy()
+      self.scatter = scatter.copy()
+      return
+    n_total = self.n_samples + n_samples
+    delta = mean - self.mean
+    self.scatter += scatter
+    # (the vector is scaled rather than the outer product, to avoid a
+    # second dim x dim temporary)
+    self.scatter += numpy.outer(delta * (self.n_samples * float(n_samples) / n_total), delta)
+    self.mean += delta * (float(n_samples) / n_total)
+    self.n_samples = n_total
+
+  def _merge_class(self, label, count, sum_):
+    if label in self.class_counts:
+      self.class_counts[label] += count
+      self.class_sums[label] = self.class_sums[label] + sum_
+    else:
+      self.class_counts[label] = count
+      self.class_sums[label] = sum_.copy()
+
+  def accumulate(self, data, labels=None):
+    """Accumulates a chunk of samples (2D array, one sample per row). The
+       optional labels give the class of each sample (required for LDA)."""
+    if data.shape[0] == 0: return
+    mean = data.mean(axis=0)
+    centered = data - mean
+    self._merge_moments(data.shape[0], mean, numpy.dot(centered.T, centered))
+    if labels is not None:
+      labels = numpy.asarray(labels)
+      for label in numpy.unique(labels):
+        rows = (labels == label)
+        self._merge_class(label.item(), int(rows.sum()), data[rows].sum(axis=0))
+
+  def merge(self, other):
+    """Merges the statistics accumulated by another ScatterStatistics"""
+    if other.n_samples == 0: return
+    self._merge_moments(other.n_samples, other.mean, other.scatter)
+    for label in other.class_counts:
+      self._merge_class(label, other.class_counts[label], other.class_sums[label])
+
+  def between_scatter(self):
+    """Returns the between-class scatter matrix"""
+    Sb = numpy.zeros(self.scatter.shape, dtype=numpy.float64)
+    for label in self.class_counts:
+      delta = self.class_sums[label] / self.class_counts[label] - self.mean
+      Sb += self.class_counts[label] * numpy.outer(delta, delta)
+    return Sb
+
+
+def statistics_filename(statistics_dir, split_id):
+  """Returns the filename of the partial statistics of a split of the
+     training files"""
+  return os.path.join(statistics_dir, 'stats_' + str(split_id).zfill(4) + '.npz')
+
+def statistics_key(filenames, features_dir):
+  """Returns a key identifying a list of training files (database File
+     objects) and the directory of their features, which is saved together
+     with their partial statistics"""
+  import hashlib
+  h = hashlib.md5(os.path.abspath(features_dir).encode('utf-8'))
+  for k in filenames:
+    h.update(('\n' + str(k.path)).encode('utf-8'))
+  return h.hexdigest()
+
+def save_statistics(stats, filename, key=''):
+  """Saves (partial) ScatterStatistics into a NumPy .npz file, together with
+     the key of the training files they were accumulated on"""
+  utils.ensure_dir(os.path.dirname(filename))
+  labels = sorted(stats.class_counts.keys())
+  dim = stats.mean.shape[0]
+  sums = numpy.ndarray(shape=(len(labels), dim), dtype=numpy.float64)
+  for k, label in enumerate(labels):
+    sums[k] = stats.class_sums[label]
+  # The file is written under a temporary name, since it indicates a complete job
+  f = open(filename + '.tmp', 'wb')
+  numpy.savez(f, n_samples=stats.n_samples, mean=stats.mean, scatter=stats.scatter,
+    labels=numpy.array(labels), class_counts=numpy.array([stats.class_counts[l] for l in labels], dtype=numpy.int64),
+    class_sums=sums, key=numpy.array(key))
+  f.close()
+  os.rename(filename + '.tmp', filename)
+
+def load_statistics(filename):
+  """Loads (partial) ScatterStatistics from a NumPy .npz file"""
+  if not os.path.exists(filename):
+    raise RuntimeError("Cannot find statistics %s" % (filename))
+  npz = numpy.load(filename)
+  stats = ScatterStatistics()
+  stats.n_samples = int(npz['n_samples'])
+  stats.mean = npz['mean']
+  stats.scatter = npz['scatter']
+  for label, count, sum_ in zip(npz['labels'].tolist(), npz['class_counts'].tolist(), npz['class_sums']):
+    stats.class_counts[label] = count
+    stats.class_sums[label] = sum_
+  if 'key' in npz.files: stats.key = str(npz['key'])
+  else: stats.key = ''
+  npz.close()
+  return stats
+
+def has_statistics(filename, key):
+  """Checks if the partial statistics saved in the given file exist, and
+     were accumulated on the training files identified by the given key"""
+  if not os.path.exists(filename):
+    return False
+  npz = numpy.load(filename)
+  found = 'key' in npz.files and str(npz['key']) == key
+  npz.close()
+  return found
+
+def merge_statistics(filenames):
+  """Loads and merges several partial ScatterStatistics"""
+  stats = ScatterStatistics()
+  for filename in filenames:
+    stats.merge(load_statistics(filename))
+  return stats
+
+def merge_split_statistics(statistics_dir, splits, features_dir):
+  """Loads and merges the partial statistics of each of the given splits of
+     the training files (lists of database File objects), checking that they
+     were accumulated on this split. Other files of the statistics directory
+     (e.g. from a former run with more splits) are ignored."""
+  stats = ScatterStatistics()
+  for split_id, filenames in enumerate(splits):
+    filename = statistics_filename(statistics_dir, split_id)
+    if not os.path.exists(filename):
+      raise RuntimeError("Cannot find the partial statistics %s of the split %d of the training files." % (filename, split_id))
+    stats_s = load_statistics(filename)
+    if stats_s.key != statistics_key(filenames, features_dir):
+      raise RuntimeError("The partial statistics %s were not accumulated on the split %d of the training files (they may come from a former run with other features or splits), and should be accumulated again." % (filename, split_id))
+    stats.merge(stats_s)
+  return stats
+
+def cross_validation_statistics(training_sets, features_dir, features_ext, chunk_size):
+  """Accumulates the ScatterStatistics of several training sets (lists of
+     database File objects) sharing most of their samples, such as the ones
+     of the folds of a cross-validation, loading each sample only once. The
+     samples are grouped according to the training sets they belong to: the
+     statistics of each group are accumulated once, and then merged into
+     the ones of each of these training sets."""
+  memberships = {}
+  for s, training_set in enumerate(training_sets):
+    for k in training_set:
+      memberships.setdefault(k.path, (k, set()))[1].add(s)
+  groups = {}
+  for k, sets in memberships.values():
+    groups.setdefault(tuple(sorted(sets)), []).append(k)
+  print("Accumulating the statistics of %d training sets over %d samples (%d groups)." % (len(training_sets), len(memberships), len(groups)))
+  stats = [ScatterStatistics() for training_set in training_sets]
+  for sets in sorted(groups.keys()):
+    group = ScatterStatistics()
+    for chunk in utils.split_list(sorted(groups[sets], key=lambda k: k.path), chunk_size):
+      group.accumulate(utils.load_data(chunk, features_dir, features_ext))
+    for s in sets:
+      stats[s].merge(group)
+  return stats
+
+def pca_train_statistics(stats, n_outputs):
+  """Generates the PCA covariance matrix from accumulated ScatterStatistics.
+     Whatever the PCA method, this always performs a full eigendecomposition
+     of the dim x dim scatter matrix. The eigenvalues are returned as by the
+     bob PCATrainer (all the min(n_samples-1, dim) ones)."""
+  print("Training LinearMachine using PCA (eigendecomposition of the accumulated covariance)")
+  # (the scatter matrix is decomposed in place of the covariance, to avoid
+  # a copy of a dim x dim matrix)
+  eig_vals, V = numpy.linalg.eigh(stats.scatter)
+  eig_vals = eig_vals[::-1][0:min(stats.n_samples - 1, stats.scatter.shape[0])] / (stats.n_samples - 1)
+  V = V[:,::-1][:,0:n_outputs]
+  return (_linear_machine(V, stats.mean), eig_vals)
+
+def _lda_eigh(Sb, Sw):
+  """Solves the generalized eigenproblem Sb.v = lambda.Sw.v. If the
+     within-class scatter Sw is singular (e.g. when there are less samples
+     than dimensions), it is regularized by adding a small ridge."""
+  import scipy.linalg
+  try:
+    return scipy.linalg.eigh(Sb, Sw)
+  except numpy.linalg.LinAlgError:
+    pass
+  dim = Sw.shape[0]
+  scale = numpy.trace(Sw) / dim
+  if scale <= 0.: scale = 1.
+  ridge = LDA_RIDGE * scale
+  print("The within-class scatter matrix is singular: adding a ridge of %g to its diagonal." % ridge)
+  try:
+    return scipy.linalg.eigh(Sb, Sw + ridge * numpy.eye(dim))
+  except numpy.linalg.LinAlgError:
+    raise RuntimeError("Cannot train the LDA projection: the within-class scatter matrix (of dimension %d) is not positive definite, even after regularization." % dim)
+
+def lda_train_statistics(stats, n_outputs):
+  """Generates the Fisher LDA projection matrix from accumulated
+     ScatterStatistics, by solving the generalized eigenproblem
+     Sb.v = lambda.Sw.v. This always performs a full decomposition of the
+     dim x dim scatter matrices. All the eigenvalues are returned, as by the
+     bob FisherLDATrainer."""
+  print("Training LinearMachine using Fisher's LDA (accumulated scatter matrices)")
+  Sb = stats.between_scatter()
+  Sw = stats.scatter - Sb
+  eig_vals, V = _lda_eigh(Sb, Sw)
+  eig_vals = eig_vals[::-1]
+  V = V[:,::-1][:,0:n_outputs]
+  # Normalizes the eigenvectors (as the bob FisherLDATrainer)
+  V /= numpy.sqrt((V**2).sum(axis=0))
+  return (_linear_machine(V, stats.mean), eig_vals)
+
+def compose_machines(machines):
+  """Fuses a chain of LinearMachines (e.g. PCA followed by LDA) into a
+     single one, such that the data are projected with a single matrix
+     multiplication, without computing the intermediate projections. The
+     input normalization of the first machine is kept, whereas the ones of
+     the following machines and the biases are folded into the projection
+     matrix and the biases of the fused machine. The machines are assumed
+     to have an identity activation, as the ones trained by this package."""
+  if len(machines) == 0:
+    raise RuntimeError("Cannot compose an empty chain of LinearMachines")
+  first = machines[0]
+  weights = numpy.array(first.weights, dtype=numpy.float64)
+  biases = numpy.array(first.biases, dtype=numpy.float64)
+  for machine in machines[1:]:
+    if machine.shape[0] != weights.shape[1]:
+      raise RuntimeError("Cannot compose a LinearMachine with %d outputs with one with %d inputs" % (weights.shape[1], machine.shape[0]))
+    # ((y - s) / d) W + b = y (W / d) + (b - (s / d) W), with y = x W1 + b1
+    scaled = machine.weights / machine.input_divide[:,numpy.newaxis]
+    biases = numpy.dot(biases - machine.input_subtract, scaled) + machine.biases
+    weights = numpy.dot(weights, scaled)
+  composite = _linear_machine(weights, first.input_subtract)
+  composite.input_divide = first.input_divide
+  composite.biases = biases
+  return composite
+
 def project(data_in, machine, data_out):
   """Projects the data using the provided covariance matrix"""
   # Projects the data
   machine(data_in, data_out)
 
+def project_batch(data_in, machine, data_out=None):
+  """Projects a 2D array of samples (one per row) using the provided
+     (linear) machine, with a single matrix multiplication"""
+  if data_out is None:
+    data_out = numpy.ndarray(shape=(data_in.shape[0], machine.shape[1]), dtype=numpy.float64)
+  centered = data_in - machine.input_subtract
+  centered /= machine.input_divide
+  numpy.dot(centered, machine.weights, out=data_out)
+  data_out += machine.biases
+  return data_out
+
+def _load_linear_machine(model_filename):
+  return bob.machine.LinearMachine(bob.io.HDF5File(model_filename))
+
 def load_model(model_filename):
   if not os.path.exists(model_filename):
     raise RuntimeError("Cannot find LinearMachine %s" % (model_filename))
-  return bob.machine.LinearMachine(bob.io.HDF5File(model_filename))
+  return utils.cached_load(model_filename, _load_linear_machine)
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Local execution backend.
+
+The JobManager of this module can be used in place of the gridtk one, when
+no SGE grid is available: jobs are submitted (through utils.submit) with
+the same dependencies and arrays, and are then run on the local machine
+by calling run(). Each task of an array job is a separate process, which
+gets its position from the ${SGE_TASK_ID} environment variable, as on the
+grid. Several tasks are run in parallel, as soon as the jobs they depend
+on have successfully completed.
+"""
+
+import os
+import time
+import subprocess
+from . import utils
+
+class Job(object):
+  """A job submitted to the local JobManager"""
+
+  def __init__(self, job_id, command, deps, array, name):
+    self.job_id = job_id
+    self.command = command
+    self.deps = list(deps)
+    self.array = array
+    self.name = name
+    if array is None:
+      self.tasks = [None]
+    else:
+      (start, stop, step) = array
+      self.tasks = list(range(start, stop + 1, step))
+    # One of 'waiting', 'running', 'success' or 'failure'
+    self.status = 'waiting'
+    self.n_finished = 0
+    self.n_failed = 0
+
+  def id(self):
+    return self.job_id
+
+  def __str__(self):
+    if self.array is None:
+      return "%d %s" % (self.job_id, self.name)
+    return "%d %s (%d tasks)" % (self.job_id, self.name, len(self.tasks))
+
+
+class JobManager(object):
+  """Runs jobs on the local machine, using several processes"""
+
+  def __init__(self, n_processes=1, logdir='logs'):
+    if n_processes < 1:
+      raise RuntimeError("The number of local processes should be strictly positive (%d given)" % n_processes)
+    self.n_processes = n_processes
+    self.logdir = logdir
+    self.jobs = []
+
+  def submit(self, command, deps=None, array=None, name=None, **kwargs):
+    """Submits a job, which will be run when calling run(). The grid
+       specific parameters (queue, memory, etc.) are ignored. An array job
+       without any task is finished as soon as it is submitted."""
+    deps = deps or []
+    job_id = len(self.jobs) + 1
+    if name is None: name = os.path.splitext(os.path.basename(command[0]))[0]
+    job = Job(job_id, command, deps, array, name)
+    for d in job.deps:
+      if d < 1 or d >= job_id:
+        raise RuntimeError("Job %d depends on unknown job %d" % (job_id, d))
+    if len(job.tasks) == 0:
+      job.status = 'success'
+    self.jobs.append(job)
+    return job
+
+  def _start(self, job, task):
+    """Starts one task of a job, redirecting its outputs to the log directory"""
+    env = os.environ.copy()
+    suffix = str(job.job_id)
+    if task is not None:
+      env['SGE_TASK_ID'] = str(task)
+      suffix += '.' + str(task)
+    utils.ensure_dir(self.logdir)
+    stdout = open(os.path.join(self.logdir, job.name + '.o' + suffix), 'w')
+    stderr = open(os.path.join(self.logdir, job.name + '.e' + suffix), 'w')
+    process = subprocess.Popen(job.command, env=env, stdout=stdout, stderr=stderr)
+    return (process, job, task, stdout, stderr)
+
+  def run(self, poll_interval=0.1):
+    """Runs all the submitted jobs, and returns True if all of them succeeded.
+       The jobs that depend on a failed job are not run."""
+    queue = []
+    running = []
+    while True:
+      # Schedules the tasks of the jobs whose dependencies are satisfied
+      for job in self.jobs:
+        if job.status != 'waiting': continue
+        deps_status = [self.jobs[d-1].status for d in job.deps]
+        if 'failure' in deps_status:
+          print("Skipping job %s, since one of its dependencies failed." % job)
+          job.status = 'failure'
+        elif all([s == 'success' for s in deps_status]):
+          print("Running job %s..." % job)
+          job.status = 'running'
+          queue.extend([(job, task) for task in job.tasks])
+
+      # Starts as many tasks as possible
+      while len(queue) > 0 and len(running) < self.n_processes:
+        (job, task) = queue.pop(0)
+        running.append(self._start(job, task))
+
+      if len(running) == 0:
+        break
+
+      # Checks which tasks have finished
+      time.sleep(poll_interval)
+      still_running = []
+      for r in running:
+        (process, job, task, stdout, stderr) = r
+        if process.poll() is None:
+          still_running.append(r)
+          continue
+        stdout.close()
+        stderr.close()
+        job.n_finished += 1
+        if process.returncode != 0:
+          job.n_failed += 1
+          print("Job %s failed (task %s, return code %d)." % (job, task, process.returncode))
+        if job.n_finished == len(job.tasks):
+          if job.n_failed > 0: job.status = 'failure'
+          else: job.status = 'success'
+      running = still_running
+
+    return all([job.status == 'success' for job in self.jobs])
@@ -19,6 +19,7 @@
 import bob
 import numpy
 import os
+from . import utils
 
 def train(data, d, nf, ng, n_iter,
   seed, init_f_method, init_f_ratio, init_g_method, init_g_ratio, init_s_method, init_s_ratio):
@@ -45,10 +46,72 @@ def enroll_model(data, pldabase):
   trainer.enrol(machine, data)
   return machine
 
+def enroll_models_batch(data_list, pldabase):
+  """Enrols a set of identities at once, given a list of 2D arrays (one per
+     identity, one sample per row) and the trained PLDABase. Rather than
+     PLDAMachines, only the quantities required for scoring are returned,
+     as by model_statistics: (n_samples, weighted_sums, offsets)."""
+  n_samples = numpy.array([d.shape[0] for d in data_list], dtype=numpy.int64)
+  starts = numpy.concatenate(([0], numpy.cumsum(n_samples)[:-1]))
+  # All the (centered) enrollment samples
+  X = numpy.vstack(data_list) - pldabase.mu
+  # Sums of F^T.beta.(x-mu) over the samples of each identity
+  weighted_sums = numpy.add.reduceat(numpy.dot(X, pldabase.__ft_beta__.T), starts, axis=0)
+  # The offset is w_sum_xit_beta_xi minus the log-likelihood of the samples,
+  # which simplifies into -(log-likelihood constant term + 1/2.w^T.gamma.w)
+  offsets = numpy.ndarray(shape=(len(data_list),), dtype=numpy.float64)
+  for n in numpy.unique(n_samples):
+    rows = numpy.where(n_samples == n)[0]
+    W = weighted_sums[rows]
+    offsets[rows] = -pldabase.get_add_log_like_const_term(int(n)) - 0.5 * (numpy.dot(W, pldabase.get_add_gamma(int(n))) * W).sum(axis=1)
+  return (n_samples, weighted_sums, offsets)
+
+def model_bank_dtype(dim_f, id_length):
+  """Returns the record type of a model bank, which stores for each enrolled
+     model the quantities required for scoring (the ids being strings of at
+     most id_length characters)"""
+  return numpy.dtype([('id', 'U%d' % max(1, id_length)), ('n_samples', numpy.int64), ('offset', numpy.float64), ('weighted_sum', numpy.float64, (dim_f,))])
+
+def save_model_bank(filename, model_ids, n_samples, weighted_sums, offsets):
+  """Saves the statistics of a set of enrolled models into a single '.npy'
+     file (a 1D array of records, one per model)"""
+  ids = [str(m) for m in model_ids]
+  # The id field is as long as the longest id, such that no id is truncated
+  bank = numpy.ndarray(shape=(len(ids),), dtype=model_bank_dtype(weighted_sums.shape[1], max([len(m) for m in ids] + [1])))
+  bank['id'] = ids
+  bank['n_samples'] = n_samples
+  bank['offset'] = offsets
+  bank['weighted_sum'] = weighted_sums
+  f = open(filename + '.tmp', 'wb')
+  numpy.save(f, bank)
+  f.close()
+  os.rename(filename + '.tmp', filename)
+
+def load_model_bank(filename, mmap_mode='r'):
+  """Opens a model bank (as a memory map by default)"""
+  if not os.path.exists(filename):
+    raise RuntimeError("Cannot find PLDA model bank %s" % (filename))
+  return numpy.load(filename, mmap_mode=mmap_mode)
+
+def model_bank_statistics(bank, model_ids):
+  """Retrieves the statistics of the given models from a model bank, as
+     returned by model_statistics: (n_samples, weighted_sums, offsets)"""
+  index = dict([(str(m), i) for i, m in enumerate(bank['id'])])
+  rows = []
+  for m in model_ids:
+    if not str(m) in index:
+      raise RuntimeError("Cannot find PLDA model %s in the model bank" % str(m))
+    rows.append(index[str(m)])
+  records = bank[numpy.array(rows, dtype=numpy.int64)]
+  return (records['n_samples'], records['weighted_sum'], records['offset'])
+
+def _load_plda_base(plda_model_filename):
+  return bob.machine.PLDABase(bob.io.HDF5File(plda_model_filename))
+
 def load_base_model(plda_model_filename):
   if not os.path.exists(plda_model_filename):
     raise RuntimeError("Cannot find PLDA Base Model %s" % (plda_model_filename))
-  return bob.machine.PLDABase(bob.io.HDF5File(plda_model_filename))
+  return utils.cached_load(plda_model_filename, _load_plda_base)
 
 def load_model(plda_model_filename, pldabase):
   if not os.path.exists(plda_model_filename):
@@ -61,3 +124,44 @@ def compute_scores(machine, probe_tests):
     A[i] = machine.forward(probe_tests[i])
   return A
 
+
+def model_statistics(machines):
+  """Gathers the quantities of a list of enrolled PLDAMachines that are
+     required to score probes against them: the number of enrollment
+     samples, the weighted sum of the enrollment samples (F^T.beta.(x-mu))
+     and the offset (sum_i -1/2.(x_i-mu)^T.beta.(x_i-mu) minus the
+     log-likelihood of the enrollment samples)."""
+  n_samples = numpy.ndarray(shape=(len(machines),), dtype=numpy.int64)
+  weighted_sums = numpy.ndarray(shape=(len(machines), machines[0].dim_f), dtype=numpy.float64)
+  offsets = numpy.ndarray(shape=(len(machines),), dtype=numpy.float64)
+  for i, machine in enumerate(machines):
+    n_samples[i] = machine.n_samples
+    weighted_sums[i] = machine.weighted_sum
+    offsets[i] = machine.w_sum_xit_beta_xi - machine.log_likelihood
+  return (n_samples, weighted_sums, offsets)
+
+def compute_scores_batch(pldabase, n_samples, weighted_sums, offsets, probe_tests):
+  """Computes the log-likelihood ratio scores of all the probes against all
+     the models (as returned by model_statistics), and returns them as a
+     (n_models x n_probes) 2D array. This is equivalent to calling
+     PLDAMachine.forward for each pair, but relies on matrix operations:
+     the probe-side terms are computed once for all the models, and the
+     model-side terms once for each number of enrollment samples."""
+  # Projected probes: u = F^T.beta.(x-mu)
+  U = numpy.dot(numpy.asarray(probe_tests) - pldabase.mu, pldabase.__ft_beta__.T)
+  gamma_1 = pldabase.get_add_gamma(1)
+  const_1 = pldabase.get_add_log_like_const_term(1)
+  scores = numpy.ndarray(shape=(len(n_samples), U.shape[0]), dtype=numpy.float64)
+  for n in numpy.unique(n_samples):
+    rows = numpy.where(n_samples == n)[0]
+    gamma_n = pldabase.get_add_gamma(int(n) + 1)
+    W = weighted_sums[rows]
+    WG = numpy.dot(W, gamma_n)
+    # Model-side terms
+    model_terms = pldabase.get_add_log_like_const_term(int(n) + 1) - const_1 + offsets[rows] + 0.5 * (WG * W).sum(axis=1)
+    # Probe-side terms
+    probe_terms = 0.5 * (numpy.dot(U, gamma_n - gamma_1) * U).sum(axis=1)
+    scores[rows] = numpy.dot(WG, U.T)
+    scores[rows] += model_terms[:,numpy.newaxis]
+    scores[rows] += probe_terms[numpy.newaxis,:]
+  return scores
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent index of a protocol.
+
+The index stores, for each group of a protocol, the (sorted) list of models
+and, for each model, its enrollment and probe samples. It is built once
+(which requires a database query per model), and saved to a file, from
+which it is then loaded by the scripts instead of querying the database.
+It also provides the mapping from the index of a scoring array job to the
+model and the split of probes it should process.
+"""
+
+import os
+import math
+import pickle
+from . import utils
+
+class Sample(object):
+  """Lightweight copy of a database File object, which provides the
+     attributes used by the scripts"""
+
+  def __init__(self, f):
+    self.id = f.id
+    self.path = str(f.path)
+    self.client_id = f.client_id
+    if hasattr(f, 'claimed_id'): self.claimed_id = f.claimed_id
+
+  def make_path(self, directory=None, extension=None):
+    return os.path.join(directory or '', self.path + (extension or ''))
+
+
+class ProtocolIndex(object):
+  """Models, enrollment and probe samples of the groups of a protocol"""
+
+  def __init__(self, protocol):
+    self.protocol = protocol
+    self.groups = {}
+
+  def add_group(self, db, group):
+    """Queries the database for the models of a group and their samples"""
+    models_ids = sorted(db.model_ids(protocol=self.protocol, groups=group))
+    enrol = {}
+    probe = {}
+    for model_id in models_ids:
+      enrol[model_id] = [Sample(f) for f in db.objects(protocol=self.protocol, model_ids=(model_id,), purposes='enrol')]
+      probe[model_id] = [Sample(f) for f in sorted(db.objects(groups=group, protocol=self.protocol, purposes='probe', model_ids=(model_id,)), key=lambda f: f.path)]
+    self.groups[group] = {'model_ids': models_ids, 'enrol': enrol, 'probe': probe}
+
+  def _group(self, group):
+    if not group in self.groups:
+      raise RuntimeError("Group '%s' is not in the index of protocol '%s'" % (group, self.protocol))
+    return self.groups[group]
+
+  def model_ids(self, group):
+    """Returns the (sorted) list of models of a group"""
+    return list(self._group(group)['model_ids'])
+
+  def enrol_samples(self, group, model_id):
+    """Returns the list of enrollment samples of a model"""
+    return list(self._group(group)['enrol'][model_id])
+
+  def probe_samples(self, group, model_id):
+    """Returns the (sorted by path) list of probe samples of a model"""
+    return list(self._group(group)['probe'][model_id])
+
+  def task_map(self, group, n_max_probes_per_job):
+    """Returns the list of (model_id, probes_split_id) processed by each
+       task of a scoring array job, in the order of the tasks"""
+    tasks = []
+    for model_id in self._group(group)['model_ids']:
+      n_probes_for_model = len(self._group(group)['probe'][model_id])
+      n_splits_for_model = int(math.ceil(n_probes_for_model / float(n_max_probes_per_job)))
+      tasks.extend([(model_id, k) for k in range(n_splits_for_model)])
+    return tasks
+
+
+def build(db, protocol, groups=('dev', 'eval')):
+  """Builds the index of the given groups of a protocol"""
+  index = ProtocolIndex(protocol)
+  for group in groups:
+    index.add_group(db, group)
+  return index
+
+def save(index, filename):
+  """Saves an index (atomically, since several jobs may try to write it)"""
+  utils.ensure_dir(os.path.dirname(filename))
+  tmp_filename = filename + '.tmp%d' % os.getpid()
+  f = open(tmp_filename, 'wb')
+  pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+  f.close()
+  os.rename(tmp_filename, filename)
+
+def load(filename):
+  """Loads an index"""
+  f = open(filename, 'rb')
+  index = pickle.load(f)
+  f.close()
+  return index
+
+def get(db, protocol, filename, groups=('dev', 'eval'), force=False):
+  """Loads the index from the given file. It is first built (or completed
+     with the missing groups) and saved if required."""
+  if not force and os.path.exists(filename):
+    index = utils.cached_load(filename, load)
+  else:
+    index = ProtocolIndex(protocol)
+  missing = [g for g in groups if not g in index.groups]
+  if len(missing) > 0:
+    print("Building the index of protocol '%s' for group(s) %s." % (protocol, ', '.join(missing)))
+    for group in missing:
+      index.add_group(db, group)
+    save(index, filename)
+  return index
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+# Sun Oct 18 21:37:12 CEST 2026
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import argparse
+from .. import utils, annotations
+
+def main(argv=None):
+  """Builds the annotation index of the samples of a protocol, which has to
+     exist before submitting the grid jobs that use it"""
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-c', '--config-file', metavar='FILE', type=str,
+      dest='config_file', default='xbob/paper/tpami2013/config_multipie.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
+  parser.add_argument('--annotation-dir', metavar='STR', type=str,
+      dest='pos_input_dir', default='/idiap/group/biometric/annotations/multipie', help='The directory containing the input annotations.')
+  parser.add_argument('--annotation-ext', metavar='STR', type=str,
+      dest='pos_input_ext', default='.pos', help='The extension of the input annotations.')
+  parser.add_argument('--output-dir', metavar='STR', type=str,
+      dest='output_dir', default='output', help='The base output directory for everything (models, scores, etc.).')
+  parser.add_argument('-p', '--protocol', metavar='STR', type=str, nargs='+',
+      dest='protocol', default=None, help='The protocols of the database whose samples are added to the index. Default is the value in the configuration file.')
+  parser.add_argument('-f', '--force', dest='force', action='store_true',
+      default=False, help='Force to erase former data if already exist')
+  args = parser.parse_args(argv)
+
+  # Loads the configuration
+  config = utils.load_config(args.config_file)
+  # Update command line options if required
+  if args.protocol: protocols = args.protocol
+  else: protocols = [config.protocol]
+
+  # Samples of all the protocols
+  inputs_list = []
+  for protocol in protocols:
+    inputs_list.extend(config.db.objects(protocol=protocol))
+
+  filename = os.path.join(args.output_dir, config.annotation_index_filename)
+  index = annotations.get(filename, inputs_list, args.pos_input_dir, args.pos_input_ext, force=args.force)
+  print("The annotation index %s contains %d sample(s)." % (filename, len(index)))
+
+if __name__ == "__main__":
+  main()
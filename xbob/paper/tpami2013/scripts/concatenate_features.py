@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+# Sun Oct 18 10:12:37 CEST 2026
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+from .. import featurestore
+
+def main(argv=None):
+  """Concatenate the shards of a feature store after splitting the computation process using an SGE grid"""
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--features-dir', metavar='STR', type=str,
+      dest='features_dir', required=True, help='The directory of the feature store to concatenate.')
+  parser.add_argument('--grid', dest='grid', action='store_true',
+      default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
+  args = parser.parse_args(argv)
+
+  if not featurestore.is_feature_store(args.features_dir):
+    raise RuntimeError("Cannot find any feature store in %s" % args.features_dir)
+  print("Concatenating the shards of feature store %s." % args.features_dir)
+  featurestore.concatenate(args.features_dir)
+
+if __name__ == "__main__":
+  main()
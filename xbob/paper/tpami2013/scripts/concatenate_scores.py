@@ -18,11 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import imp 
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """Concatenate scores after splitting the computation process using an SGE grid"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -40,10 +39,10 @@ def main():
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
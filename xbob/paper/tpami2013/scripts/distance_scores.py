@@ -18,11 +18,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import imp
 import argparse
-from .. import utils
+import numpy
+from .. import utils, protocol_index
 
-def main():
+def main(argv=None):
   """Compute scores using a distance approach"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -37,17 +37,23 @@ def main():
   parser.add_argument('--algorithm-dir', metavar='FILE', type=str,
       dest='algorithm_dir', default='default_algorithm', help='The relative directory of the algorithm that will contain the models and the scores. It is appended to the given output directory and the protocol.')
   parser.add_argument('--distance', metavar='STR', type=str,
-      dest='distance', default='euclidean', help='The distance to use, when computing scores.')
+      dest='distance', default='euclidean', choices=utils.DISTANCES, help='The distance to use, when computing scores.')
+  parser.add_argument('--block-size', metavar='INT', type=int,
+      dest='block_size', default=0, help='The number of probes for which the distances are computed at once. Default is to choose it such that the temporary arrays remain of bounded size.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--probe-once', dest='probe_once', action='store_true',
+      default=False, help='If set, the union of the probes of all the models to process is loaded once, and each model is scored against its own probes using index arrays, the models sharing the same probes being scored together.')
+  parser.add_argument('--protocol-index', dest='protocol_index', action='store_true',
+      default=False, help='If set, the models and their probes are retrieved from the index of the protocol (built and saved into the output directory if required), rather than by querying the database.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='If set, assumes it is being run using a parametric grid job. It orders all ids to be processed and picks the one at the position given by ${SGE_TASK_ID}-1')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -58,26 +64,38 @@ def main():
   else: groups = args.group
 
   # (sorted) list of models
-  models_ids = sorted(config.db.model_ids(protocol=protocol, groups=args.group))
+  if args.protocol_index:
+    index = protocol_index.get(config.db, protocol, os.path.join(args.output_dir, protocol, config.protocol_index_filename), groups=(args.group,))
+    models_ids = index.model_ids(args.group)
+  else:
+    models_ids = sorted(config.db.model_ids(protocol=protocol, groups=args.group))
 
   # finally, if we are on a grid environment, just find what I have to process.
   probes_split_id = 0
   if args.grid:
     import math
-    n_splits = 0
-    found = False
     pos = int(os.environ['SGE_TASK_ID']) - 1
-    for model_id in models_ids:
-      n_probes_for_model = len(config.db.objects(groups=args.group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
-      n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
-      if pos < n_splits + n_splits_for_model:
-        models_ids = [model_id]
-        probes_split_id = pos - n_splits
-        found = True
-        break
-      n_splits += n_splits_for_model
-    if found == False:
-      raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_splits))
+    if args.protocol_index:
+      # Finds the model and the split of probes of this task in the index
+      tasks = index.task_map(args.group, config.n_max_probes_per_job)
+      if pos >= len(tasks):
+        raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, len(tasks)))
+      (model_id, probes_split_id) = tasks[pos]
+      models_ids = [model_id]
+    else:
+      n_splits = 0
+      found = False
+      for model_id in models_ids:
+        n_probes_for_model = len(config.db.objects(groups=args.group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
+        n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
+        if pos < n_splits + n_splits_for_model:
+          models_ids = [model_id]
+          probes_split_id = pos - n_splits
+          found = True
+          break
+        n_splits += n_splits_for_model
+      if found == False:
+        raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_splits))
 
 
   sc_nonorm_filename = os.path.join(args.output_dir, protocol, args.algorithm_dir, config.scores_nonorm_dir, "scores-" + args.group)
@@ -87,6 +105,10 @@ def main():
   elif not args.grid and os.path.exists(sc_nonorm_filename):
     print("Scores file '%s' already exists." % sc_nonorm_filename)
   else:
+    # Models to be scored together, indexed by their list of probes
+    batches = {}
+    batches_keys = []
+
     # Loops over the model ids
     for model_id in models_ids:
       print("Computing score for model '%s'." % model_id)
@@ -102,22 +124,34 @@ def main():
         print("Scores file '%s' already exists." % sc_nonorm_filename)
       else:
         # Gets the probe sample list
-        probe_filenames = sorted(config.db.objects(groups=args.group, protocol=protocol, purposes="probe", model_ids=(model_id,)), key=lambda f: f.path)
+        if args.protocol_index: probe_filenames = index.probe_samples(args.group, model_id)
+        else: probe_filenames = sorted(config.db.objects(groups=args.group, protocol=protocol, purposes="probe", model_ids=(model_id,)), key=lambda f: f.path)
         
         # If we are on a grid environment, just keep the required split of samples
         if args.grid:
           probe_filenames_g = utils.split_list(probe_filenames, config.n_max_probes_per_job)
           probe_filenames = probe_filenames_g[probes_split_id]
 
-        # Loads the probes
-        (probe_tests, probe_client_ids) = utils.load_probes(probe_filenames, features_dir, config.features_ext)
-
         # Loads the client model
         model_path = os.path.join(args.output_dir, protocol, args.algorithm_dir, config.models_dir, str(model_id) + ".hdf5")
         model = utils.load_model(model_path)
 
+        # Probe-once mode: the scores are computed once all the models are loaded
+        if args.probe_once:
+          key = tuple([str(x.path) for x in probe_filenames])
+          if not key in batches:
+            batches[key] = (probe_filenames, [], [], [])
+            batches_keys.append(key)
+          batches[key][1].append(model_id)
+          batches[key][2].append(model)
+          batches[key][3].append(sc_nonorm_filename)
+          continue
+
+        # Loads the probes
+        (probe_tests, probe_client_ids) = utils.load_probes(probe_filenames, features_dir, config.features_ext)
+
         # Computes the scores of all the probes against the model and put them in A
-        A = utils.compute_distance_scores(model, probe_tests, args.distance)
+        A = utils.compute_distance_scores_batch(model, probe_tests, args.distance, args.block_size)
 
         # Saves model_scores to text file
         if args.grid:
@@ -125,5 +159,22 @@ def main():
         else:
           utils.save_scores_to_textfile(A, probe_filenames, model_id, sc_nonorm_filename, True)
 
+    if len(batches_keys) > 0:
+      # Loads the union of the probes of all the models
+      (union_tests, union_indices) = utils.load_probe_union([batches[key][0] for key in batches_keys], features_dir, config.features_ext)
+
+    for b, key in enumerate(batches_keys):
+      (probe_filenames, batch_models_ids, models, sc_filenames) = batches[key]
+      print("Computing scores of %d model(s) against %d probe(s)." % (len(batch_models_ids), len(probe_filenames)))
+      # Computes the scores of all the probes against all the models
+      A = utils.compute_distance_scores_batch(numpy.vstack(models), union_tests[union_indices[b]], args.distance, args.block_size)
+
+      # Saves model_scores to text file
+      for i, model_id in enumerate(batch_models_ids):
+        if args.grid:
+          utils.save_scores_to_textfile(A[i], probe_filenames, model_id, sc_filenames[i])
+        else:
+          utils.save_scores_to_textfile(A[i], probe_filenames, model_id, sc_filenames[i], True)
+
 if __name__ == "__main__": 
   main()
@@ -17,13 +17,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import os
 import subprocess
-import imp
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """PLDA experiments required to reproduce first value in Table 2 of the article (on LFW)"""
   # Parses options
   parser = argparse.ArgumentParser(description=__doc__,
@@ -32,6 +30,8 @@ def main():
       dest='config_file', default='xbob/paper/tpami2013/config_lfw.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
   parser.add_argument('--pca-n-outputs', metavar='INT', type=int,
      dest='pca_n_outputs', default=None, help='The rank of the PCA subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
+  parser.add_argument('--pca-n-outputs-sweep', metavar='INT', type=int, nargs='+',
+     dest='pca_n_outputs_sweep', default=None, help='If set, the PCA subspace of each fold is trained and the features projected only once (using the largest rank), and the PLDA toolchain is run for each of these ranks, on the leading columns of the projected features.')
   parser.add_argument('--plda-nf', metavar='INT', type=int,
      dest='plda_nf', default=None, help='The dimensionality of the F subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
   parser.add_argument('--plda-ng', metavar='INT', type=int,
@@ -48,16 +48,19 @@ def main():
       dest='plda_dir', default=None, help='The subdirectory where the PLDA data are stored. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is appended to the given output directory and the protocol.')
   parser.add_argument('--plda-model-filename', metavar='STR', type=str,
       dest='plda_model_filename', default=None, help='The (relative) filename of the PLDABase model. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is then appended to the given output directory, the protocol and the plda directory.')
+  parser.add_argument('--shared-pca-statistics', dest='shared_pca_statistics', action='store_true',
+      default=False, help='If set, the PCA models of the 10 folds are first trained at once (by a single grid job with --grid), from the statistics of the 10 subsets of training samples: each sample is loaded once, and the training statistics of a fold are the merge of the ones of the 9 subsets it contains.')
   parser.add_argument('-g', '--group', metavar='STR', type=str, nargs='+',
       dest='group', default=['dev','eval'], help='Database group (\'dev\' or \'eval\') for which to enroll models and compute scores.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='Run the script using the gridtk on an SGE infrastructure.')
-  args = parser.parse_args()
+  utils.add_local_argument(parser)
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.pca_n_outputs: pca_n_outputs = args.pca_n_outputs
   else: pca_n_outputs = config.pca_n_outputs
@@ -79,9 +82,36 @@ def main():
   if utils.check_string(args.group): groups = [args.group]
   else: groups = args.group
 
+  protocols = ['view2-fold%s' % k for k in range(1,11)]
+
+  # Trains the PCA models of the 10 folds at once if required
+  if args.shared_pca_statistics:
+    if args.pca_n_outputs_sweep: pca_train_n_outputs = max(args.pca_n_outputs_sweep)
+    else: pca_train_n_outputs = pca_n_outputs
+    cmd_pcatrain = [
+                    './bin/pca_train.py',
+                    '--config-file=%s' % args.config_file,
+                    '--n-outputs=%d' % pca_train_n_outputs,
+                    '--output-dir=%s' % args.output_dir,
+                    '--features-dir=%s' % features_dir,
+                    '--pca-dir=%s' % pca_dir,
+                    '--pca-model-filename=%s' % pca_model_filename,
+                   ]
+    cmd_pcatrain.append('--protocols')
+    cmd_pcatrain.extend(protocols)
+    if args.force: cmd_pcatrain.append('--force')
+    (jm, split) = utils.job_manager(args)
+    if split:
+      job_pcatrain = utils.submit(jm, cmd_pcatrain, dependencies=[], array=None, queue='q1d', mem='8G', hostname='!cicatrix')
+      print('submitted: %s' % job_pcatrain)
+      # The local job is run before the toolchains of the folds
+      utils.run_local_jobs(jm, args)
+    else:
+      print('Running PCA training of the %d folds...' % len(protocols))
+      subprocess.call(cmd_pcatrain)
+
   # Run the PLDA toolchain for the 10 folds protocols
-  for k in range(1,11):
-    protocol = 'view2-fold%s' % k
+  for protocol in protocols:
     cmd_plda = [ 
                 './bin/toolchain_pcaplda.py',
                 '--config-file=%s' % args.config_file, 
@@ -96,11 +126,18 @@ def main():
                 '--plda-model-filename=%s' % plda_model_filename,
                 '--protocol=%s' % protocol,
                ]
+    if args.pca_n_outputs_sweep:
+      cmd_plda.append('--pca-n-outputs-sweep')
+      cmd_plda.extend(['%d' % n for n in args.pca_n_outputs_sweep])
     sgroups = ['--group']
     sgroups.extend(groups)
     cmd_plda.extend(sgroups)
+    if args.shared_pca_statistics:
+      cmd_plda.append('--skip-pca-training')
+      if args.grid: cmd_plda.append('--pca-dependencies=%d' % job_pcatrain.id())
     if args.force: cmd_plda.append('--force')
     if args.grid: cmd_plda.append('--grid')
+    if args.local > 0: cmd_plda.append('--local=%d' % args.local)
     subprocess.call(cmd_plda)
 
 if __name__ == '__main__':
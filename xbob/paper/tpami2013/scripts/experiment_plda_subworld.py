@@ -19,11 +19,10 @@
 
 import os
 import subprocess
-import imp
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """PLDA experiments required to reproduce Figure 2 of the article"""
 
   # Parses options
@@ -47,10 +46,10 @@ def main():
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='Run the script using the gridtk on an SGE infrastructure.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.nf == 0: plda_nf = config.plda_nf
   else: plda_nf = args.nf
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+# Sun Oct 18 17:02:44 CEST 2026
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import argparse
+from .. import features, utils, annotations
+
+def main(argv=None):
+  """Crops the faces, and saves them into a feature store, from which the
+     LBP histograms features can then be extracted"""
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-c', '--config-file', metavar='FILE', type=str,
+      dest='config_file', default='xbob/paper/tpami2013/config_multipie.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
+  parser.add_argument('--image-dir', metavar='STR', type=str,
+      dest='img_input_dir', default='/idiap/resource/database/Multi-Pie/data', help='The directory containing the input images.')
+  parser.add_argument('--image-ext', metavar='STR', type=str,
+      dest='img_input_ext', default='.png', help='The extension of the input images.')
+  parser.add_argument('--annotation-dir', metavar='STR', type=str,
+      dest='pos_input_dir', default='/idiap/group/biometric/annotations/multipie', help='The directory containing the input annotations.')
+  parser.add_argument('--annotation-ext', metavar='STR', type=str,
+      dest='pos_input_ext', default='.pos', help='The extension of the input annotations.')
+  parser.add_argument('--output-dir', metavar='STR', type=str,
+      dest='output_dir', default='output', help='The base output directory for everything (models, scores, etc.).')
+  parser.add_argument('--crops-dir', metavar='STR', type=str,
+      dest='crops_dir', default=None, help='The directory for the feature store of the cropped faces. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('-p', '--protocol', metavar='STR', type=str,
+      dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--lbph-engine', metavar='STR', type=str, choices=features.LBPH_ENGINES,
+      dest='lbph_engine', default='bob', help='The engine used to crop the faces: \'bob\' processes the images one by one, whereas \'numpy\' processes batches of images at once (defaults to "%(default)s").')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=1, help='The number of images processed at once (defaults to "%(default)s").')
+  parser.add_argument('--annotation-index', dest='annotation_index', action='store_true',
+      default=False, help='If set, the eye positions are read from the annotation index of the output directory, rather than from one annotation file per image. The index is built from the annotation files if required, except by the grid jobs, which expect it to be built beforehand (see annotation_index.py).')
+  parser.add_argument('-f', '--force', dest='force', action='store_true',
+      default=False, help='Force to erase former data if already exist')
+  parser.add_argument('--grid', dest='grid', action='store_true',
+      default=False, help='If set, assumes it is being run using a parametric grid job. It orders all ids to be processed and picks the one at the position given by ${SGE_TASK_ID}-1')
+  args = parser.parse_args(argv)
+
+  # Loads the configuration 
+  config = utils.load_config(args.config_file)
+  # Update command line options if required
+  if args.protocol: protocol = args.protocol
+  else: protocol = config.protocol
+  # Directory containing the cropped faces
+  if args.crops_dir: crops_dir = args.crops_dir
+  else: crops_dir = os.path.join(args.output_dir, protocol, config.crops_dir)
+
+  # Database python objects (sorted by keys in case of SGE grid usage)
+  inputs_list = sorted(config.db.objects(protocol=protocol), key=lambda f: f.path)
+
+  # finally, if we are on a grid environment, just find what I have to process.
+  store_shard = 0
+  if args.grid:
+    import math
+    pos = int(os.environ['SGE_TASK_ID']) - 1 
+    n_jobs = int(math.ceil(len(inputs_list) / float(config.n_max_files_per_job)))
+    
+    if pos >= n_jobs:
+      raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_jobs))
+    inputs_lits_g = utils.split_list(inputs_list, config.n_max_files_per_job)[pos]
+    inputs_list = inputs_lits_g
+    store_shard = pos
+
+  # Annotation index (only read by the grid jobs, which run concurrently)
+  annotation_index = None
+  if args.annotation_index:
+    annotation_index = os.path.join(args.output_dir, config.annotation_index_filename)
+    if args.grid: annotations.require(annotation_index, inputs_list)
+    else: annotations.get(annotation_index, inputs_list, args.pos_input_dir, args.pos_input_ext)
+
+  # Checks that the directory for storing the cropped faces exists
+  utils.ensure_dir(crops_dir)
+
+  features.crop_faces(inputs_list, args.img_input_dir, args.img_input_ext, args.pos_input_dir, args.pos_input_ext, crops_dir,
+                      config.crop_eyes_d, config.crop_h, config.crop_w, config.crop_oh, config.crop_ow,
+                      force = args.force, store_shard = store_shard, engine = args.lbph_engine, batch_size = args.batch_size, annotation_index = annotation_index)
+
+if __name__ == "__main__": 
+  main()
+ 
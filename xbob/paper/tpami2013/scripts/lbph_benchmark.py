@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+# Sun Oct 18 15:41:09 CEST 2026
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import argparse
+import numpy
+import bob
+from .. import utils, lbp, tantriggs, facenorm
+
+def benchmark_lbph(config, args, rng):
+  """Compares the bob and NumPy LBP histograms on random preprocessed images"""
+  lbph_params = (config.block_h, config.block_w, config.block_oh, config.block_ow,
+                 config.radius, config.p_n, config.circular, config.to_average, config.add_average_bit, config.uniform, config.rot_inv)
+
+  # Random (preprocessed) images
+  images = rng.randint(0, 256, size=(args.n_images, config.crop_h, config.crop_w)).astype(numpy.uint8)
+
+  # bob engine (one image at a time)
+  lbphs = bob.ip.LBPHSFeatures(*lbph_params)
+  start = time.time()
+  data_bob = numpy.vstack([numpy.hstack(lbphs(images[i])).astype(numpy.float64) for i in range(args.n_images)])
+  time_bob = time.time() - start
+
+  # NumPy engine (by blocks of images)
+  lbphs_np = lbp.LBPHS(*lbph_params)
+  data_np = numpy.ndarray(shape=(args.n_images, lbphs_np.n_features(config.crop_h, config.crop_w)), dtype=numpy.float64)
+  start = time.time()
+  for b in range(0, args.n_images, args.batch_size):
+    lbphs_np(images[b:b+args.batch_size], data_np[b:b+args.batch_size])
+  time_np = time.time() - start
+
+  return (time_bob, time_np, data_bob, data_np)
+
+def benchmark_tantriggs(config, args, rng):
+  """Compares the bob and NumPy Tan and Triggs preprocessing on random cropped images"""
+  tt_params = (config.gamma, config.sigma0, config.sigma1, config.size, config.threshold, config.alpha)
+
+  # Random (cropped) images
+  images = rng.randint(0, 256, size=(args.n_images, config.crop_h, config.crop_w)).astype(numpy.float64)
+
+  # bob engine (one image at a time)
+  tt = bob.ip.TanTriggs(*tt_params)
+  preprocessed_img = numpy.ndarray(shape=(config.crop_h, config.crop_w), dtype=numpy.float64)
+  data_bob = numpy.ndarray(shape=images.shape, dtype=numpy.uint8)
+  start = time.time()
+  for i in range(args.n_images):
+    tt(images[i], preprocessed_img)
+    data_bob[i] = bob.core.convert(preprocessed_img, dtype=numpy.uint8, source_range=(-config.threshold,config.threshold))
+  time_bob = time.time() - start
+
+  # NumPy engine (by blocks of images)
+  tt_np = tantriggs.TanTriggs(*tt_params)
+  data_np = numpy.ndarray(shape=images.shape, dtype=numpy.uint8)
+  start = time.time()
+  for b in range(0, args.n_images, args.batch_size):
+    tt_np(images[b:b+args.batch_size], data_np[b:b+args.batch_size])
+  time_np = time.time() - start
+
+  return (time_bob, time_np, data_bob.reshape(args.n_images, -1).astype(numpy.float64), data_np.reshape(args.n_images, -1).astype(numpy.float64))
+
+def benchmark_crop(config, args, rng):
+  """Compares the bob and NumPy face cropping on random images and eye positions"""
+  crop_params = (config.crop_eyes_d, config.crop_h, config.crop_w, config.crop_oh, config.crop_ow)
+
+  # Random images (of the size of the Multi-PIE ones) and eye positions
+  images = rng.randint(0, 256, size=(args.n_images, 480, 640)).astype(numpy.float64)
+  eyes = numpy.vstack([rng.uniform(200, 260, args.n_images), rng.uniform(260, 300, args.n_images),
+                       rng.uniform(200, 260, args.n_images), rng.uniform(340, 380, args.n_images)]).T
+
+  # bob engine (one image at a time)
+  fen = bob.ip.FaceEyesNorm(*crop_params)
+  data_bob = numpy.ndarray(shape=(args.n_images, config.crop_h, config.crop_w), dtype=numpy.float64)
+  start = time.time()
+  for i in range(args.n_images):
+    fen(images[i], data_bob[i], eyes[i,0], eyes[i,1], eyes[i,2], eyes[i,3])
+  time_bob = time.time() - start
+
+  # NumPy engine (by blocks of images)
+  fen_np = facenorm.FaceEyesNorm(*crop_params)
+  data_np = numpy.ndarray(shape=(args.n_images, config.crop_h, config.crop_w), dtype=numpy.float64)
+  start = time.time()
+  for b in range(0, args.n_images, args.batch_size):
+    fen_np(images[b:b+args.batch_size], eyes[b:b+args.batch_size], data_np[b:b+args.batch_size])
+  time_np = time.time() - start
+
+  return (time_bob, time_np, data_bob.reshape(args.n_images, -1), data_np.reshape(args.n_images, -1))
+
+BENCHMARKS = {'lbph': benchmark_lbph, 'tantriggs': benchmark_tantriggs, 'crop': benchmark_crop}
+
+def main(argv=None):
+  """Compares the throughput (and the output) of the bob and NumPy engines
+     for the LBP histograms, the Tan and Triggs preprocessing or the face
+     cropping"""
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-c', '--config-file', metavar='FILE', type=str,
+      dest='config_file', default='xbob/paper/tpami2013/config_multipie.py', help='Filename of the configuration file with the LBP parameters (defaults to "%(default)s")')
+  parser.add_argument('--stage', type=str, choices=sorted(BENCHMARKS.keys()),
+      dest='stage', default='lbph', help='The processing stage to benchmark (defaults to "%(default)s").')
+  parser.add_argument('--n-images', metavar='INT', type=int,
+      dest='n_images', default=1000, help='The number of (random) images to process (defaults to "%(default)s").')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=256, help='The number of images processed at once by the NumPy engine (defaults to "%(default)s").')
+  parser.add_argument('--seed', metavar='INT', type=int,
+      dest='seed', default=0, help='The seed of the random generator of the images (defaults to "%(default)s").')
+  args = parser.parse_args(argv)
+
+  # Loads the configuration
+  config = utils.load_config(args.config_file)
+  rng = numpy.random.RandomState(args.seed)
+  (time_bob, time_np, data_bob, data_np) = BENCHMARKS[args.stage](config, args, rng)
+
+  print("bob engine:   %.1f images/s" % (args.n_images / time_bob))
+  print("NumPy engine: %.1f images/s (batches of %d images)" % (args.n_images / time_np, args.batch_size))
+  if data_bob.shape != data_np.shape:
+    raise RuntimeError("The outputs of the two engines have different shapes (%s and %s)" % (str(data_bob.shape), str(data_np.shape)))
+  n_diff = numpy.sum(numpy.any(data_bob != data_np, axis=1))
+  print("Images with different outputs: %d/%d (largest difference: %g)" % (n_diff, args.n_images, numpy.abs(data_bob - data_np).max()))
+
+if __name__ == "__main__":
+  main()
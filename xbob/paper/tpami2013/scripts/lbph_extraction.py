@@ -19,10 +19,9 @@
 
 import os
 import argparse
-import imp 
-from .. import features, utils
+from .. import features, utils, annotations
 
-def main():
+def main(argv=None):
   """Run the LBP Histograms feature extraction"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -42,14 +41,30 @@ def main():
       dest='features_dir', default=None, help='The subdirectory for the output features. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--crops-dir', metavar='STR', type=str,
+      dest='crops_dir', default=None, help='If set, the cropped faces are read from this feature store (see face_cropping.py), rather than computed from the images and annotations.')
+  parser.add_argument('--feature-store', dest='feature_store', action='store_true',
+      default=False, help='If set, the features are saved into a feature store (one matrix per job) located in the features directory, rather than into one file per sample.')
+  parser.add_argument('--processes', metavar='INT', type=int,
+      dest='n_processes', default=1, help='The number of worker processes used to extract the features, each of them processing one sample at a time (defaults to "%(default)s").')
+  parser.add_argument('--lbph-engine', metavar='STR', type=str, choices=features.LBPH_ENGINES,
+      dest='lbph_engine', default='bob', help='The engine used to preprocess the images (Tan and Triggs) and to compute the LBP histograms: \'bob\' processes the images one by one, whereas \'numpy\' processes stacks of images at once (defaults to "%(default)s").')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=1, help='The number of images processed at once (and given to a worker process) (defaults to "%(default)s").')
+  parser.add_argument('--annotation-index', dest='annotation_index', action='store_true',
+      default=False, help='If set, the eye positions are read from the annotation index of the output directory, rather than from one annotation file per image. The index is built from the annotation files if required, except by the grid jobs, which expect it to be built beforehand (see annotation_index.py).')
+  parser.add_argument('--stage-cache', dest='stage_cache', action='store_true',
+      default=False, help='If set, the cropped and preprocessed faces are cached in the stage cache of the output directory, such that an extraction with other LBP parameters starts from the preprocessed faces.')
+  parser.add_argument('--shared-features', dest='shared_features', action='store_true',
+      default=False, help='If set, the features are extracted into the shared (protocol-independent) cache of the output directory, in a directory named after the parameters of the extraction, and the features directory of the protocol is a link to it. The samples already extracted for another protocol are then not extracted again.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='If set, assumes it is being run using a parametric grid job. It orders all ids to be processed and picks the one at the position given by ${SGE_TASK_ID}-1')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -61,6 +76,8 @@ def main():
   inputs_list = sorted(config.db.objects(protocol=protocol), key=lambda f: f.path)
 
   # finally, if we are on a grid environment, just find what I have to process.
+  store_shard = None
+  if args.feature_store: store_shard = 0
   if args.grid:
     import math
     pos = int(os.environ['SGE_TASK_ID']) - 1 
@@ -70,9 +87,30 @@ def main():
       raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_jobs))
     inputs_lits_g = utils.split_list(inputs_list, config.n_max_files_per_job)[pos]
     inputs_list = inputs_lits_g
+    if args.feature_store: store_shard = pos
+
+  # Annotation index (only read by the grid jobs, which run concurrently)
+  annotation_index = None
+  if args.annotation_index:
+    annotation_index = os.path.join(args.output_dir, config.annotation_index_filename)
+    if args.grid: annotations.require(annotation_index, inputs_list)
+    else: annotations.get(annotation_index, inputs_list, args.pos_input_dir, args.pos_input_ext)
+
+  # Shares the features with the other protocols if required
+  if args.shared_features:
+    shared_dir = features.shared_features_dir(os.path.join(args.output_dir, config.shared_features_dir),
+                        config.crop_eyes_d, config.crop_h, config.crop_w, config.crop_oh, config.crop_ow,
+                        config.gamma, config.sigma0, config.sigma1, config.size, config.threshold, config.alpha,
+                        config.radius, config.p_n, config.circular, config.to_average, config.add_average_bit, config.uniform, config.rot_inv,
+                        config.block_h, config.block_w, config.block_oh, config.block_ow, args.lbph_engine)
+    utils.link_dir(shared_dir, features_dir)
+    # The shards of the different protocols should not collide
+    if store_shard is not None: store_shard = '%s-%s' % (protocol, str(store_shard).zfill(4))
 
   # Checks that the directories for storing the features exists
   utils.ensure_dir(features_dir)
+  cache_dir = None
+  if args.stage_cache: cache_dir = os.path.join(args.output_dir, config.stage_cache_dir)
 
   features.extract_lbph(inputs_list, args.img_input_dir, args.img_input_ext, args.pos_input_dir, args.pos_input_ext, features_dir, config.features_ext,
                         # Cropping
@@ -82,7 +120,9 @@ def main():
                         # LBP
                         config.radius, config.p_n, config.circular, config.to_average, config.add_average_bit, config.uniform, config.rot_inv,
                         config.block_h, config.block_w, config.block_oh, config.block_ow, 
-                        force = args.force)
+                        force = args.force, store_shard = store_shard, n_processes = args.n_processes,
+                        engine = args.lbph_engine, batch_size = args.batch_size, crops_dir = args.crops_dir,
+                        annotation_index = annotation_index, cache_dir = cache_dir)
 
 if __name__ == "__main__": 
   main()
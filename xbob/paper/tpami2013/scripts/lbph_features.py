@@ -19,11 +19,10 @@
 
 import os
 import argparse
-import imp 
 import subprocess
-from .. import utils
+from .. import utils, annotations, features
 
-def main():
+def main(argv=None):
   """Call the LBP Histograms feature extraction"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -43,14 +42,31 @@ def main():
       dest='features_dir', default=None, help='The directory for the output features. It will overwrite the value in the configuration file if any. Default is the value in the configuration file, that is prepended by the given output directory and the protocol.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--feature-store', dest='feature_store', action='store_true',
+      default=False, help='If set, the extracted features are saved into a feature store (one matrix per job), rather than into one file per sample.')
+  parser.add_argument('--processes', metavar='INT', type=int,
+      dest='n_processes', default=1, help='The number of worker processes used by each extraction job.')
+  parser.add_argument('--lbph-engine', metavar='STR', type=str, choices=features.LBPH_ENGINES,
+      dest='lbph_engine', default='bob', help='The engine used to preprocess the images and to compute the LBP histograms (\'bob\' or \'numpy\').')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=1, help='The number of images processed at once by the extraction.')
+  parser.add_argument('--crop-stage', dest='crop_stage', action='store_true',
+      default=False, help='If set, the faces are first cropped into a feature store (in the crops directory of the configuration file), from which the LBP histograms are then extracted.')
+  parser.add_argument('--annotation-index', dest='annotation_index', action='store_true',
+      default=False, help='If set, the eye positions of all the samples are first gathered into an annotation index, from which they are then read by the jobs.')
+  parser.add_argument('--stage-cache', dest='stage_cache', action='store_true',
+      default=False, help='If set, the cropped and preprocessed faces are cached (and reused) by the extraction jobs.')
+  parser.add_argument('--shared-features', dest='shared_features', action='store_true',
+      default=False, help='If set, the features are extracted into the shared (protocol-independent) cache of features, such that the samples already extracted for another protocol are not extracted again.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_local_argument(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='If set, assumes it will split the jobs on the SGE grid.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -59,9 +75,30 @@ def main():
   else: features_dir = os.path.join(args.output_dir, protocol, config.lbph_features_dir)
 
   # Let's create the job manager
-  if args.grid:
-    from gridtk.manager import JobManager
-    jm = JobManager()
+  (jm, grid) = utils.job_manager(args)
+
+  # Builds the annotation index once for all the jobs
+  if args.annotation_index:
+    annotations.get(os.path.join(args.output_dir, config.annotation_index_filename), config.db.objects(protocol=protocol), args.pos_input_dir, args.pos_input_ext)
+
+  # Crops the faces if required
+  if args.crop_stage:
+    crops_dir = os.path.join(args.output_dir, protocol, config.crops_dir)
+    cmd_crop = [
+                './bin/face_cropping.py',
+                '--config-file=%s' % args.config_file,
+                '--image-dir=%s' % args.img_input_dir,
+                '--image-ext=%s' % args.img_input_ext,
+                '--annotation-dir=%s' % args.pos_input_dir,
+                '--annotation-ext=%s' % args.pos_input_ext,
+                '--output-dir=%s' % args.output_dir,
+                '--crops-dir=%s' % crops_dir,
+                '--protocol=%s' % protocol,
+                '--lbph-engine=%s' % args.lbph_engine,
+               ]
+    if args.force: cmd_crop.append('--force')
+    if args.batch_size > 1: cmd_crop.append('--batch-size=%d' % args.batch_size)
+    if args.annotation_index: cmd_crop.append('--annotation-index')
 
   # Extract the features
   cmd_lbph_extract = [ 
@@ -76,18 +113,48 @@ def main():
                       '--protocol=%s' % protocol,
                      ]
   if args.force: cmd_lbph_extract.append('--force')
-  if args.grid: 
+  if args.feature_store: cmd_lbph_extract.append('--feature-store')
+  if args.n_processes > 1: cmd_lbph_extract.append('--processes=%d' % args.n_processes)
+  cmd_lbph_extract.append('--lbph-engine=%s' % args.lbph_engine)
+  if args.batch_size > 1: cmd_lbph_extract.append('--batch-size=%d' % args.batch_size)
+  if args.crop_stage: cmd_lbph_extract.append('--crops-dir=%s' % crops_dir)
+  elif args.annotation_index: cmd_lbph_extract.append('--annotation-index')
+  if args.stage_cache: cmd_lbph_extract.append('--stage-cache')
+  if args.shared_features: cmd_lbph_extract.append('--shared-features')
+  if grid: 
     cmd_lbph_extract.append('--grid')
     import math
     # Database python objects (sorted by keys in case of SGE grid usage)
     inputs_list = config.db.objects(protocol=protocol)
     # Number of array jobs
     n_array_jobs = int(math.ceil(len(inputs_list) / float(config.n_max_files_per_job)))  
-    job_lbph_extract = utils.submit(jm, cmd_lbph_extract, dependencies=None, array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
+    deps = None
+    if args.crop_stage:
+      cmd_crop.append('--grid')
+      job_crop = utils.submit(jm, cmd_crop, dependencies=None, array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
+      print('submitted: %s' % job_crop)
+      deps = [job_crop.id()]
+    job_lbph_extract = utils.submit(jm, cmd_lbph_extract, dependencies=deps, array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
     print('submitted: %s' % job_lbph_extract)
+    if args.feature_store and not args.shared_features:
+      # Concatenates the shards of the feature store (but not the ones of a
+      # shared store, which may be in use by the other protocols)
+      cmd_cat = [
+                  './bin/concatenate_features.py',
+                  '--features-dir=%s' % features_dir,
+                  '--grid'
+                ]
+      job_cat = utils.submit(jm, cmd_cat, dependencies=[job_lbph_extract.id()], array=None)
+      print('submitted: %s' % job_cat)
   else:
+    if args.crop_stage:
+      print('Running face cropping...')
+      subprocess.call(cmd_crop)
     print('Running LBPH feature extraction...')
     subprocess.call(cmd_lbph_extract)
 
+  # Runs the jobs locally if required
+  utils.run_local_jobs(jm, args)
+
 if __name__ == "__main__": 
   main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+# Sun Oct 18 19:26:05 CEST 2026
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import argparse
+import itertools
+from .. import features, utils, annotations
+
+def sweep_name(radius, p_n, block_h, block_w, block_oh, block_ow):
+  """Returns the name of the feature directory of a LBP configuration"""
+  return 'r%d-p%d-b%dx%d-o%dx%d' % (radius, p_n, block_h, block_w, block_oh, block_ow)
+
+def main(argv=None):
+  """Run the LBP Histograms feature extraction for a grid of LBP
+     configurations, preprocessing each image only once"""
+  parser = argparse.ArgumentParser(description=__doc__,
+      formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-c', '--config-file', metavar='FILE', type=str,
+      dest='config_file', default='xbob/paper/tpami2013/config_multipie.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
+  parser.add_argument('--image-dir', metavar='STR', type=str,
+      dest='img_input_dir', default='/idiap/resource/database/Multi-Pie/data', help='The directory containing the input images.')
+  parser.add_argument('--image-ext', metavar='STR', type=str,
+      dest='img_input_ext', default='.png', help='The extension of the input images.')
+  parser.add_argument('--annotation-dir', metavar='STR', type=str,
+      dest='pos_input_dir', default='/idiap/group/biometric/annotations/multipie', help='The directory containing the input annotations.')
+  parser.add_argument('--annotation-ext', metavar='STR', type=str,
+      dest='pos_input_ext', default='.pos', help='The extension of the input annotations.')
+  parser.add_argument('--output-dir', metavar='STR', type=str,
+      dest='output_dir', default='output', help='The base output directory for everything (models, scores, etc.).')
+  parser.add_argument('--features-dir', metavar='STR', type=str,
+      dest='features_dir', default=None, help='The directory containing the feature directories of the LBP configurations (named after their parameters). It will overwrite the value in the configuration file if any. Default is the value in the configuration file, that is prepended by the given output directory and the protocol.')
+  parser.add_argument('-p', '--protocol', metavar='STR', type=str,
+      dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--radius', metavar='INT', type=int, nargs='+',
+      dest='radius', default=None, help='The radii of the LBP to consider. Default is the value in the configuration file.')
+  parser.add_argument('--p-n', metavar='INT', type=int, nargs='+',
+      dest='p_n', default=None, help='The numbers of neighbours of the LBP to consider. Default is the value in the configuration file.')
+  parser.add_argument('--block-h', metavar='INT', type=int, nargs='+',
+      dest='block_h', default=None, help='The heights of the blocks of the histograms to consider. Default is the value in the configuration file.')
+  parser.add_argument('--block-w', metavar='INT', type=int, nargs='+',
+      dest='block_w', default=None, help='The widths of the blocks of the histograms to consider. Default is the value in the configuration file.')
+  parser.add_argument('--block-oh', metavar='INT', type=int, nargs='+',
+      dest='block_oh', default=None, help='The vertical overlaps of the blocks of the histograms to consider. Default is the value in the configuration file.')
+  parser.add_argument('--block-ow', metavar='INT', type=int, nargs='+',
+      dest='block_ow', default=None, help='The horizontal overlaps of the blocks of the histograms to consider. Default is the value in the configuration file.')
+  parser.add_argument('--lbph-engine', metavar='STR', type=str, choices=features.LBPH_ENGINES,
+      dest='lbph_engine', default='bob', help='The engine used to preprocess the images (Tan and Triggs) and to compute the LBP histograms: \'bob\' processes the images one by one, whereas \'numpy\' processes stacks of images at once (defaults to "%(default)s").')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=1, help='The number of images processed at once (defaults to "%(default)s").')
+  parser.add_argument('--crops-dir', metavar='STR', type=str,
+      dest='crops_dir', default=None, help='If set, the cropped faces are read from this feature store (see face_cropping.py), rather than computed from the images and annotations.')
+  parser.add_argument('--annotation-index', dest='annotation_index', action='store_true',
+      default=False, help='If set, the eye positions are read from the annotation index of the output directory, rather than from one annotation file per image. The index is built from the annotation files if required, except by the grid jobs, which expect it to be built beforehand (see annotation_index.py).')
+  parser.add_argument('--stage-cache', dest='stage_cache', action='store_true',
+      default=False, help='If set, the cropped and preprocessed faces are cached in the stage cache of the output directory.')
+  parser.add_argument('-f', '--force', dest='force', action='store_true',
+      default=False, help='Force to erase former data if already exist')
+  parser.add_argument('--grid', dest='grid', action='store_true',
+      default=False, help='If set, assumes it is being run using a parametric grid job. It orders all ids to be processed and picks the one at the position given by ${SGE_TASK_ID}-1')
+  args = parser.parse_args(argv)
+
+  # Loads the configuration 
+  config = utils.load_config(args.config_file)
+  # Update command line options if required
+  if args.protocol: protocol = args.protocol
+  else: protocol = config.protocol
+  # Directory containing the feature directories of the configurations
+  if args.features_dir: features_dir = args.features_dir
+  else: features_dir = os.path.join(args.output_dir, protocol, config.lbph_sweep_dir)
+
+  # Grid of LBP configurations
+  radii = args.radius or [config.radius]
+  p_ns = args.p_n or [config.p_n]
+  block_hs = args.block_h or [config.block_h]
+  block_ws = args.block_w or [config.block_w]
+  block_ohs = args.block_oh or [config.block_oh]
+  block_ows = args.block_ow or [config.block_ow]
+  lbp_configs = []
+  features_dirs = []
+  for (radius, p_n, block_h, block_w, block_oh, block_ow) in itertools.product(radii, p_ns, block_hs, block_ws, block_ohs, block_ows):
+    if block_oh >= block_h or block_ow >= block_w or 2 * radius >= min(block_h, block_w):
+      print("Skipping the configuration with radius %d, blocks of %dx%d and overlaps of %dx%d, which is not valid." % (radius, block_h, block_w, block_oh, block_ow))
+      continue
+    lbp_configs.append((radius, p_n, config.circular, config.to_average, config.add_average_bit, config.uniform, config.rot_inv,
+                        block_h, block_w, block_oh, block_ow))
+    features_dirs.append(os.path.join(features_dir, sweep_name(radius, p_n, block_h, block_w, block_oh, block_ow)))
+  if len(lbp_configs) == 0:
+    raise RuntimeError("The grid of LBP parameters does not contain any valid configuration.")
+
+  # Database python objects (sorted by keys in case of SGE grid usage)
+  inputs_list = sorted(config.db.objects(protocol=protocol), key=lambda f: f.path)
+
+  # finally, if we are on a grid environment, just find what I have to process.
+  store_shard = 0
+  if args.grid:
+    import math
+    pos = int(os.environ['SGE_TASK_ID']) - 1 
+    n_jobs = int(math.ceil(len(inputs_list) / float(config.n_max_files_per_job)))
+    
+    if pos >= n_jobs:
+      raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_jobs))
+    inputs_list = utils.split_list(inputs_list, config.n_max_files_per_job)[pos]
+    store_shard = pos
+
+  # Annotation index (only read by the grid jobs, which run concurrently)
+  annotation_index = None
+  if args.annotation_index:
+    annotation_index = os.path.join(args.output_dir, config.annotation_index_filename)
+    if args.grid: annotations.require(annotation_index, inputs_list)
+    else: annotations.get(annotation_index, inputs_list, args.pos_input_dir, args.pos_input_ext)
+  cache_dir = None
+  if args.stage_cache: cache_dir = os.path.join(args.output_dir, config.stage_cache_dir)
+
+  print("Extracting the features of %d LBP configuration(s) into %s." % (len(lbp_configs), features_dir))
+  features.sweep_lbph(inputs_list, args.img_input_dir, args.img_input_ext, args.pos_input_dir, args.pos_input_ext, features_dirs,
+                      # Cropping
+                      config.crop_eyes_d, config.crop_h, config.crop_w, config.crop_oh, config.crop_ow,
+                      # Tan Triggs
+                      config.gamma, config.sigma0, config.sigma1, config.size, config.threshold, config.alpha,
+                      # LBP
+                      lbp_configs,
+                      force = args.force, store_shard = store_shard, engine = args.lbph_engine, batch_size = args.batch_size,
+                      crops_dir = args.crops_dir, annotation_index = annotation_index, cache_dir = cache_dir)
+
+if __name__ == "__main__": 
+  main()
@@ -19,10 +19,9 @@
 
 import os
 import argparse
-import imp 
 from .. import linear, utils
 
-def main():
+def main(argv=None):
   """Train a LDA model"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -42,17 +41,34 @@ def main():
       dest='eig_filename', default=None, help='The file for storing the eigenvalues.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--streaming', dest='streaming', action='store_true',
+      default=False, help='If set, the training data are loaded chunk by chunk to accumulate the mean and scatter matrices, rather than loaded all at once into memory.')
+  parser.add_argument('--chunk-size', metavar='INT', type=int,
+     dest='chunk_size', default=None, help='The number of files loaded at once in streaming mode. Default is the value \'n_max_files_per_job\' in the configuration file.')
+  parser.add_argument('--statistics-dir', metavar='STR', type=str,
+      dest='statistics_dir', default='statistics', help='The subdirectory where the partial statistics are stored, when splitting the training. It is appended to the given output directory, the protocol and the lda directory.')
+  parser.add_argument('--accumulate', dest='accumulate', action='store_true',
+      default=False, help='If set, only computes the partial statistics (counts, sums and scatter) of the training files and saves them into the statistics directory, one file per split of the training files (of \'n_max_files_per_job\' files). In grid mode, only the split at the position given by ${SGE_TASK_ID}-1 is processed.')
+  parser.add_argument('--reduce', dest='reduce', action='store_true',
+      default=False, help='If set, merges the partial statistics of all the splits of the training files, checking that each of them was accumulated on its split, and trains the LDA model from them.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
-      default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+      default=False, help='If set together with --accumulate, assumes it is being run using a parametric grid job. It orders all files to be processed and picks the split at the position given by ${SGE_TASK_ID}-1')
+  args = parser.parse_args(argv)
+
+  if args.accumulate and args.reduce:
+    raise RuntimeError("The options --accumulate and --reduce cannot be used together, since all the partial statistics should be accumulated before being reduced.")
+  if args.streaming and (args.accumulate or args.reduce):
+    raise RuntimeError("The option --streaming cannot be used together with --accumulate or --reduce, which always process the training files chunk by chunk.")
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.n_outputs: lda_n_outputs = args.n_outputs
   else: lda_n_outputs = config.lda_n_outputs
+  if args.chunk_size: chunk_size = args.chunk_size
+  else: chunk_size = config.n_max_files_per_job
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
   # Directories containing the features and the LDA model
@@ -63,6 +79,40 @@ def main():
   if args.lda_model_filename: lda_model_filename_ = args.lda_model_filename
   else: lda_model_filename_ = config.model_filename
   lda_model_filename = os.path.join(args.output_dir, protocol, lda_dir_, lda_model_filename_)
+  statistics_dir = os.path.join(args.output_dir, protocol, lda_dir_, args.statistics_dir)
+
+  if args.accumulate:
+    # Database python objects (sorted by keys in case of SGE grid usage)
+    training_filenames = sorted(config.db.objects(protocol=protocol, groups='world'), key=lambda f: f.path)
+    splits = utils.split_list(training_filenames, config.n_max_files_per_job)
+
+    # finally, if we are on a grid environment, just find what I have to process.
+    split_ids = range(len(splits))
+    if args.grid:
+      split_id = int(os.environ['SGE_TASK_ID']) - 1
+      if split_id >= len(splits):
+        raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (split_id, len(splits)))
+      split_ids = [split_id]
+
+    for split_id in split_ids:
+      stats_filename = linear.statistics_filename(statistics_dir, split_id)
+      key = linear.statistics_key(splits[split_id], features_dir)
+      if args.force:
+        print("Removing old partial statistics.")
+        utils.erase_if_exists(stats_filename)
+
+      if linear.has_statistics(stats_filename, key):
+        print("Partial statistics '%s' already exist." % stats_filename)
+      else:
+        if os.path.exists(stats_filename):
+          print("Replacing the partial statistics '%s', which were accumulated on other training files." % stats_filename)
+        print("Accumulating partial statistics over %d training files." % len(splits[split_id]))
+        stats = linear.ScatterStatistics()
+        for chunk in utils.split_list(splits[split_id], chunk_size):
+          stats.accumulate(utils.load_data(chunk, features_dir, config.features_ext), [f.client_id for f in chunk])
+        linear.save_statistics(stats, stats_filename, key)
+    return
+
 
   # Remove old file if required
   if args.force:
@@ -85,11 +135,35 @@ def main():
     print("Number of identities: %d" % len(training_filenames))
     print("Number of training files: %d" % nfiles) 
  
-    # Loads training data
-    training_data = utils.load_data_by_client(training_filenames, features_dir, config.features_ext)
+    if args.reduce:
+      # Merges the partial statistics of the splits of the training files
+      splits = utils.split_list(sorted(config.db.objects(protocol=protocol, groups='world'), key=lambda f: f.path), config.n_max_files_per_job)
+      print("Merging %d partial statistics." % len(splits))
+      stats = linear.merge_split_statistics(statistics_dir, splits, features_dir)
+      if stats.n_samples != nfiles:
+        raise RuntimeError("The partial statistics cover %d samples instead of %d." % (stats.n_samples, nfiles))
+
+      # Trains a LDAMachine
+      (machine, eig_vals) = linear.lda_train_statistics(stats, lda_n_outputs)
+    elif args.streaming:
+      # Accumulates the statistics, one chunk of training files at a time
+      # (the identity of each file being its index in the list of models)
+      training_labels = []
+      for k, train_data_m in enumerate(training_filenames):
+        training_labels.extend([(f, k) for f in train_data_m])
+      stats = linear.ScatterStatistics()
+      for chunk in utils.split_list(training_labels, chunk_size):
+        data = utils.load_data([f for (f, k) in chunk], features_dir, config.features_ext)
+        stats.accumulate(data, [k for (f, k) in chunk])
+
+      # Trains a LDAMachine
+      (machine, eig_vals) = linear.lda_train_statistics(stats, lda_n_outputs)
+    else:
+      # Loads training data
+      training_data = utils.load_data_by_client(training_filenames, features_dir, config.features_ext)
 
-    # Trains a LDAMachine
-    (machine, eig_vals) = linear.lda_train(training_data, lda_n_outputs)
+      # Trains a LDAMachine
+      (machine, eig_vals) = linear.lda_train(training_data, lda_n_outputs)
     
     # Saves the machine
     utils.save_machine(machine, lda_model_filename)
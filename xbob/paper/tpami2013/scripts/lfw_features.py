@@ -21,7 +21,7 @@ import os
 import argparse
 from .. import utils, lfw_features
 
-def main():
+def main(argv=None):
   """Download, extract and converts the features into HDF5"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -29,18 +29,25 @@ def main():
       dest='input_url', default='http://lear.inrialpes.fr/people/guillaumin/data/lfw/lfw_funneled_sfd.tar.bz2', help='The URL of the LFW SIFT features to download.')
   parser.add_argument('--output-dir', metavar='FILE', type=str,
       dest='output_dir', default='database', help='The base output directory for everything (features, models, scores, etc.).')
+  parser.add_argument('--stream', dest='stream', action='store_true',
+      default=False, help='If set, the archive is not extracted: its SIFT features are directly parsed from the (streamed) archive, and saved into a feature store (in the lfw_funneled directory of the output directory).')
+  parser.add_argument('--processes', metavar='INT', type=int,
+      dest='n_processes', default=1, help='The number of worker processes used to convert the features of the extracted archive, each of them processing one client directory at a time (defaults to "%(default)s").')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration
   utils.ensure_dir(args.output_dir)
   dl_filename = os.path.join(args.output_dir, 'lfw_funneled_sfd.tar.bz2')
   lfw_features.download(args.input_url, dl_filename)
-  lfw_features.extract_tbz2(dl_filename, args.output_dir)
-  lfw_features.db_parse_jeval(os.path.join(args.output_dir, 'lfw_funneled'))
+  if args.stream:
+    lfw_features.ingest_tbz2(dl_filename, os.path.join(args.output_dir, 'lfw_funneled'), force=args.force)
+  else:
+    lfw_features.extract_tbz2(dl_filename, args.output_dir)
+    lfw_features.db_parse_jeval(os.path.join(args.output_dir, 'lfw_funneled'), args.n_processes)
 
 if __name__ == "__main__": 
   main()
@@ -19,12 +19,11 @@
 
 import os
 import argparse
-import imp
-from .. import linear, utils
+from .. import linear, utils, featurestore
 import bob
 import numpy
 
-def main():
+def main(argv=None):
   """Project features using a trained (either with PCA or LDA) LinearMachine"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -40,16 +39,22 @@ def main():
       dest='algorithm_dir', default='pca', help='The subdirectory where the algorithm data are stored. It is appended to the given output directory and the protocol.')
   parser.add_argument('--model-filename', metavar='STR', type=str,
       dest='model_filename', default=None, help='The (relative) filename of the Linear model. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is then appended to the given output directory, the protocol and the algorithm directory.')
+  parser.add_argument('--chain', metavar='STR', type=str, nargs='+',
+      dest='chain_filenames', default=None, help='The (relative) filenames of the Linear models to apply after the one of the model filename (e.g. \'lda/model.hdf5\' after a PCA model). They are appended to the given output directory and the protocol. All the models are fused into a single projection, such that the intermediate projected features are neither computed nor stored.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=0, help='If strictly positive, the features are projected by blocks of this number of samples, using a single matrix multiplication per block. Default is to project the samples one by one.')
+  parser.add_argument('--feature-store', dest='feature_store', action='store_true',
+      default=False, help='If set, the projected features are saved into a feature store (one matrix per job) located in the projected features directory, rather than into one file per sample.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='If set, assumes it is being run using a parametric grid job. It orders all ids to be processed and picks the one at the position given by ${SGE_TASK_ID}-1')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -67,6 +72,7 @@ def main():
   inputs_list = sorted(config.db.objects(protocol=protocol), key=lambda f: f.path) 
 
   # finally, if we are on a grid environment, just find what I have to process.
+  store_shard = 0
   if args.grid:
     import math
     pos = int(os.environ['SGE_TASK_ID']) - 1
@@ -76,12 +82,70 @@ def main():
       raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_jobs))
     inputs_list_g = utils.split_list(inputs_list, config.n_max_files_per_job)[pos]
     inputs_list = inputs_list_g
+    store_shard = pos
 
   # Checks that the base directory for storing the features exists
   utils.ensure_dir(features_projected_dir)
 
   # Loads the machine (linear projection matrix)
   machine = linear.load_model(model_filename)
+  if args.chain_filenames:
+    # Fuses the chain of machines into a single one
+    chain = [machine] + [linear.load_model(os.path.join(args.output_dir, protocol, f)) for f in args.chain_filenames]
+    machine = linear.compose_machines(chain)
+
+  if args.feature_store:
+    if args.force == True and featurestore.shard_exists(features_projected_dir, store_shard):
+      print("Removing old projected features shard %s." % featurestore.shard_name(store_shard))
+      featurestore.erase_shard(features_projected_dir, store_shard)
+
+    if featurestore.shard_exists(features_projected_dir, store_shard):
+      print("Projected features shard %s already exists." % featurestore.shard_name(store_shard))
+    else:
+      print("Computing projected features shard %s." % featurestore.shard_name(store_shard))
+      data_out = numpy.ndarray(shape=(len(inputs_list), machine.shape[1]), dtype=numpy.float64)
+      # Loads and projects the data block by block (or sample by sample), such
+      # that only the projected data of the whole job are kept in memory
+      block_size = max(args.batch_size, 1)
+      for b in range(0, len(inputs_list), block_size):
+        data_in = utils.load_data(inputs_list[b:b+block_size], features_dir, config.features_ext)
+        if args.batch_size > 0:
+          linear.project_batch(data_in, machine, data_out[b:b+block_size])
+        else:
+          linear.project(data_in[0], machine, data_out[b])
+      # Saves the projected data
+      featurestore.save_shard(features_projected_dir, store_shard, [k.path for k in inputs_list], data_out)
+    return
+
+  if args.batch_size > 0:
+    # Lists the samples for which the projected features are missing
+    inputs_todo = []
+    for k in inputs_list:
+      output_features_k = str(k.make_path(directory=features_projected_dir, extension=config.features_ext))
+      if args.force == True and os.path.exists(output_features_k):
+        print("Removing old features %s." % (output_features_k))
+        os.remove(output_features_k)
+
+      if os.path.exists(output_features_k):
+        print("Projected features %s already exists."  % (output_features_k))
+      else:
+        inputs_todo.append(k)
+
+    for block in utils.split_list(inputs_todo, args.batch_size):
+      print("Computing projected features from a block of %d samples." % len(block))
+      # Loads and projects the block of data
+      data_out = linear.project_batch(utils.load_data(block, features_dir, config.features_ext), machine)
+      # Saves the projected data
+      for k, img_out in zip(block, data_out):
+        output_features_k = str(k.make_path(directory=features_projected_dir, extension=config.features_ext))
+        utils.ensure_dir(os.path.dirname(str(output_features_k)))
+        bob.io.save(img_out, output_features_k)
+    return
+
+  # Opens the input feature store if any
+  store_in = None
+  if featurestore.is_feature_store(features_dir):
+    store_in = featurestore.FeatureStore(features_dir)
 
   # Allocates an array for the projected data
   img_out = numpy.ndarray(shape=(machine.shape[1],), dtype=numpy.float64)
@@ -98,7 +162,8 @@ def main():
     else:
       print("Computing projected features from sample %s." % (input_features_k))
       # Loads the data
-      img_in = bob.io.load( input_features_k )
+      if store_in is not None: img_in = store_in.get(k.path)
+      else: img_in = bob.io.load( input_features_k )
       # Projects the data
       linear.project(img_in, machine, img_out)
       # Saves the projected data
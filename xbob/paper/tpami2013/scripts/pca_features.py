@@ -19,11 +19,10 @@
 
 import os
 import argparse
-import imp
 import subprocess
-from .. import utils
+from .. import utils, featurestore, linear
 
-def main():
+def main(argv=None):
   """Reduce the dimensionality of a feature set using PCA"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -31,6 +30,10 @@ def main():
       dest='config_file', default='xbob/paper/tpami2013/config_multipie.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
   parser.add_argument('--n-outputs', metavar='INT', type=int,
      dest='n_outputs', default=None, help='The rank of the PCA subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
+  parser.add_argument('--n-outputs-sweep', metavar='INT', type=int, nargs='+',
+     dest='n_outputs_sweep', default=None, help='If set, the PCA model is trained and the features are projected (into a feature store) only once, using the largest of these ranks. The features of each rank are then available as a view of the leading columns of this store, in the projected features directory suffixed by the rank (e.g. \'features-100\').')
+  parser.add_argument('--pca-method', metavar='STR', type=str, choices=linear.PCA_METHODS,
+     dest='pca_method', default=None, help='The PCA training method: \'svd\' computes all the components, whereas \'gram\' and \'randomized\' only compute the leading ones. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
   parser.add_argument('--output-dir', metavar='FILE', type=str,
       dest='output_dir', default='output', help='The base output directory for everything (models, scores, etc.).')
   parser.add_argument('--features-dir', metavar='STR', type=str,
@@ -45,17 +48,31 @@ def main():
       dest='eig_filename', default=None, help='The file for storing the eigenvalues.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=0, help='If strictly positive, the features are projected by blocks of this number of samples, using a single matrix multiplication per block.')
+  parser.add_argument('--feature-store', dest='feature_store', action='store_true',
+      default=False, help='If set, the projected features are saved into a feature store (one matrix per job), rather than into one file per sample.')
+  parser.add_argument('--streaming', dest='streaming', action='store_true',
+      default=False, help='If set, the training data are loaded chunk by chunk when training the PCA model, rather than loaded all at once into memory.')
+  parser.add_argument('--skip-training', dest='skip_training', action='store_true',
+      default=False, help='If set, the PCA model is assumed to be already trained (e.g. by pca_train.py with the --protocols option), and the features are only projected.')
+  parser.add_argument('--dependencies', metavar='INT', type=int, nargs='+',
+      dest='dependencies', default=None, help='The ids of the grid jobs on which the first jobs of this script depend (e.g. the job training the PCA models of several protocols at once, with --skip-training).')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_local_argument(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='If set, assumes it will split the jobs on the SGE grid.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
-  if args.n_outputs: pca_n_outputs = args.n_outputs
+  if args.n_outputs_sweep: pca_n_outputs = max(args.n_outputs_sweep)
+  elif args.n_outputs: pca_n_outputs = args.n_outputs
   else: pca_n_outputs = config.pca_n_outputs
+  if args.pca_method: pca_method = args.pca_method
+  else: pca_method = config.pca_method
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
   # Directories containing the features and the PCA model
@@ -67,16 +84,20 @@ def main():
   else: features_projected_dir = config.features_projected_dir
   if args.pca_model_filename: pca_model_filename = args.pca_model_filename
   else: pca_model_filename = config.model_filename
+  # The views of a sweep require the projected features to be in a store
+  feature_store = args.feature_store or args.n_outputs_sweep is not None
 
   # Let's create the job manager
-  if args.grid:
-    from gridtk.manager import JobManager
-    jm = JobManager()
+  (jm, grid) = utils.job_manager(args)
 
   # Trains the LinearMachine
+  # (Only the leading components are computed by the gram and randomized methods)
+  if pca_method == 'svd': pca_mem = '8G'
+  else: pca_mem = '4G'
   cmd_pcatrain = [ 
                   './bin/pca_train.py', 
                   '--n-outputs=%d' % pca_n_outputs,
+                  '--pca-method=%s' % pca_method,
                   '--config-file=%s' % args.config_file, 
                   '--output-dir=%s' % args.output_dir,
                   '--features-dir=%s' % features_dir,
@@ -86,10 +107,15 @@ def main():
                  ]
   if args.eig_filename: cmd_pcatrain.append('--eigenvalues=%s' % args.eig_filename)
   if args.force: cmd_pcatrain.append('--force')
-  if args.grid: 
+  if args.streaming: cmd_pcatrain.append('--streaming')
+  deps = args.dependencies
+  if args.skip_training:
+    print('Skipping PCA training...')
+  elif grid: 
     cmd_pcatrain.append('--grid')
-    job_pcatrain = utils.submit(jm, cmd_pcatrain, dependencies=[], array=None, queue='q1d', mem='8G', hostname='!cicatrix')
+    job_pcatrain = utils.submit(jm, cmd_pcatrain, dependencies=args.dependencies or [], array=None, queue='q1d', mem=pca_mem, hostname='!cicatrix')
     print('submitted: %s' % job_pcatrain)
+    deps = [job_pcatrain.id()]
   else:
     print('Running PCA training...')
     subprocess.call(cmd_pcatrain)
@@ -106,18 +132,40 @@ def main():
                     '--protocol=%s' % protocol,
                    ]
   if args.force: cmd_pcaproject.append('--force')
-  if args.grid: 
+  if feature_store: cmd_pcaproject.append('--feature-store')
+  if args.batch_size > 0: cmd_pcaproject.append('--batch-size=%d' % args.batch_size)
+  if grid: 
     cmd_pcaproject.append('--grid')
     import math
     # Database python objects (sorted by keys in case of SGE grid usage)
     inputs_list = config.db.objects(protocol=protocol)
     # Number of array jobs
     n_array_jobs = int(math.ceil(len(inputs_list) / float(config.n_max_files_per_job)))  
-    job_pcaproject = utils.submit(jm, cmd_pcaproject, dependencies=[job_pcatrain.id()], array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
+    job_pcaproject = utils.submit(jm, cmd_pcaproject, dependencies=deps, array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
     print('submitted: %s' % job_pcaproject)
+    if feature_store:
+      # Concatenates the shards of the feature store
+      cmd_cat = [
+                  './bin/concatenate_features.py',
+                  '--features-dir=%s' % os.path.join(args.output_dir, protocol, pca_dir, features_projected_dir),
+                  '--grid'
+                ]
+      job_cat = utils.submit(jm, cmd_cat, dependencies=[job_pcaproject.id()], array=None)
+      print('submitted: %s' % job_cat)
   else:
     print('Running PCA projection...')
     subprocess.call(cmd_pcaproject)
 
+  # The components of the PCA subspace are sorted by decreasing eigenvalue,
+  # such that the features of a smaller rank are the leading columns of
+  # the projected ones (the views can be created before the store)
+  if args.n_outputs_sweep:
+    store_dir = os.path.join(args.output_dir, protocol, pca_dir, features_projected_dir)
+    for n_outputs in sorted(set(args.n_outputs_sweep)):
+      featurestore.save_view(utils.sweep_dir(store_dir, n_outputs), store_dir, n_outputs)
+
+  # Runs the jobs locally if required
+  utils.run_local_jobs(jm, args)
+
 if __name__ == "__main__": 
   main()
@@ -19,10 +19,9 @@
 
 import os
 import argparse
-import imp 
 from .. import linear, utils
 
-def main():
+def main(argv=None):
   """Train a PCA model"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -30,6 +29,8 @@ def main():
       dest='config_file', default='xbob/paper/tpami2013/config_multipie.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
   parser.add_argument('--n-outputs', metavar='INT', type=int,
      dest='n_outputs', default=None, help='The rank of the PCA subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
+  parser.add_argument('--pca-method', metavar='STR', type=str, choices=linear.PCA_METHODS,
+     dest='pca_method', default=None, help='The PCA training method: \'svd\' computes all the components, whereas \'gram\' and \'randomized\' only compute the leading ones. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
   parser.add_argument('--output-dir', metavar='FILE', type=str,
       dest='output_dir', default='output', help='The base output directory for everything (models, scores, etc.).')
   parser.add_argument('--features-dir', metavar='STR', type=str,
@@ -42,17 +43,40 @@ def main():
       dest='eig_filename', default=None, help='The file for storing the eigenvalues.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--protocols', metavar='STR', type=str, nargs='+',
+      dest='protocols', default=None, help='If set, trains the PCA models of all these protocols (e.g. the folds of a cross-validation) at once, from their accumulated statistics: the samples shared by several training sets are only loaded once, and the statistics of each training set are obtained by merging the ones of the groups of samples it contains. The features directory (common to all these protocols) must then be given.')
+  parser.add_argument('--streaming', dest='streaming', action='store_true',
+      default=False, help='If set, the training data are loaded chunk by chunk to accumulate the mean and scatter matrices, rather than loaded all at once into memory. The PCA model is then obtained from a full eigendecomposition of the (dim x dim) scatter matrix, whatever the PCA method.')
+  parser.add_argument('--chunk-size', metavar='INT', type=int,
+     dest='chunk_size', default=None, help='The number of files loaded at once in streaming mode. Default is the value \'n_max_files_per_job\' in the configuration file.')
+  parser.add_argument('--statistics-dir', metavar='STR', type=str,
+      dest='statistics_dir', default='statistics', help='The subdirectory where the partial statistics are stored, when splitting the training. It is appended to the given output directory, the protocol and the pca directory.')
+  parser.add_argument('--accumulate', dest='accumulate', action='store_true',
+      default=False, help='If set, only computes the partial statistics (counts, sums and scatter) of the training files and saves them into the statistics directory, one file per split of the training files (of \'n_max_files_per_job\' files). In grid mode, only the split at the position given by ${SGE_TASK_ID}-1 is processed.')
+  parser.add_argument('--reduce', dest='reduce', action='store_true',
+      default=False, help='If set, merges the partial statistics of all the splits of the training files, checking that each of them was accumulated on its split, and trains the PCA model from them.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
-      default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+      default=False, help='If set together with --accumulate, assumes it is being run using a parametric grid job. It orders all files to be processed and picks the split at the position given by ${SGE_TASK_ID}-1')
+  args = parser.parse_args(argv)
+
+  if args.accumulate and args.reduce:
+    raise RuntimeError("The options --accumulate and --reduce cannot be used together, since all the partial statistics should be accumulated before being reduced.")
+  if args.protocols and (args.accumulate or args.reduce or args.streaming):
+    raise RuntimeError("The option --protocols cannot be used together with --accumulate, --reduce or --streaming, since the models of several protocols are always trained from their accumulated statistics.")
+  if args.streaming and (args.accumulate or args.reduce):
+    raise RuntimeError("The option --streaming cannot be used together with --accumulate or --reduce, which always process the training files chunk by chunk.")
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.n_outputs: pca_n_outputs = args.n_outputs
   else: pca_n_outputs = config.pca_n_outputs
+  if args.pca_method: pca_method = args.pca_method
+  else: pca_method = config.pca_method
+  if args.chunk_size: chunk_size = args.chunk_size
+  else: chunk_size = config.n_max_files_per_job
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
   # Directories containing the features and the PCA model
@@ -63,6 +87,64 @@ def main():
   if args.pca_model_filename: pca_model_filename_ = args.pca_model_filename
   else: pca_model_filename_ = config.model_filename
   pca_model_filename = os.path.join(args.output_dir, protocol, pca_dir_, pca_model_filename_)
+  statistics_dir = os.path.join(args.output_dir, protocol, pca_dir_, args.statistics_dir)
+
+  if args.protocols:
+    if not args.features_dir:
+      raise RuntimeError("The features directory of the protocols %s should be given." % ', '.join(args.protocols))
+    if args.eig_filename:
+      raise RuntimeError("The eigenvalues cannot be saved when training the PCA models of several protocols.")
+    pca_model_filenames = [os.path.join(args.output_dir, p, pca_dir_, pca_model_filename_) for p in args.protocols]
+    # Remove old files if required
+    if args.force:
+      print("Removing old PCA base models.")
+      for filename in pca_model_filenames:
+        utils.erase_if_exists(filename)
+    todo = [(p, f) for (p, f) in zip(args.protocols, pca_model_filenames) if not os.path.exists(f)]
+    if len(todo) == 0:
+      print("PCA base models already exist.")
+      return
+    print("Training the PCA base models of %d protocols." % len(todo))
+    training_sets = [config.db.objects(protocol=p, groups='world') for (p, f) in todo]
+    stats = linear.cross_validation_statistics(training_sets, features_dir, config.features_ext, chunk_size)
+    for (p, filename), stats_p in zip(todo, stats):
+      print("Number of training files of protocol %s: %d" % (p, stats_p.n_samples))
+      (machine, eig_vals) = linear.pca_train_statistics(stats_p, pca_n_outputs)
+      utils.save_machine(machine, filename)
+    return
+
+  if args.accumulate:
+    # Database python objects (sorted by keys in case of SGE grid usage)
+    training_filenames = sorted(config.db.objects(protocol=protocol, groups='world'), key=lambda f: f.path)
+    splits = utils.split_list(training_filenames, config.n_max_files_per_job)
+
+    # finally, if we are on a grid environment, just find what I have to process.
+    split_ids = range(len(splits))
+    if args.grid:
+      split_id = int(os.environ['SGE_TASK_ID']) - 1
+      if split_id >= len(splits):
+        raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (split_id, len(splits)))
+      split_ids = [split_id]
+
+    for split_id in split_ids:
+      stats_filename = linear.statistics_filename(statistics_dir, split_id)
+      key = linear.statistics_key(splits[split_id], features_dir)
+      if args.force:
+        print("Removing old partial statistics.")
+        utils.erase_if_exists(stats_filename)
+
+      if linear.has_statistics(stats_filename, key):
+        print("Partial statistics '%s' already exist." % stats_filename)
+      else:
+        if os.path.exists(stats_filename):
+          print("Replacing the partial statistics '%s', which were accumulated on other training files." % stats_filename)
+        print("Accumulating partial statistics over %d training files." % len(splits[split_id]))
+        stats = linear.ScatterStatistics()
+        for chunk in utils.split_list(splits[split_id], chunk_size):
+          stats.accumulate(utils.load_data(chunk, features_dir, config.features_ext))
+        linear.save_statistics(stats, stats_filename, key)
+    return
+
 
   # Remove old file if required
   if args.force:
@@ -78,11 +160,30 @@ def main():
     training_filenames = sorted(config.db.objects(protocol=protocol, groups='world'), key=lambda f: f.path)
     print("Number of training files: " + str(len(training_filenames)))
     
-    # Loads training data
-    training_data = utils.load_data(training_filenames, features_dir, config.features_ext)
+    if args.reduce:
+      # Merges the partial statistics of the splits of the training files
+      splits = utils.split_list(training_filenames, config.n_max_files_per_job)
+      print("Merging %d partial statistics." % len(splits))
+      stats = linear.merge_split_statistics(statistics_dir, splits, features_dir)
+      if stats.n_samples != len(training_filenames):
+        raise RuntimeError("The partial statistics cover %d samples instead of %d." % (stats.n_samples, len(training_filenames)))
+
+      # Trains a PCAMachine
+      (machine, eig_vals) = linear.pca_train_statistics(stats, pca_n_outputs)
+    elif args.streaming:
+      # Accumulates the statistics, one chunk of training files at a time
+      stats = linear.ScatterStatistics()
+      for chunk in utils.split_list(training_filenames, chunk_size):
+        stats.accumulate(utils.load_data(chunk, features_dir, config.features_ext))
+
+      # Trains a PCAMachine
+      (machine, eig_vals) = linear.pca_train_statistics(stats, pca_n_outputs)
+    else:
+      # Loads training data
+      training_data = utils.load_data(training_filenames, features_dir, config.features_ext)
 
-    # Trains a PCAMachine
-    (machine, eig_vals) = linear.pca_train(training_data, pca_n_outputs)
+      # Trains a PCAMachine
+      (machine, eig_vals) = linear.pca_train(training_data, pca_n_outputs, pca_method)
     
     # Saves the machine
     utils.save_machine(machine, pca_model_filename)
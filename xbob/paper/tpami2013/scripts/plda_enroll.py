@@ -18,11 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import imp
 import argparse
 from .. import plda, utils
 
-def main():
+def main(argv=None):
   """Enroll PLDA models"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -40,14 +39,16 @@ def main():
       dest='plda_model_filename', default=None, help='The (relative) filename of the PLDABase model. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is then appended to the given output directory, the protocol and the plda directory.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--model-bank', dest='model_bank', action='store_true',
+      default=False, help='If set, all the models are enrolled at once with matrix operations, and saved into a single model bank file per group, rather than into one file per model.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
  
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -68,6 +69,34 @@ def main():
   # Loads the PLDABase 
   pldabase = plda.load_base_model(plda_model_filename)
 
+  if args.model_bank:
+    # One model bank per group
+    for group in groups:
+      model_bank_filename = os.path.join(args.output_dir, protocol, plda_dir_, config.models_dir, group, config.model_bank_filename)
+      # Removes old file if required
+      if args.force:
+        print("Removing old PLDA model bank.")
+        utils.erase_if_exists(model_bank_filename)
+
+      if os.path.exists(model_bank_filename):
+        print("PLDA model bank already exists.")
+      else:
+        # Loads the enrollment files of all the client models
+        group_models_ids = sorted(config.db.model_ids(protocol=protocol, groups=group))
+        data_list = []
+        for model_id in group_models_ids:
+          enroll_files = config.db.objects(protocol=protocol, model_ids=(model_id,), purposes='enrol')
+          data_list.append(utils.load_data(enroll_files, features_dir, config.features_ext))
+
+        # Enrolls all the client models at once
+        print("Enrolling %d PLDA models of group '%s' into a model bank..." % (len(group_models_ids), group))
+        (n_samples, weighted_sums, offsets) = plda.enroll_models_batch(data_list, pldabase)
+
+        # Saves the model bank
+        utils.ensure_dir(os.path.dirname(model_bank_filename))
+        plda.save_model_bank(model_bank_filename, group_models_ids, n_samples, weighted_sums, offsets)
+    return
+
   # Enrolls all the client models
   print("Enrolling PLDA models...")
   for model_id in models_ids:
@@ -142,12 +142,12 @@ def plot(scores_pos, scores_neg, dbname, output_filename):
   mpl.savefig(output_filename)
   print("Saved your plot at '%s'... Bye!" % output_filename)
 
-def main():
+def main(argv=None):
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('--output-img', metavar='FILE', type=str,
       dest='output_img', default='plda_example_iris.png', help='The path to the output image with the resulting scores distributions.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Get data
   data_train, data_enrol, data_test_pos, data_test_neg = split_iris_data()
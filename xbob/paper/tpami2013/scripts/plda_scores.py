@@ -18,11 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import imp
 import argparse
-from .. import plda, utils
+from .. import plda, utils, protocol_index
 
-def main():
+def main(argv=None):
   """Compute PLDA scores"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -40,14 +39,22 @@ def main():
       dest='plda_model_filename', default=None, help='The (relative) filename of the PLDABase model. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is then appended to the given output directory, the protocol and the plda directory.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--batch', dest='batch', action='store_true',
+      default=False, help='If set, the scores of all the models sharing the same list of probes are computed at once with matrix operations, rather than one model and one probe at a time.')
+  parser.add_argument('--model-bank', dest='model_bank', action='store_true',
+      default=False, help='If set, the enrolled models are read from the model bank (a single file generated by plda_enroll.py --model-bank), rather than from one file per model. This implies --batch.')
+  parser.add_argument('--probe-once', dest='probe_once', action='store_true',
+      default=False, help='If set, the union of the probes of all the models to process is loaded once, and each model is scored against its own probes using index arrays. This implies --batch.')
+  parser.add_argument('--protocol-index', dest='protocol_index', action='store_true',
+      default=False, help='If set, the models and their probes are retrieved from the index of the protocol (built and saved into the output directory if required), rather than by querying the database.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='If set, assumes it is being run using a parametric grid job. It orders all ids to be processed and picks the one at the position given by ${SGE_TASK_ID}-1')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -59,28 +66,42 @@ def main():
   if args.plda_model_filename: plda_model_filename_ = args.plda_model_filename
   else: plda_model_filename_ = config.model_filename
   plda_model_filename = os.path.join(args.output_dir, protocol, plda_dir_, plda_model_filename_)
+  model_bank_filename = os.path.join(args.output_dir, protocol, plda_dir_, config.models_dir, args.group, config.model_bank_filename)
+  batch = args.batch or args.model_bank or args.probe_once
 
   # (sorted) list of models
-  models_ids = sorted(config.db.model_ids(protocol=protocol, groups=args.group))
+  if args.protocol_index:
+    index = protocol_index.get(config.db, protocol, os.path.join(args.output_dir, protocol, config.protocol_index_filename), groups=(args.group,))
+    models_ids = index.model_ids(args.group)
+  else:
+    models_ids = sorted(config.db.model_ids(protocol=protocol, groups=args.group))
 
   # finally, if we are on a grid environment, just find what I have to process.
   probes_split_id = 0
   if args.grid:
     import math
-    n_splits = 0
-    found = False
     pos = int(os.environ['SGE_TASK_ID']) - 1
-    for model_id in models_ids:
-      n_probes_for_model = len(config.db.objects(groups=args.group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
-      n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
-      if pos < n_splits + n_splits_for_model:
-        models_ids = [model_id]
-        probes_split_id = pos - n_splits
-        found = True
-        break
-      n_splits += n_splits_for_model
-    if found == False:
-      raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_splits))
+    if args.protocol_index:
+      # Finds the model and the split of probes of this task in the index
+      tasks = index.task_map(args.group, config.n_max_probes_per_job)
+      if pos >= len(tasks):
+        raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, len(tasks)))
+      (model_id, probes_split_id) = tasks[pos]
+      models_ids = [model_id]
+    else:
+      n_splits = 0
+      found = False
+      for model_id in models_ids:
+        n_probes_for_model = len(config.db.objects(groups=args.group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
+        n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
+        if pos < n_splits + n_splits_for_model:
+          models_ids = [model_id]
+          probes_split_id = pos - n_splits
+          found = True
+          break
+        n_splits += n_splits_for_model
+      if found == False:
+        raise RuntimeError("Grid request for job %d on a setup with %d jobs" % (pos, n_splits))
 
   sc_nonorm_filename = os.path.join(args.output_dir, protocol, plda_dir_, config.scores_nonorm_dir, "scores-" + args.group)
   if args.force:
@@ -92,6 +113,13 @@ def main():
     # Loads the PLDABase
     pldabase = plda.load_base_model(plda_model_filename)
     
+    # Loads the model bank if required
+    if args.model_bank: bank = plda.load_model_bank(model_bank_filename)
+
+    # Models to be scored together, indexed by their list of probes
+    batches = {}
+    batches_keys = []
+
     # Loops over the model ids
     for model_id in models_ids:
       print("Computing scores for model '%s'." % model_id)
@@ -107,20 +135,31 @@ def main():
         print("Scores file '%s' already exists." % sc_nonorm_filename)
       else:
         # Gets the probe sample list
-        probe_filenames = sorted(config.db.objects(groups=args.group, protocol=protocol, purposes="probe", model_ids=(model_id,)), key=lambda f: f.path)
+        if args.protocol_index: probe_filenames = index.probe_samples(args.group, model_id)
+        else: probe_filenames = sorted(config.db.objects(groups=args.group, protocol=protocol, purposes="probe", model_ids=(model_id,)), key=lambda f: f.path)
         
         # If we are on a grid environment, just keep the required split of samples
         if args.grid:
           probe_filenames_g = utils.split_list(probe_filenames, config.n_max_probes_per_job)
           probe_filenames = probe_filenames_g[probes_split_id]
 
-        # Loads the probes
-        (probe_tests, probe_client_ids) = utils.load_probes(probe_filenames, features_dir, config.features_ext)
+        # Batch mode: the scores are computed once all the models are listed
+        if batch:
+          key = tuple([str(x.path) for x in probe_filenames])
+          if not key in batches:
+            batches[key] = (probe_filenames, [], [])
+            batches_keys.append(key)
+          batches[key][1].append(model_id)
+          batches[key][2].append(sc_nonorm_filename)
+          continue
 
         # Loads the client model
         model_path = os.path.join(args.output_dir, protocol, plda_dir_, config.models_dir, str(model_id) + ".hdf5")
         machine = plda.load_model(model_path, pldabase)
 
+        # Loads the probes
+        (probe_tests, probe_client_ids) = utils.load_probes(probe_filenames, features_dir, config.features_ext)
+
         # Computes the scores of all the probes against the model and put them in A
         A = plda.compute_scores(machine, probe_tests)
 
@@ -130,5 +169,33 @@ def main():
         else:
           utils.save_scores_to_textfile(A, probe_filenames, model_id, sc_nonorm_filename, True)
 
+    if args.probe_once and len(batches_keys) > 0:
+      # Loads the union of the probes of all the models
+      (union_tests, union_indices) = utils.load_probe_union([batches[key][0] for key in batches_keys], features_dir, config.features_ext)
+
+    for b, key in enumerate(batches_keys):
+      (probe_filenames, batch_models_ids, sc_filenames) = batches[key]
+      print("Computing scores of %d model(s) against %d probe(s)." % (len(batch_models_ids), len(probe_filenames)))
+      # Loads the probes (once for all the models)
+      if args.probe_once: probe_tests = union_tests[union_indices[b]]
+      else: (probe_tests, probe_client_ids) = utils.load_probes(probe_filenames, features_dir, config.features_ext)
+
+      # Loads the client models
+      if args.model_bank:
+        (n_samples, weighted_sums, offsets) = plda.model_bank_statistics(bank, batch_models_ids)
+      else:
+        machines = [plda.load_model(os.path.join(args.output_dir, protocol, plda_dir_, config.models_dir, str(model_id) + ".hdf5"), pldabase) for model_id in batch_models_ids]
+        (n_samples, weighted_sums, offsets) = plda.model_statistics(machines)
+
+      # Computes the scores of all the probes against all the models
+      A = plda.compute_scores_batch(pldabase, n_samples, weighted_sums, offsets, probe_tests)
+
+      # Saves model_scores to text file
+      for i, model_id in enumerate(batch_models_ids):
+        if args.grid:
+          utils.save_scores_to_textfile(A[i], probe_filenames, model_id, sc_filenames[i])
+        else:
+          utils.save_scores_to_textfile(A[i], probe_filenames, model_id, sc_filenames[i], True)
+
 if __name__ == "__main__": 
   main()
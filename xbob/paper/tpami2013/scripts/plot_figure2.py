@@ -18,12 +18,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import imp
 import argparse
 import matplotlib.pyplot as plt
 from .. import utils
 
-def main():
+def main(argv=None):
   """Plot Figure 2 of the article, assuming that the required experiments have successfully completed"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -37,10 +36,10 @@ def main():
       dest='output_img', default=None, help='The output image (Figure 2 of the article).')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if not args.plda_dir: plda_dir = config.plda_dir
   else: plda_dir = args.plda_dir
@@ -18,11 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import imp
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """Plot Table 3 of the article, assuming that the required experiments have successfully completed"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -36,10 +35,10 @@ def main():
       dest='algorithms_name', default=['PCA', 'LDA', 'LBPH', 'PLDA'], help='The name of the algorithm to display in the table.')
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
 
   # Read files containing the scores and compute HTER
   print('Table 3')
@@ -18,13 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import math
-import imp
-import subprocess
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """LBPH chi square toolchain"""
   # Parses options
   parser = argparse.ArgumentParser(description=__doc__,
@@ -43,14 +40,17 @@ def main():
       dest='distance', default='chi_square', help='The distance to use, when computing scores.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--probe-once', dest='probe_once', action='store_true',
+      default=False, help='If set, the probes are loaded only once for all the models scored by a job.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_runner_arguments(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='Run the script using the gridtk on an SGE infrastructure.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
@@ -60,9 +60,7 @@ def main():
   else: groups = args.group
 
   # Let's create the job manager
-  if args.grid:
-    from gridtk.manager import JobManager
-    jm = JobManager()
+  (jm, grid) = utils.job_manager(args)
 
   # Generates the models 
   job_enroll = []
@@ -78,24 +76,19 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
     if args.force: cmd_enroll.append('--force')
-    if args.grid: 
+    if grid: 
       cmd_enroll.append('--grid')
       job_enroll_int = utils.submit(jm, cmd_enroll, dependencies=None, array=None, queue='q1d', mem='2G', hostname='!cicatrix')
       job_enroll.append(job_enroll_int.id())
       print('submitted: %s' % job_enroll_int)
     else:
       print('Running enrollment for %s...' % group)
-      subprocess.call(cmd_enroll)
+      utils.run_command(cmd_enroll, args.in_process)
 
   # Compute raw scores
   job_scores = []
   for group in groups:
-    n_array_jobs = 0
-    model_ids = sorted(config.db.model_ids(protocol=protocol, groups=group))
-    for model_id in model_ids:
-      n_probes_for_model = len(config.db.objects(groups=group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
-      n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
-      n_array_jobs += n_splits_for_model
+    n_array_jobs = utils.n_scoring_jobs(config, protocol, group, groups, args.output_dir, args.protocol_index)
     cmd_scores = [
                   './bin/distance_scores.py',
                   '--config-file=%s' % args.config_file, 
@@ -106,7 +99,9 @@ def main():
                   '--distance=%s' % args.distance,
                   '--protocol=%s' % protocol,
                  ]
-    if args.grid: 
+    if args.probe_once: cmd_scores.append('--probe-once')
+    if args.protocol_index: cmd_scores.append('--protocol-index')
+    if grid: 
       cmd_scores.append('--grid')
       deps = job_enroll
       job_scores_int = utils.submit(jm, cmd_scores, dependencies=deps, array=(1,n_array_jobs,1), queue='q1d', mem='3G', hostname='!cicatrix')
@@ -114,10 +109,10 @@ def main():
       print('submitted: %s' % job_scores_int)
     else:
       print('Running scoring for %s...' % group)
-      subprocess.call(cmd_scores)
+      utils.run_command(cmd_scores, args.in_process)
 
   # Concatenates the scores
-  if args.grid:
+  if grid:
     cmd_cat = [ 
                 './bin/concatenate_scores.py', 
                 '--config-file=%s' % args.config_file, 
@@ -129,5 +124,8 @@ def main():
     job_cat = utils.submit(jm, cmd_cat, dependencies=job_scores, array=None)
     print('submitted: %s' % job_cat)
 
+  # Runs the jobs locally if required
+  utils.run_local_jobs(jm, args)
+
 if __name__ == '__main__':
   main()
@@ -20,12 +20,10 @@
 
 import math
 import os
-import imp
-import subprocess
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """LDA Toolchain"""
   # Parses options
   parser = argparse.ArgumentParser(description=__doc__,
@@ -48,14 +46,28 @@ def main():
       dest='distance', default='euclidean', help='The distance to use, when computing scores.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=0, help='If strictly positive, the features are projected by blocks of this number of samples, using a single matrix multiplication per block.')
+  parser.add_argument('--feature-store', dest='feature_store', action='store_true',
+      default=False, help='If set, the projected features are saved into a feature store (one matrix per job), rather than into one file per sample.')
+  parser.add_argument('--streaming', dest='streaming', action='store_true',
+      default=False, help='If set, the training data are loaded chunk by chunk when training the LDA model, rather than loaded all at once into memory.')
+  parser.add_argument('--split-training', dest='split_training', action='store_true',
+      default=False, help='If set, the partial statistics of the LDA training are computed on splits of the training files (as an array job on the grid), and then merged to train the model.')
+  parser.add_argument('--probe-once', dest='probe_once', action='store_true',
+      default=False, help='If set, the probes are loaded only once for all the models scored by a job.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_runner_arguments(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='Run the script using the gridtk on an SGE infrastructure.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
+
+  if args.streaming and args.split_training:
+    raise RuntimeError("The options --streaming and --split-training cannot be used together, since the split training always processes the training files chunk by chunk.")
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.n_outputs: lda_n_outputs = args.n_outputs
   else: lda_n_outputs = config.lda_n_outputs
@@ -72,9 +84,7 @@ def main():
   else: groups = args.group
 
   # Let's create the job manager
-  if args.grid:
-    from gridtk.manager import JobManager
-    jm = JobManager()
+  (jm, grid) = utils.job_manager(args)
 
   # Trains the LinearMachine
   cmd_ldatrain = [ 
@@ -88,13 +98,32 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
   if args.force: cmd_ldatrain.append('--force')
-  if args.grid: 
+  if args.streaming: cmd_ldatrain.append('--streaming')
+  deps_ldatrain = []
+  if args.split_training:
+    # Accumulates the partial statistics on each split of the training files
+    cmd_ldaacc = cmd_ldatrain + ['--accumulate']
+    cmd_ldatrain.append('--reduce')
+    if grid:
+      cmd_ldaacc.append('--grid')
+      # Number of array jobs
+      training_list = config.db.objects(protocol=protocol, groups='world')
+      n_array_jobs = int(math.ceil(len(training_list) / float(config.n_max_files_per_job)))
+      job_ldaacc = utils.submit(jm, cmd_ldaacc, dependencies=[], array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
+      print('submitted: %s' % job_ldaacc)
+      deps_ldatrain = [job_ldaacc.id()]
+    else:
+      print('Running LDA partial statistics accumulation...')
+      utils.run_command(cmd_ldaacc, args.in_process)
+  if grid: 
+    # (the reduce job decomposes the dim x dim scatter matrices, which requires
+    # as much memory as training from the whole data)
     cmd_ldatrain.append('--grid')
-    job_ldatrain = utils.submit(jm, cmd_ldatrain, dependencies=[], array=None, queue='q1d', mem='8G', hostname='!cicatrix')
+    job_ldatrain = utils.submit(jm, cmd_ldatrain, dependencies=deps_ldatrain, array=None, queue='q1d', mem='8G', hostname='!cicatrix')
     print('submitted: %s' % job_ldatrain)
   else:
     print('Running LDA training...')
-    subprocess.call(cmd_ldatrain)
+    utils.run_command(cmd_ldatrain, args.in_process)
 
 
   # Project the data
@@ -108,7 +137,9 @@ def main():
                     '--protocol=%s' % protocol,
                    ]
   if args.force: cmd_ldaproject.append('--force')
-  if args.grid: 
+  if args.feature_store: cmd_ldaproject.append('--feature-store')
+  if args.batch_size > 0: cmd_ldaproject.append('--batch-size=%d' % args.batch_size)
+  if grid: 
     # Database python objects (sorted by keys in case of SGE grid usage)
     inputs_list = config.db.objects(protocol=protocol)
     inputs_list.sort(key=lambda x: x.id)
@@ -119,7 +150,7 @@ def main():
     print('submitted: %s' % job_ldaproject)
   else:
     print('Running LDA projection...')
-    subprocess.call(cmd_ldaproject)
+    utils.run_command(cmd_ldaproject, args.in_process)
 
   features_dir = os.path.join(args.output_dir, protocol, lda_dir, config.features_projected_dir)
   # Generates the models 
@@ -136,24 +167,19 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
     if args.force: cmd_enroll.append('--force')
-    if args.grid: 
+    if grid: 
       cmd_enroll.append('--grid')
       job_enroll_int = utils.submit(jm, cmd_enroll, dependencies=[job_ldaproject.id()], array=None, queue='q1d', mem='2G', hostname='!cicatrix')
       job_enroll.append(job_enroll_int.id())
       print('submitted: %s' % job_enroll_int)
     else:
       print('Running enrollment for %s...' % group)
-      subprocess.call(cmd_enroll)
+      utils.run_command(cmd_enroll, args.in_process)
 
   # Compute raw scores
   job_scores = []
   for group in groups:
-    n_array_jobs = 0
-    model_ids = sorted(config.db.model_ids(protocol=protocol, groups=group))
-    for model_id in model_ids:
-      n_probes_for_model = len(config.db.objects(groups=group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
-      n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
-      n_array_jobs += n_splits_for_model
+    n_array_jobs = utils.n_scoring_jobs(config, protocol, group, groups, args.output_dir, args.protocol_index)
     cmd_scores = [
                   './bin/distance_scores.py',
                   '--config-file=%s' % args.config_file, 
@@ -164,7 +190,9 @@ def main():
                   '--distance=%s' % args.distance,
                   '--protocol=%s' % protocol,
                  ]
-    if args.grid: 
+    if args.probe_once: cmd_scores.append('--probe-once')
+    if args.protocol_index: cmd_scores.append('--protocol-index')
+    if grid: 
       cmd_scores.append('--grid')
       deps = job_enroll
       job_scores_int = utils.submit(jm, cmd_scores, dependencies=deps, array=(1,n_array_jobs,1), queue='q1d', mem='3G', hostname='!cicatrix')
@@ -172,10 +200,10 @@ def main():
       print('submitted: %s' % job_scores_int)
     else:
       print('Running scoring for %s...' % group)
-      subprocess.call(cmd_scores)
+      utils.run_command(cmd_scores, args.in_process)
 
   # Concatenates the scores
-  if args.grid:
+  if grid:
     cmd_cat = [ 
                 './bin/concatenate_scores.py', 
                 '--config-file=%s' % args.config_file, 
@@ -187,5 +215,8 @@ def main():
     job_cat = utils.submit(jm, cmd_cat, dependencies=job_scores, array=None)
     print('submitted: %s' % job_cat)
 
+  # Runs the jobs locally if required
+  utils.run_local_jobs(jm, args)
+
 if __name__ == '__main__':
   main()
@@ -19,12 +19,10 @@
 
 import math
 import os
-import imp
-import subprocess
 import argparse
-from .. import utils
+from .. import utils, linear
 
-def main():
+def main(argv=None):
   """PCA toolchain"""
   # Parses options
   parser = argparse.ArgumentParser(description=__doc__,
@@ -35,6 +33,8 @@ def main():
       dest='group', default=['dev','eval'], help='Database group (\'dev\' or \'eval\') for which to enroll models and compute scores.')
   parser.add_argument('--n-outputs', metavar='INT', type=int,
      dest='n_outputs', default=None, help='The rank of the PCA subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
+  parser.add_argument('--pca-method', metavar='STR', type=str, choices=linear.PCA_METHODS,
+     dest='pca_method', default=None, help='The PCA training method: \'svd\' computes all the components, whereas \'gram\' and \'randomized\' only compute the leading ones. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
   parser.add_argument('--output-dir', metavar='STR', type=str,
       dest='output_dir', default='output', help='The base output directory for everything (models, scores, etc.).')
   parser.add_argument('--features-dir', metavar='STR', type=str,
@@ -47,17 +47,33 @@ def main():
       dest='distance', default='euclidean', help='The distance to use, when computing scores.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--batch-size', metavar='INT', type=int,
+      dest='batch_size', default=0, help='If strictly positive, the features are projected by blocks of this number of samples, using a single matrix multiplication per block.')
+  parser.add_argument('--feature-store', dest='feature_store', action='store_true',
+      default=False, help='If set, the projected features are saved into a feature store (one matrix per job), rather than into one file per sample.')
+  parser.add_argument('--streaming', dest='streaming', action='store_true',
+      default=False, help='If set, the training data are loaded chunk by chunk when training the PCA model, rather than loaded all at once into memory.')
+  parser.add_argument('--split-training', dest='split_training', action='store_true',
+      default=False, help='If set, the partial statistics of the PCA training are computed on splits of the training files (as an array job on the grid), and then merged to train the model.')
+  parser.add_argument('--probe-once', dest='probe_once', action='store_true',
+      default=False, help='If set, the probes are loaded only once for all the models scored by a job.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_runner_arguments(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='Run the script using the gridtk on an SGE infrastructure.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
+
+  if args.streaming and args.split_training:
+    raise RuntimeError("The options --streaming and --split-training cannot be used together, since the split training always processes the training files chunk by chunk.")
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.n_outputs: pca_n_outputs = args.n_outputs
   else: pca_n_outputs = config.pca_n_outputs
+  if args.pca_method: pca_method = args.pca_method
+  else: pca_method = config.pca_method
   if args.protocol: protocol = args.protocol
   else: protocol = config.protocol
   # Update command line options if required
@@ -71,15 +87,17 @@ def main():
   else: groups = args.group
 
   # Let's create the job manager
-  if args.grid:
-    from gridtk.manager import JobManager
-    jm = JobManager()
+  (jm, grid) = utils.job_manager(args)
 
   # Trains the LinearMachine
+  # (Only the leading components are computed by the gram and randomized methods)
+  if pca_method == 'svd': pca_mem = '8G'
+  else: pca_mem = '4G'
   cmd_pcatrain = [ 
                   './bin/pca_train.py', 
                   '--config-file=%s' % args.config_file, 
                   '--n-outputs=%d' % pca_n_outputs,
+                  '--pca-method=%s' % pca_method,
                   '--output-dir=%s' % args.output_dir,
                   '--features-dir=%s' % features_dir,
                   '--pca-dir=%s' % pca_dir,
@@ -87,13 +105,32 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
   if args.force: cmd_pcatrain.append('--force')
-  if args.grid: 
+  if args.streaming: cmd_pcatrain.append('--streaming')
+  deps_pcatrain = []
+  if args.split_training:
+    # Accumulates the partial statistics on each split of the training files
+    cmd_pcaacc = cmd_pcatrain + ['--accumulate']
+    cmd_pcatrain.append('--reduce')
+    if grid:
+      cmd_pcaacc.append('--grid')
+      # Number of array jobs
+      training_list = config.db.objects(protocol=protocol, groups='world')
+      n_array_jobs = int(math.ceil(len(training_list) / float(config.n_max_files_per_job)))
+      job_pcaacc = utils.submit(jm, cmd_pcaacc, dependencies=[], array=(1,n_array_jobs,1), queue='q1d', mem='2G', hostname='!cicatrix')
+      print('submitted: %s' % job_pcaacc)
+      deps_pcatrain = [job_pcaacc.id()]
+    else:
+      print('Running PCA partial statistics accumulation...')
+      utils.run_command(cmd_pcaacc, args.in_process)
+  if grid: 
+    # (the reduce job decomposes the dim x dim scatter matrices, which requires
+    # as much memory as training from the whole data)
     cmd_pcatrain.append('--grid')
-    job_pcatrain = utils.submit(jm, cmd_pcatrain, dependencies=[], array=None, queue='q1d', mem='8G', hostname='!cicatrix')
+    job_pcatrain = utils.submit(jm, cmd_pcatrain, dependencies=deps_pcatrain, array=None, queue='q1d', mem=pca_mem, hostname='!cicatrix')
     print('submitted: %s' % job_pcatrain)
   else:
     print('Running PCA training...')
-    subprocess.call(cmd_pcatrain)
+    utils.run_command(cmd_pcatrain, args.in_process)
 
 
   # Project the data
@@ -107,7 +144,9 @@ def main():
                     '--protocol=%s' % protocol,
                    ]
   if args.force: cmd_pcaproject.append('--force')
-  if args.grid: 
+  if args.feature_store: cmd_pcaproject.append('--feature-store')
+  if args.batch_size > 0: cmd_pcaproject.append('--batch-size=%d' % args.batch_size)
+  if grid: 
     # Database python objects (sorted by keys in case of SGE grid usage)
     inputs_list = config.db.objects(protocol=protocol)
     inputs_list.sort(key=lambda x: x.id)
@@ -118,7 +157,7 @@ def main():
     print('submitted: %s' % job_pcaproject)
   else:
     print('Running PCA projection...')
-    subprocess.call(cmd_pcaproject)
+    utils.run_command(cmd_pcaproject, args.in_process)
 
   features_dir = os.path.join(args.output_dir, protocol, pca_dir, config.features_projected_dir)
   # Generates the models 
@@ -135,24 +174,19 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
     if args.force: cmd_enroll.append('--force')
-    if args.grid: 
+    if grid: 
       cmd_enroll.append('--grid')
       job_enroll_int = utils.submit(jm, cmd_enroll, dependencies=[job_pcaproject.id()], array=None, queue='q1d', mem='2G', hostname='!cicatrix')
       job_enroll.append(job_enroll_int.id())
       print('submitted: %s' % job_enroll_int)
     else:
       print('Running enrollment for %s...' % group)
-      subprocess.call(cmd_enroll)
+      utils.run_command(cmd_enroll, args.in_process)
 
   # Compute raw scores
   job_scores = []
   for group in groups:
-    n_array_jobs = 0
-    model_ids = sorted(config.db.model_ids(protocol=protocol, groups=group))
-    for model_id in model_ids:
-      n_probes_for_model = len(config.db.objects(groups=group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
-      n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
-      n_array_jobs += n_splits_for_model
+    n_array_jobs = utils.n_scoring_jobs(config, protocol, group, groups, args.output_dir, args.protocol_index)
     cmd_scores = [
                   './bin/distance_scores.py',
                   '--config-file=%s' % args.config_file, 
@@ -163,7 +197,9 @@ def main():
                   '--distance=%s' % args.distance,
                   '--protocol=%s' % protocol,
                  ]
-    if args.grid: 
+    if args.probe_once: cmd_scores.append('--probe-once')
+    if args.protocol_index: cmd_scores.append('--protocol-index')
+    if grid: 
       cmd_scores.append('--grid')
       deps = job_enroll
       job_scores_int = utils.submit(jm, cmd_scores, dependencies=deps, array=(1,n_array_jobs,1), queue='q1d', mem='3G', hostname='!cicatrix')
@@ -171,10 +207,10 @@ def main():
       print('submitted: %s' % job_scores_int)
     else:
       print('Running scoring for %s...' % group)
-      subprocess.call(cmd_scores)
+      utils.run_command(cmd_scores, args.in_process)
 
   # Concatenates the scores
-  if args.grid:
+  if grid:
     cmd_cat = [ 
                 './bin/concatenate_scores.py', 
                 '--config-file=%s' % args.config_file, 
@@ -186,5 +222,8 @@ def main():
     job_cat = utils.submit(jm, cmd_cat, dependencies=job_scores, array=None)
     print('submitted: %s' % job_cat)
 
+  # Runs the jobs locally if required
+  utils.run_local_jobs(jm, args)
+
 if __name__ == '__main__':
   main()
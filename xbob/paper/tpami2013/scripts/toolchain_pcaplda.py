@@ -19,11 +19,10 @@
 
 import os
 import argparse
-import imp
 import subprocess
 from .. import utils
 
-def main():
+def main(argv=None):
   """PCA+PLDA toolchain"""
   parser = argparse.ArgumentParser(description=__doc__,
       formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -31,6 +30,8 @@ def main():
       dest='config_file', default='xbob/paper/tpami2013/config_lfw.py', help='Filename of the configuration file to use to run the script on the grid (defaults to "%(default)s")')
   parser.add_argument('--pca-n-outputs', metavar='INT', type=int,
      dest='pca_n_outputs', default=None, help='The rank of the PCA subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
+  parser.add_argument('--pca-n-outputs-sweep', metavar='INT', type=int, nargs='+',
+     dest='pca_n_outputs_sweep', default=None, help='If set, the PCA subspace is trained and the features projected only once (using the largest rank), and the PLDA toolchain is run for each of these ranks, on the leading columns of the projected features. The PLDA data of each rank are stored in the PLDA directory suffixed by the rank (e.g. \'plda-100\').')
   parser.add_argument('--plda-nf', metavar='INT', type=int,
      dest='plda_nf', default=0, help='The dimensionality of the F subspace. It will overwrite the value in the configuration file if any. Default is the value in the configuration file')
   parser.add_argument('--plda-ng', metavar='INT', type=int,
@@ -47,6 +48,10 @@ def main():
       dest='pca_model_filename', default=None, help='The (relative) filename of the PCA model. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is then appended to the given output directory, the protocol and the pca directory.')
   parser.add_argument('--eigenvalues', metavar='FILE', type=str,
       dest='eig_filename', default=None, help='The file for storing the eigenvalues.')
+  parser.add_argument('--skip-pca-training', dest='skip_pca_training', action='store_true',
+      default=False, help='If set, the PCA model is assumed to be already trained (e.g. by pca_train.py with the --protocols option), and the features are only projected.')
+  parser.add_argument('--pca-dependencies', metavar='INT', type=int, nargs='+',
+      dest='pca_dependencies', default=None, help='The ids of the grid jobs on which the PCA jobs depend (e.g. the job training the PCA models of several protocols at once, with --skip-pca-training).')
   parser.add_argument('--plda-dir', metavar='STR', type=str,
       dest='plda_dir', default=None, help='The subdirectory where the PLDA data are stored. It will overwrite the value in the configuration file if any. Default is the value in the configuration file. It is appended to the given output directory and the protocol.')
   parser.add_argument('--plda-model-filename', metavar='STR', type=str,
@@ -57,12 +62,13 @@ def main():
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_local_argument(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='It is currently not possible to paralellize this script, and hence useless for the time being.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.pca_n_outputs: pca_n_outputs = args.pca_n_outputs
   else: pca_n_outputs = config.pca_n_outputs
@@ -91,7 +97,6 @@ def main():
   # PCA features extraction
   cmd_pcafeatures = [
                      './bin/pca_features.py', 
-                     '--n-outputs=%d' % pca_n_outputs,
                      '--config-file=%s' % args.config_file, 
                      '--output-dir=%s' % args.output_dir,
                      '--features-dir=%s' % features_dir,
@@ -100,29 +105,45 @@ def main():
                      '--pca-model-filename=%s' % pca_model_filename,
                      '--protocol=%s' % protocol,
                     ]
+  if args.pca_n_outputs_sweep:
+    cmd_pcafeatures.append('--n-outputs-sweep')
+    cmd_pcafeatures.extend(['%d' % n for n in args.pca_n_outputs_sweep])
+  else: cmd_pcafeatures.append('--n-outputs=%d' % pca_n_outputs)
   if args.eig_filename: cmd_pcafeatures.append('--eigenvalues=%s' % args.eig_filename)
+  if args.skip_pca_training: cmd_pcafeatures.append('--skip-training')
+  if args.pca_dependencies:
+    cmd_pcafeatures.append('--dependencies')
+    cmd_pcafeatures.extend(['%d' % d for d in args.pca_dependencies])
   if args.force: cmd_pcafeatures.append('--force')
   if args.grid: cmd_pcafeatures.append('--grid')
+  if args.local > 0: cmd_pcafeatures.append('--local=%d' % args.local)
   subprocess.call(cmd_pcafeatures)
 
-  # PLDA toolchain
-  cmd_plda = [ 
-              './bin/toolchain_plda.py', 
-              '--config-file=%s' % args.config_file, 
-              '--nf=%d' % plda_nf,
-              '--ng=%d' % plda_ng,
-              '--output-dir=%s' % args.output_dir,
-              '--features-dir=%s' % os.path.join(args.output_dir,protocol, pca_dir, features_projected_dir),
-              '--plda-dir=%s' % plda_dir,
-              '--plda-model-filename=%s' % plda_model_filename,
-              '--protocol=%s' % protocol, 
-             ]
-  sgroups = ['--group']
-  sgroups.extend(groups)
-  cmd_plda.extend(sgroups)
-  if args.force: cmd_plda.append('--force')
-  if args.grid: cmd_plda.append('--grid')
-  subprocess.call(cmd_plda)
+  # PLDA toolchain (for each rank of the PCA subspace in case of a sweep)
+  features_projected_dir = os.path.join(args.output_dir, protocol, pca_dir, features_projected_dir)
+  if args.pca_n_outputs_sweep:
+    runs = [(utils.sweep_dir(features_projected_dir, n), utils.sweep_dir(plda_dir, n)) for n in sorted(set(args.pca_n_outputs_sweep))]
+  else:
+    runs = [(features_projected_dir, plda_dir)]
+  for (plda_features_dir, plda_run_dir) in runs:
+    cmd_plda = [ 
+                './bin/toolchain_plda.py', 
+                '--config-file=%s' % args.config_file, 
+                '--nf=%d' % plda_nf,
+                '--ng=%d' % plda_ng,
+                '--output-dir=%s' % args.output_dir,
+                '--features-dir=%s' % plda_features_dir,
+                '--plda-dir=%s' % plda_run_dir,
+                '--plda-model-filename=%s' % plda_model_filename,
+                '--protocol=%s' % protocol, 
+               ]
+    sgroups = ['--group']
+    sgroups.extend(groups)
+    cmd_plda.extend(sgroups)
+    if args.force: cmd_plda.append('--force')
+    if args.grid: cmd_plda.append('--grid')
+    if args.local > 0: cmd_plda.append('--local=%d' % args.local)
+    subprocess.call(cmd_plda)
 
 if __name__ == "__main__": 
   main()
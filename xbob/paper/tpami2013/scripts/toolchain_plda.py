@@ -18,13 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import math
-import imp
-import subprocess
 import argparse
 from .. import utils
 
-def main():
+def main(argv=None):
   """PLDA toolchain"""
 
   # Parses options
@@ -50,14 +47,21 @@ def main():
       dest='group', default=['dev','eval'], help='Database group (\'dev\' or \'eval\') for which to enroll models and compute scores.')
   parser.add_argument('-p', '--protocol', metavar='STR', type=str,
       dest='protocol', default=None, help='The protocol of the database to consider. It will overwrite the value in the configuration file if any. Default is the value in the configuration file.')
+  parser.add_argument('--batch', dest='batch', action='store_true',
+      default=False, help='If set, the PLDA scores of all the models sharing the same list of probes are computed at once with matrix operations.')
+  parser.add_argument('--model-bank', dest='model_bank', action='store_true',
+      default=False, help='If set, the PLDA models of each group are enrolled at once and saved into a single model bank file, which is then used for scoring (implies --batch).')
+  parser.add_argument('--probe-once', dest='probe_once', action='store_true',
+      default=False, help='If set, the probes are loaded only once for all the models scored by a job.')
   parser.add_argument('-f', '--force', dest='force', action='store_true',
       default=False, help='Force to erase former data if already exist')
+  utils.add_runner_arguments(parser)
   parser.add_argument('--grid', dest='grid', action='store_true',
       default=False, help='Run the script using the gridtk on an SGE infrastructure.')
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
 
   # Loads the configuration 
-  config = imp.load_source('config', args.config_file)
+  config = utils.load_config(args.config_file)
   # Update command line options if required
   if args.nf == 0: plda_nf = config.plda_nf
   else: plda_nf = args.nf
@@ -76,9 +80,7 @@ def main():
   else: groups = args.group
 
   # Let's create the job manager
-  if args.grid:
-    from gridtk.manager import JobManager
-    jm = JobManager()
+  (jm, grid) = utils.job_manager(args)
 
   # Trains the PLDABaseMachine
   cmd_pldabase = [ 
@@ -94,13 +96,13 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
   if args.force: cmd_pldabase.append('--force')
-  if args.grid: 
+  if grid: 
     cmd_pldabase.append('--grid')
     job_pldabase = utils.submit(jm, cmd_pldabase, dependencies=[], array=None, queue='q1d', mem='4G', hostname='!cicatrix')
     print('submitted: %s' % job_pldabase)
   else:
     print('Running PLDA training...')
-    subprocess.call(cmd_pldabase)
+    utils.run_command(cmd_pldabase, args.in_process)
 
   # Generates the models 
   job_enroll = []
@@ -117,24 +119,20 @@ def main():
                   '--protocol=%s' % protocol,
                  ]
     if args.force: cmd_enroll.append('--force')
-    if args.grid: 
+    if args.model_bank: cmd_enroll.append('--model-bank')
+    if grid: 
       cmd_enroll.append('--grid')
       job_enroll_int = utils.submit(jm, cmd_enroll, dependencies=[job_pldabase.id()], array=None, queue='q1d', mem='2G', hostname='!cicatrix')
       job_enroll.append(job_enroll_int.id())
       print('submitted: %s' % job_enroll_int)
     else:
       print('Running PLDA enrollment for %s...' % group)
-      subprocess.call(cmd_enroll)
+      utils.run_command(cmd_enroll, args.in_process)
 
   # Compute raw scores (and A matrix for ZT-Norm)
   job_scores = []
   for group in groups:
-    n_array_jobs = 0
-    model_ids = sorted(config.db.model_ids(protocol=protocol, groups=group))
-    for model_id in model_ids:
-      n_probes_for_model = len(config.db.objects(groups=group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
-      n_splits_for_model = int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
-      n_array_jobs += n_splits_for_model
+    n_array_jobs = utils.n_scoring_jobs(config, protocol, group, groups, args.output_dir, args.protocol_index)
     cmd_scores = [
                   './bin/plda_scores.py',
                   '--config-file=%s' % args.config_file, 
@@ -145,7 +143,11 @@ def main():
                   '--plda-model-filename=%s' % plda_model_filename,
                   '--protocol=%s' % protocol,
                  ]
-    if args.grid: 
+    if args.batch: cmd_scores.append('--batch')
+    if args.model_bank: cmd_scores.append('--model-bank')
+    if args.probe_once: cmd_scores.append('--probe-once')
+    if args.protocol_index: cmd_scores.append('--protocol-index')
+    if grid: 
       cmd_scores.append('--grid')
       deps = job_enroll
       job_scores_int = utils.submit(jm, cmd_scores, dependencies=deps, array=(1,n_array_jobs,1), queue='q1d', mem='3G', hostname='!cicatrix')
@@ -153,10 +155,10 @@ def main():
       print('submitted: %s' % job_scores_int)
     else:
       print('Running PLDA scoring for %s...' % group)
-      subprocess.call(cmd_scores)
+      utils.run_command(cmd_scores, args.in_process)
 
   # Concatenates the scores
-  if args.grid:
+  if grid:
     cmd_cat = [ 
                 './bin/concatenate_scores.py', 
                 '--config-file=%s' % args.config_file, 
@@ -168,5 +170,8 @@ def main():
     job_cat = utils.submit(jm, cmd_cat, dependencies=job_scores, array=None)
     print('submitted: %s' % job_cat)
 
+  # Runs the jobs locally if required
+  utils.run_local_jobs(jm, args)
+
 if __name__ == '__main__':
   main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the NumPy LBP histograms and Tan and Triggs preprocessing
+against naive (pixel by pixel) implementations, against reference outputs of
+bob 1.2, and against bob when it is available"""
+
+import os
+import math
+import unittest
+import numpy
+from . import lbp, tantriggs, facenorm
+
+try:
+  import bob
+except ImportError:
+  bob = None
+
+# Parameters of the Tan and Triggs preprocessing (gamma, sigma0, sigma1,
+# size, threshold, alpha)
+TT_PARAMS = (0.2, 1., 2., 2, 10., 0.1)
+
+# Reference outputs of bob 1.2, taken from the test data of facereclib 1.2.3:
+# a window of its test image around the face ('image', with the eye positions
+# 'eyes' as (rh, rw, lh, lw)), the 80x64 face cropped with the right eye at
+# (16, 15) and the left one at (16, 48) ('cropped'), this face preprocessed
+# by bob.ip.TanTriggs(0.2, 1., 2., 5, 10., 0.1) ('tan_triggs_cropped'), and
+# the circular LBP codes (radius 2, not uniform) of the 84x68 face cropped
+# with the eyes at (18, 17) and (18, 50) ('inorm_cropped')
+REFERENCE = os.path.join(os.path.dirname(__file__), 'testdata', 'bob12_preprocessing.npz')
+
+# Codes of the uniform LBP patterns, in the order of their labels (1 to 58),
+# as generated by bob::ip::LBP (the generator of bob 1.2 LBP8R)
+BOB_UNIFORM_CODES = [0, 128, 64, 32, 16, 8, 4, 2, 1, 192, 96, 48, 24, 12, 6,
+    3, 129, 224, 112, 56, 28, 14, 7, 131, 193, 240, 120, 60, 30, 15, 135, 195,
+    225, 248, 124, 62, 31, 143, 199, 227, 241, 252, 126, 63, 159, 207, 231,
+    243, 249, 254, 127, 191, 223, 239, 247, 251, 253, 255]
+
+def bilinear(img, y, x):
+  """Returns the value of an image at a (non-integer) position"""
+  y0 = int(math.floor(y))
+  x0 = int(math.floor(x))
+  fy = y - y0
+  fx = x - x0
+  if fy == 0. and fx == 0.:
+    return img[y0, x0]
+  return (1. - fy) * ((1. - fx) * img[y0, x0] + fx * img[y0, x0+1]) + fy * ((1. - fx) * img[y0+1, x0] + fx * img[y0+1, x0+1])
+
+def naive_lbp_code(img, y, x, radius, circular):
+  """Returns the 8-bit LBP code of a pixel, the first neighbour being the top
+     left one (most significant bit), and the next ones clockwise"""
+  directions = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+  code = 0
+  for (uy, ux) in directions:
+    if circular and uy != 0 and ux != 0: scale = radius / math.sqrt(2.)
+    else: scale = float(radius)
+    code = (code << 1) | int(bilinear(img, y + uy * scale, x + ux * scale) >= img[y, x])
+  return code
+
+def naive_lbphs(img, block_h, block_w, block_oh, block_ow, radius, circular, lut):
+  """Returns the concatenated LBP histograms of the blocks of an image, the
+     codes of a block being computed on the block only"""
+  if lut is None: n_bins = 256
+  else: n_bins = int(lut.max()) + 1
+  hists = []
+  for by in range(0, img.shape[0] - block_h + 1, block_h - block_oh):
+    for bx in range(0, img.shape[1] - block_w + 1, block_w - block_ow):
+      block = img[by:by+block_h, bx:bx+block_w]
+      hist = numpy.zeros(shape=(n_bins,), dtype=numpy.float64)
+      for y in range(radius, block_h - radius):
+        for x in range(radius, block_w - radius):
+          code = naive_lbp_code(block, y, x, radius, circular)
+          if lut is not None: code = lut[code]
+          hist[code] += 1
+      hists.append(hist)
+  return numpy.concatenate(hists)
+
+def naive_tantriggs(img, gamma, sigma0, sigma1, size, threshold, alpha):
+  """Returns the Tan and Triggs preprocessed image, the DoG filter being
+     computed with 2D kernels and mirrored borders"""
+  def mirror(i, n):
+    if i < 0: return -i - 1
+    if i >= n: return 2 * n - i - 1
+    return i
+  def blur(src, sigma):
+    k = tantriggs.gaussian_kernel(sigma, size)
+    k2 = numpy.outer(k, k)
+    (h, w) = src.shape
+    dst = numpy.zeros(shape=src.shape, dtype=numpy.float64)
+    for y in range(h):
+      for x in range(w):
+        for i in range(-size, size + 1):
+          for j in range(-size, size + 1):
+            dst[y, x] += k2[i+size, j+size] * src[mirror(y+i, h), mirror(x+j, w)]
+    return dst
+  img = numpy.power(img, gamma)
+  img = blur(img, sigma0) - blur(img, sigma1)
+  img = img / numpy.mean(numpy.abs(img) ** alpha) ** (1. / alpha)
+  img = img / numpy.mean(numpy.minimum(threshold, numpy.abs(img)) ** alpha) ** (1. / alpha)
+  return threshold * numpy.tanh(img / threshold)
+
+
+class LBPTest(unittest.TestCase):
+
+  def setUp(self):
+    rng = numpy.random.RandomState(0)
+    # Continuous values (no ties with the interpolated neighbours)
+    self.images = rng.rand(3, 17, 15) * 255.
+    # Grey levels (many ties between the neighbours and the centers)
+    self.grey_images = rng.randint(0, 4, size=(3, 17, 15)).astype(numpy.uint8)
+
+  def test_uniform_lut(self):
+    lut = lbp.uniform_lut(8)
+    transitions = [sum([((c >> i) & 1) != ((c >> ((i + 1) % 8)) & 1) for i in range(8)]) for c in range(256)]
+    uniform = [c for c in range(256) if transitions[c] <= 2]
+    self.assertEqual(len(uniform), 58)
+    # All the non-uniform patterns share the label 0, the uniform ones have
+    # distinct labels from 1 to 58
+    self.assertTrue(all([lut[c] == 0 for c in range(256) if transitions[c] > 2]))
+    self.assertEqual(sorted([int(lut[c]) for c in uniform]), list(range(1, 59)))
+    self.assertEqual(lut[0], 1)
+    self.assertEqual(lut[255], 58)
+
+  def test_uniform_lut_bob(self):
+    lut = lbp.uniform_lut(8)
+    self.assertEqual([int(lut[c]) for c in BOB_UNIFORM_CODES], list(range(1, 59)))
+
+  def reference_face(self):
+    """Returns the 84x68 face of the reference image, whose LBP codes were
+       computed with bob 1.2, after checking the cropping against bob 1.2"""
+    ref = numpy.load(REFERENCE)
+    image = ref['image'][numpy.newaxis].astype(numpy.float64)
+    eyes = ref['eyes'][numpy.newaxis]
+    cropped = facenorm.FaceEyesNorm(33, 80, 64, 16, 31.5)(image, eyes)
+    self.assertTrue(numpy.allclose(cropped[0], ref['cropped'], rtol=1e-8, atol=1e-8))
+    return (facenorm.FaceEyesNorm(33, 84, 68, 18, 33.5)(image, eyes), ref['inorm_cropped'].astype(numpy.int64))
+
+  def test_codes_reference(self):
+    (face, expected) = self.reference_face()
+    lbphs = lbp.LBPHS(84, 68, 0, 0, 2, 8, True, False, False, False, False)
+    codes = lbphs.codes(face)[0]
+    self.assertTrue(numpy.mean(codes == expected) > 0.999)
+    # A bit may only differ where the neighbour equals the center, up to the
+    # round-off of the interpolation
+    for (y, x) in numpy.argwhere(codes != expected):
+      diff = int(codes[y, x] ^ expected[y, x])
+      for (k, (dy, dx)) in enumerate(lbphs.offsets):
+        if (diff >> (7 - k)) & 1:
+          self.assertTrue(abs(bilinear(face[0], y + 2 + dy, x + 2 + dx) - face[0, y + 2, x + 2]) < 1e-2)
+
+  def test_lbphs_reference(self):
+    (face, expected) = self.reference_face()
+    # Histograms of the uniform labels of 16x16 blocks of the codes of bob
+    # 1.2, overlapping by 8 pixels (i.e. of the 20x20 blocks of the face,
+    # overlapping by 12 pixels)
+    bob_lut = numpy.zeros(shape=(256,), dtype=numpy.int64)
+    bob_lut[BOB_UNIFORM_CODES] = numpy.arange(1, 59)
+    labels = bob_lut[expected]
+    wrong = lbp.LBPHS(84, 68, 0, 0, 2, 8, True, False, False, False, False).codes(face)[0] != expected
+    hists = lbp.LBPHS(20, 20, 12, 12, 2, 8, True, False, False, True, False)(face)[0].reshape(-1, 59)
+    b = 0
+    for by in range(0, 80 - 16 + 1, 8):
+      for bx in range(0, 64 - 16 + 1, 8):
+        ref = numpy.bincount(labels[by:by+16, bx:bx+16].flatten(), minlength=59)
+        # The codes differing from the ones of bob (see test_codes_reference)
+        # move a sample from a bin to another one
+        self.assertTrue(numpy.abs(hists[b] - ref).sum() <= 2 * wrong[by:by+16, bx:bx+16].sum())
+        b += 1
+    self.assertEqual(b, hists.shape[0])
+
+  def check_lbphs(self, images, block_h, block_w, block_oh, block_ow, radius, circular, uniform):
+    lbphs = lbp.LBPHS(block_h, block_w, block_oh, block_ow, radius, 8, circular, False, False, uniform, False)
+    hists = lbphs(images)
+    self.assertEqual(hists.shape, (images.shape[0], lbphs.n_features(images.shape[1], images.shape[2])))
+    for i in range(images.shape[0]):
+      ref = naive_lbphs(images[i].astype(numpy.float64), block_h, block_w, block_oh, block_ow, radius, circular, lbphs.lut)
+      self.assertTrue(numpy.array_equal(hists[i], ref))
+
+  def test_lbphs_circular(self):
+    self.check_lbphs(self.images, 8, 7, 4, 3, 1, True, True)
+    self.check_lbphs(self.images, 9, 9, 0, 0, 2, True, False)
+
+  def test_lbphs_square(self):
+    self.check_lbphs(self.images, 8, 7, 4, 3, 2, False, True)
+    self.check_lbphs(self.grey_images, 6, 5, 2, 1, 1, False, True)
+    self.check_lbphs(self.grey_images, 9, 9, 0, 0, 2, False, False)
+
+  @unittest.skipIf(bob is None, "bob is not available")
+  def test_lbphs_bob(self):
+    params = (8, 7, 4, 3, 1, 8, True, False, False, True, False)
+    lbphs_bob = bob.ip.LBPHSFeatures(*params)
+    hists = lbp.LBPHS(*params)(self.images)
+    for i in range(self.images.shape[0]):
+      ref = numpy.concatenate([numpy.asarray(b, dtype=numpy.float64) for b in lbphs_bob(self.images[i])])
+      self.assertTrue(numpy.array_equal(hists[i], ref))
+
+
+class TanTriggsTest(unittest.TestCase):
+
+  def setUp(self):
+    rng = numpy.random.RandomState(0)
+    self.images = rng.randint(0, 256, size=(2, 12, 10)).astype(numpy.float64)
+    self.tt = tantriggs.TanTriggs(*TT_PARAMS)
+
+  def test_preprocessing(self):
+    preprocessed = self.tt(self.images)
+    for i in range(self.images.shape[0]):
+      ref = naive_tantriggs(self.images[i], *TT_PARAMS)
+      self.assertTrue(numpy.allclose(preprocessed[i], ref, rtol=1e-10, atol=1e-10))
+
+  def test_uint8_rounding(self):
+    threshold = TT_PARAMS[4]
+    preprocessed = self.tt(self.images)
+    out = numpy.ndarray(shape=self.images.shape, dtype=numpy.uint8)
+    self.tt(self.images, out)
+    # Nearest grey level of [-threshold, threshold] mapped onto [0, 255]
+    ref = numpy.rint((preprocessed + threshold) / (2. * threshold) * 255.)
+    self.assertTrue(numpy.array_equal(out, ref.astype(numpy.uint8)))
+
+  def test_preprocessing_reference(self):
+    ref = numpy.load(REFERENCE)
+    threshold = 10.
+    tt = tantriggs.TanTriggs(0.2, 1., 2., 5, threshold, 0.1)
+    cropped = ref['cropped'][numpy.newaxis]
+    self.assertTrue(numpy.allclose(tt(cropped)[0], ref['tan_triggs_cropped'], rtol=1e-10, atol=1e-10))
+    out = numpy.ndarray(shape=cropped.shape, dtype=numpy.uint8)
+    tt(cropped, out)
+    expected = numpy.rint((ref['tan_triggs_cropped'] + threshold) / (2. * threshold) * 255.)
+    self.assertTrue(numpy.array_equal(out[0], expected.astype(numpy.uint8)))
+
+  @unittest.skipIf(bob is None, "bob is not available")
+  def test_preprocessing_bob(self):
+    tt_bob = bob.ip.TanTriggs(*TT_PARAMS)
+    preprocessed = self.tt(self.images)
+    ref = numpy.ndarray(shape=self.images.shape[1:], dtype=numpy.float64)
+    for i in range(self.images.shape[0]):
+      tt_bob(self.images[i], ref)
+      self.assertTrue(numpy.allclose(preprocessed[i], ref, rtol=1e-8, atol=1e-8))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+# Laurent El Shafey <Laurent.El-Shafey@idiap.ch>
+#
+# Copyright (C) 2011-2013 Idiap Research Institute, Martigny, Switzerland
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of the batched PLDA enrollment and scoring against the PLDAMachine
+of bob"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+try:
+  import bob
+  from . import plda
+except ImportError:
+  bob = None
+
+def random_pldabase(dim_d=7, dim_f=3, dim_g=2, seed=0):
+  """Returns a PLDABase with random parameters"""
+  rng = numpy.random.RandomState(seed)
+  pldabase = bob.machine.PLDABase(dim_d, dim_f, dim_g)
+  pldabase.mu = rng.randn(dim_d)
+  pldabase.f = rng.randn(dim_d, dim_f)
+  pldabase.g = rng.randn(dim_d, dim_g)
+  pldabase.sigma = rng.rand(dim_d) + 0.5
+  return pldabase
+
+def random_identities(dim_d, n_samples, seed=1):
+  """Returns a list of 2D arrays (one per identity, one sample per row)"""
+  rng = numpy.random.RandomState(seed)
+  return [rng.randn(n, dim_d) for n in n_samples]
+
+
+@unittest.skipIf(bob is None, "bob is not available")
+class PLDABatchTest(unittest.TestCase):
+
+  def setUp(self):
+    self.pldabase = random_pldabase()
+    # Identities with different numbers of enrollment samples
+    self.data_list = random_identities(self.pldabase.dim_d, [1, 3, 2, 3, 1])
+    self.machines = [plda.enroll_model(data, self.pldabase) for data in self.data_list]
+    self.probes = numpy.random.RandomState(2).randn(6, self.pldabase.dim_d)
+
+  def test_enroll_models_batch(self):
+    (n_samples, weighted_sums, offsets) = plda.enroll_models_batch(self.data_list, self.pldabase)
+    (n_samples_ref, weighted_sums_ref, offsets_ref) = plda.model_statistics(self.machines)
+    self.assertTrue(numpy.array_equal(n_samples, n_samples_ref))
+    self.assertTrue(numpy.allclose(weighted_sums, weighted_sums_ref, rtol=1e-10, atol=1e-10))
+    self.assertTrue(numpy.allclose(offsets, offsets_ref, rtol=1e-10, atol=1e-10))
+
+  def test_compute_scores_batch(self):
+    scores_ref = numpy.array([[m.forward(p) for p in self.probes] for m in self.machines])
+    # From the enrolled PLDAMachines
+    scores = plda.compute_scores_batch(self.pldabase, *(plda.model_statistics(self.machines) + (self.probes,)))
+    self.assertTrue(numpy.allclose(scores, scores_ref, rtol=1e-10, atol=1e-10))
+    # From the batched enrollment
+    scores = plda.compute_scores_batch(self.pldabase, *(plda.enroll_models_batch(self.data_list, self.pldabase) + (self.probes,)))
+    self.assertTrue(numpy.allclose(scores, scores_ref, rtol=1e-10, atol=1e-10))
+
+  def test_model_bank(self):
+    # Model ids longer than 64 characters
+    model_ids = ['%d%s' % (k, 'x' * 100) for k in range(len(self.data_list))]
+    (n_samples, weighted_sums, offsets) = plda.enroll_models_batch(self.data_list, self.pldabase)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tmp_dir, 'model_bank.npy')
+      plda.save_model_bank(filename, model_ids, n_samples, weighted_sums, offsets)
+      bank = plda.load_model_bank(filename)
+      self.assertEqual(list(bank['id']), model_ids)
+      (n_samples_b, weighted_sums_b, offsets_b) = plda.model_bank_statistics(bank, model_ids[::-1])
+      self.assertTrue(numpy.array_equal(n_samples_b, n_samples[::-1]))
+      self.assertTrue(numpy.array_equal(weighted_sums_b, weighted_sums[::-1]))
+      self.assertTrue(numpy.array_equal(offsets_b, offsets[::-1]))
+      del bank
+    finally:
+      shutil.rmtree(tmp_dir)
@@ -21,6 +21,7 @@ import math
 import numpy
 import bob
 import sys
+import subprocess
 
 def ensure_dir(dirname):
   """ Creates the directory dirname if it does not already exist,
@@ -48,19 +49,167 @@ def erase_if_exists(filename):
       else: raise
 
 
+def link_dir(target, link):
+  """ Makes the directory link point to the (existing or not) directory
+      target, taking into account concurrent 'creation' on the grid.
+      A link pointing elsewhere is replaced, whereas an exception is thrown
+      if a real directory (or file) already exists. """
+  ensure_dir(target)
+  target = os.path.abspath(target)
+  if os.path.islink(link):
+    if os.path.realpath(link) == os.path.realpath(target): return
+    os.remove(link)
+  elif os.path.exists(link):
+    raise RuntimeError("Cannot link '%s' to '%s', since it already exists and is not a link" % (link, target))
+  ensure_dir(os.path.dirname(os.path.abspath(link)))
+  try:
+    os.symlink(target, link)
+  except OSError:
+    # Checks that the link has been created (in case of concurrent creation)
+    if os.path.realpath(link) == os.path.realpath(target): pass
+    else: raise
+
+def sweep_dir(dirname, n_outputs):
+  """Returns the name of the directory associated with the given
+     dimensionality in a sweep (e.g. over the rank of a PCA subspace)"""
+  return '%s-%d' % (dirname.rstrip(os.sep), n_outputs)
+
+
 def check_string(var):
   """Make sure that the passed argument is a tuple or a list"""
   from six import string_types
   return isinstance(var, string_types)
 
 
+class CachedDatabase(object):
+  """Wraps a database, such that the results of its queries (objects,
+     model_ids, etc.) are only computed once. Copies of the lists are
+     returned, since they are often sorted in place."""
+
+  def __init__(self, db):
+    self._db = db
+    self._queries = {}
+
+  def _freeze(self, value):
+    if isinstance(value, (list, tuple)):
+      return tuple([self._freeze(v) for v in value])
+    return value
+
+  def _query(self, name, *args, **kwargs):
+    key = (name, self._freeze(args), tuple(sorted([(k, self._freeze(v)) for k, v in kwargs.items()])))
+    if not key in self._queries:
+      self._queries[key] = getattr(self._db, name)(*args, **kwargs)
+    res = self._queries[key]
+    if isinstance(res, list): return list(res)
+    return res
+
+  def objects(self, *args, **kwargs):
+    return self._query('objects', *args, **kwargs)
+
+  def model_ids(self, *args, **kwargs):
+    return self._query('model_ids', *args, **kwargs)
+
+  def clients(self, *args, **kwargs):
+    return self._query('clients', *args, **kwargs)
+
+  def __getattr__(self, name):
+    return getattr(self._db, name)
+
+
+# Configurations already loaded in this process
+_configs = {}
+
+def load_config(config_file):
+  """Loads a configuration file. Each file is only loaded once per process
+     (which avoids recreating its database), and the queries to its database
+     are cached."""
+  if not config_file in _configs:
+    import imp
+    config = imp.load_source('config_%d' % len(_configs), config_file)
+    if hasattr(config, 'db'): config.db = CachedDatabase(config.db)
+    _configs[config_file] = config
+  return _configs[config_file]
+
+
+# In-memory cache of the data loaded from files (disabled by default). It
+# keeps at most CACHE_MAX_ENTRIES files and CACHE_MAX_BYTES bytes of arrays,
+# the least recently used files being evicted first.
+CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_BYTES = 1 << 30
+_cache = None
+_cache_bytes = 0
+
+def enable_cache():
+  """Keeps the data (features, models and machines) loaded from files in
+     memory, such that the stages run successively in the same process do
+     not reload them."""
+  global _cache
+  if _cache is None:
+    import collections
+    _cache = collections.OrderedDict()
+
+def _nbytes(value):
+  """Returns the size of the arrays of a cached value (the other objects,
+     such as machines and indices, are small and are only bounded by the
+     number of entries)"""
+  if isinstance(value, numpy.ndarray):
+    return value.nbytes
+  if isinstance(value, (list, tuple)):
+    return sum([_nbytes(v) for v in value])
+  return 0
+
+def cached_load(filename, loader):
+  """Loads a file using the given function, or retrieves it from the cache
+     if enabled. Cached entries are invalidated when the file is modified."""
+  global _cache_bytes
+  if _cache is None:
+    return loader(filename)
+  key = (filename, loader)
+  mtime = os.path.getmtime(filename)
+  if key in _cache and _cache[key][0] == mtime:
+    # Moves the entry to the end (most recently used)
+    entry = _cache.pop(key)
+  else:
+    if key in _cache:
+      _cache_bytes -= _cache.pop(key)[2]
+    value = loader(filename)
+    entry = (mtime, value, _nbytes(value))
+    if entry[2] > CACHE_MAX_BYTES:
+      # Too large to be cached
+      return value
+    _cache_bytes += entry[2]
+    while len(_cache) >= CACHE_MAX_ENTRIES or (_cache_bytes > CACHE_MAX_BYTES and len(_cache) > 0):
+      _cache_bytes -= _cache.popitem(last=False)[1][2]
+  _cache[key] = entry
+  return entry[1]
+
+def run_command(command, in_process=False):
+  """Runs one of the scripts of this package, given as a './bin/<script>.py'
+     command line, either as a separate process, or by calling its main
+     function in the current process. In the latter case, the configuration,
+     database queries and loaded data are kept in memory between calls."""
+  if not in_process:
+    return subprocess.call(command)
+  import importlib
+  name = os.path.splitext(os.path.basename(command[0]))[0]
+  module = importlib.import_module(__name__.rsplit('.', 1)[0] + '.scripts.' + name)
+  enable_cache()
+  module.main(command[1:])
+  return 0
+
+
 def submit(job_manager, command, dependencies=[], array=None, queue=None, mem=None, hostname=None, pe_opt=None):
   """Submits one job using our specialized shell wrapper. We hard-code certain
   parameters we like to use. You can change general submission parameters
   directly at this method."""
 
-  from gridtk.tools import make_shell, random_logdir
   name = os.path.splitext(os.path.basename(command[0]))[0]
+  from . import local
+  if isinstance(job_manager, local.JobManager):
+    # Local execution: the grid specific parameters are ignored
+    return job_manager.submit([sys.executable] + command, deps=dependencies, array=array, name=name)
+
+  from gridtk.tools import make_shell, random_logdir
   logdir = os.path.join('logs', random_logdir())
   use_command = make_shell(sys.executable, command)
   return job_manager.submit(use_command, deps=dependencies, cwd=True,
@@ -68,14 +217,65 @@ def submit(job_manager, command, dependencies=[], array=None, queue=None, mem=No
       stdout=logdir, stderr=logdir, name=name, array=array)
 
 
+def add_local_argument(parser):
+  """Adds the --local option, to run the jobs on the local machine"""
+  parser.add_argument('--local', metavar='INT', type=int,
+      dest='local', default=0, help='If strictly positive, runs the jobs on the local machine using this number of parallel processes, splitting them as on the SGE grid.')
+
+def add_runner_arguments(parser):
+  """Adds the options of the toolchains selecting how their stages are run
+     (without the --grid option)"""
+  parser.add_argument('--protocol-index', dest='protocol_index', action='store_true',
+      default=False, help='If set, the index of the protocol is built once (if not already saved into the output directory), and the scoring jobs retrieve their models and probes from it, rather than by querying the database.')
+  parser.add_argument('--in-process', dest='in_process', action='store_true',
+      default=False, help='If set (and if not using the grid), each stage is run by calling its main function in the current process, rather than in a separate process, which keeps the configuration, database queries, features and machines in memory between stages.')
+  add_local_argument(parser)
+
+def job_manager(args):
+  """Returns the job manager given by the --grid and --local options (None
+     if the jobs are run one after the other), and whether the jobs are
+     split and submitted to it. The jobs are split in the same way, whether
+     they run on the grid or locally."""
+  if args.grid:
+    from gridtk.manager import JobManager
+    return (JobManager(), True)
+  if args.local > 0:
+    from . import local
+    return (local.JobManager(args.local), True)
+  return (None, False)
+
+def run_local_jobs(job_manager, args):
+  """Runs the jobs submitted to the local job manager, if any"""
+  if args.local > 0 and not job_manager.run():
+    raise RuntimeError("Some of the local jobs failed (see the logs in '%s')." % job_manager.logdir)
+
+def n_scoring_jobs(config, protocol, group, groups, output_dir, use_protocol_index=False):
+  """Returns the number of (array) jobs computing the scores of a group,
+     each of them scoring at most 'n_max_probes_per_job' probes of a model"""
+  if use_protocol_index:
+    from . import protocol_index
+    index = protocol_index.get(config.db, protocol, os.path.join(output_dir, protocol, config.protocol_index_filename), groups=groups)
+    return len(index.task_map(group, config.n_max_probes_per_job))
+  n_array_jobs = 0
+  model_ids = sorted(config.db.model_ids(protocol=protocol, groups=group))
+  for model_id in model_ids:
+    n_probes_for_model = len(config.db.objects(groups=group, protocol=protocol, purposes='probe', model_ids=(model_id,)))
+    n_array_jobs += int(math.ceil(n_probes_for_model / float(config.n_max_probes_per_job)))
+  return n_array_jobs
+
+
 def load_data(filenames, features_dir, features_ext):
   """Loads the data (arrays) from a list of filenames, and put them in a
      2D NumPy array."""
+  # Loads from a feature store if any
+  from . import featurestore
+  if featurestore.is_feature_store(features_dir):
+    return featurestore.open_store(features_dir).load([kf.path for kf in filenames])
   # Loads files
   data = []
   for kf in filenames:
     # Loads the file
-    feat = bob.io.load( str(kf.make_path(directory=features_dir, extension=features_ext)) )
+    feat = cached_load(str(kf.make_path(directory=features_dir, extension=features_ext)), bob.io.load)
     # Appends in the arrayset
     data.append(feat)
   # Returns the Arrayset
@@ -85,6 +285,11 @@ def load_data(filenames, features_dir, features_ext):
 def load_data_by_client(filenames_by_client, features_dir, features_ext):
   """Loads the data (arrays) from a list of list of filenames, 
      one list for each client, and put them in a list of Arraysets."""
+  # Loads from a feature store if any
+  from . import featurestore
+  if featurestore.is_feature_store(features_dir):
+    store = featurestore.open_store(features_dir)
+    return [store.load([kf.path for kf in kc]) for kc in filenames_by_client]
   # Initializes an arrayset for the data
   data = []
   for kc in filenames_by_client:
@@ -92,7 +297,7 @@ def load_data_by_client(filenames_by_client, features_dir, features_ext):
     data_client = []
     for kf in kc:
       # Loads the file
-      img = bob.io.load( str(kf.make_path(directory=features_dir, extension=features_ext) ) )
+      img = cached_load(str(kf.make_path(directory=features_dir, extension=features_ext)), bob.io.load)
       # Appends in the arrayset
       data_client.append(img)
     data.append(numpy.vstack(data_client))
@@ -105,22 +310,80 @@ def enroll_mean_model(data):
   return data.mean(axis=0)
 
 
-def compute_distance_scores(model, probe_tests, distance):
-  """Compute scores between a model and probe samples using a distance"""
-  A = numpy.ndarray(shape=(len(probe_tests),), dtype=numpy.float64)
-  import scipy.spatial.distance
+DISTANCES = ('euclidean', 'cosine', 'chi_square')
+# Maximum number of elements of all the temporary arrays used when computing
+# distances by blocks (2^24 float64 elements, i.e. 128MB)
+DISTANCE_BLOCK_ELEMENTS = 2**24
+
+def _euclidean_block(models, probes):
+  """Euclidean distances between all the rows of two 2D arrays"""
+  d = numpy.dot(models, probes.T)
+  d *= -2.
+  d += (models ** 2).sum(axis=1)[:,numpy.newaxis]
+  d += (probes ** 2).sum(axis=1)[numpy.newaxis,:]
+  # Rounding errors may lead to (small) negative values
+  numpy.maximum(d, 0., d)
+  return numpy.sqrt(d, d)
+
+def _cosine_block(models, probes):
+  """Cosine distances between all the rows of two 2D arrays"""
+  d = numpy.dot(models, probes.T)
+  # (the norm of an all-zero vector is replaced by a tiny value, such that its
+  # distance to any vector is 1)
+  tiny = numpy.finfo(numpy.float64).tiny
+  d /= numpy.maximum(numpy.sqrt((models ** 2).sum(axis=1)), tiny)[:,numpy.newaxis]
+  d /= numpy.maximum(numpy.sqrt((probes ** 2).sum(axis=1)), tiny)[numpy.newaxis,:]
+  return 1. - d
+
+def _chi_square_block(models, probes):
+  """Chi-square distances between all the rows of two 2D arrays (the terms
+     for which both histograms are zero are ignored, as in bob.math.chi_square)"""
+  diff = models[:,numpy.newaxis,:] - probes[numpy.newaxis,:,:]
+  summ = models[:,numpy.newaxis,:] + probes[numpy.newaxis,:,:]
+  diff **= 2
+  summ[summ == 0] = 1.
+  diff /= summ
+  return diff.sum(axis=2)
+
+def compute_distance_scores_batch(models, probe_tests, distance, block_size=None):
+  """Compute scores between one or several (mean) models and a 2D array of
+     probe samples (one per row) using a distance. The scores are the
+     opposite of the distances, and are returned as a (n_models x n_probes)
+     2D array, or as a 1D array if a single 1D model is given. The probes
+     are processed by blocks of block_size samples, which is by default
+     chosen such that the temporary arrays remain of bounded size."""
   if distance == 'euclidean':
-    dist = scipy.spatial.distance.euclidean
+    kernel = _euclidean_block
   elif distance == 'chi_square':
-    dist = bob.math.chi_square
+    kernel = _chi_square_block
   elif distance == 'cosine':
-    dist = scipy.spatial.distance.cosine
+    kernel = _cosine_block
   else:
     raise RuntimeError("Unknow distance '%s' for computing scores." % distance)
-  for i in range(len(probe_tests)):
-    A[i] = -dist(model, probe_tests[i])
+  models = numpy.asarray(models, dtype=numpy.float64)
+  probe_tests = numpy.asarray(probe_tests, dtype=numpy.float64)
+  single = (models.ndim == 1)
+  models = numpy.atleast_2d(models)
+  if not block_size:
+    # Number of elements of the temporary arrays per probe: the chi-square
+    # kernel allocates two (n_models x block x dim) float64 arrays and a
+    # boolean mask of the same shape (counted as a third array), whereas
+    # the other ones allocate the (n_models x block) distances and the
+    # (block x dim) squared probes
+    if distance == 'chi_square': n_per_probe = 3 * models.shape[0] * models.shape[1]
+    else: n_per_probe = models.shape[0] + probe_tests.shape[1]
+    block_size = max(1, DISTANCE_BLOCK_ELEMENTS // max(1, n_per_probe))
+  A = numpy.ndarray(shape=(models.shape[0], probe_tests.shape[0]), dtype=numpy.float64)
+  for b in range(0, probe_tests.shape[0], block_size):
+    A[:,b:b+block_size] = kernel(models, probe_tests[b:b+block_size])
+  A *= -1.
+  if single: return A[0]
   return A
 
+def compute_distance_scores(model, probe_tests, distance):
+  """Compute scores between a model and probe samples using a distance"""
+  return compute_distance_scores_batch(model, numpy.vstack(probe_tests), distance)
+
 
 def save_machine(machine, output_filename):
   """Saves a machine into an HDF5File"""
@@ -137,7 +400,7 @@ def load_model(input_filename):
   """Loads a mean model fron an HDF5File"""
   if not os.path.exists(input_filename):
     raise RuntimeError("Cannot find model %s" % (input_filename))
-  return bob.io.load(input_filename)
+  return cached_load(input_filename, bob.io.load)
 
 
 def split_list(input_list, nb_unit_per_sublist):
@@ -153,16 +416,42 @@ def split_list(input_list, nb_unit_per_sublist):
 def load_probes(probe_objects, features_dir, features_ext):
   """Loads the probes from a list of Database.objects, returns them,
      as well as their corresponding client_ids."""
+  # Loads from a feature store if any
+  from . import featurestore
+  if featurestore.is_feature_store(features_dir):
+    probe_tests = featurestore.open_store(features_dir).load([k.path for k in probe_objects])
+    return (probe_tests, [k.client_id for k in probe_objects])
   # Loads files
   probe_tests = []
   probe_clients_ids = []
   for k in probe_objects:
-    p = bob.io.load(str(k.make_path(directory=features_dir, extension=features_ext)))
+    p = cached_load(str(k.make_path(directory=features_dir, extension=features_ext)), bob.io.load)
     probe_tests.append(p)
     probe_clients_ids.append(k.client_id)
   return (probe_tests,probe_clients_ids)
 
 
+def load_probe_union(probe_lists, features_dir, features_ext):
+  """Loads the union of several lists of probes (Database.objects) at once,
+     such that each probe is only read a single time. Returns the 2D array
+     of the (distinct) probes, as well as an index array for each list,
+     giving the rows of its probes in the array."""
+  rows = {}
+  union = []
+  indices = []
+  for probe_objects in probe_lists:
+    index = numpy.ndarray(shape=(len(probe_objects),), dtype=numpy.int64)
+    for i, k in enumerate(probe_objects):
+      path = str(k.path)
+      if not path in rows:
+        rows[path] = len(union)
+        union.append(k)
+      index[i] = rows[path]
+    indices.append(index)
+  (probe_tests, probe_clients_ids) = load_probes(union, features_dir, features_ext)
+  return (numpy.vstack(probe_tests), indices)
+
+
 def save_scores_to_textfile(scores, probe_filenames, model_id, output_filename, append=False):
   """Saves an array of scores associated to some probe_objects, into an ASCII file
      with the four column format."""